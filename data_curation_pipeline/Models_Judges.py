@@ -1,18 +1,14 @@
 import sys
 import os
-import json
-from tqdm import tqdm
-sys.path.append('.')
-from lmms_eval.tasks.pope.utils import pope_process_results
-from collections import defaultdict
-import matplotlib.pyplot as plt
 import re
-from collections import Counter
+sys.path.append('.')
+from score_matrix import ScoreMatrix
 task='ai2d'
+metric='exact_match'
+models=['llava1.5_7b','llava1.5_13b','llava1.6','llava_llama3_8b','xcomposer2_4khd','minicpm','instructblip','idefics2','internvl']
 
 task_type=task.split('_')[0]
 print(task_type)
-all_model_result={}
 log_path='./logs'
 all_task_path=[]
 for entry in os.listdir(log_path):
@@ -35,22 +31,16 @@ for path in all_task_path:
         model = match.group(1)
     else:
         continue
+    if model not in models:
+        continue
     for root, dirs, files in os.walk(path):
         for file in files:
-            if task in file:
-                coco_file[model]=os.path.join(path, file)
-result_dic = defaultdict(dict)
+            # logs are read through their index, which points to the small per-rank score files of every format
+            if file == f'{task}.index.json':
+                coco_file[model]=os.path.join(root, file)
+            elif task in file and file.endswith('.json') and not file.endswith('.index.json') and model not in coco_file:
+                coco_file[model]=os.path.join(root, file)
 
-for model,process_file in coco_file.items():
-    if model not in ['llava1.5_7b','llava1.5_13b','llava1.6','llava_llama3_8b','xcomposer2_4khd','minicpm','instructblip','idefics2','internvl']:
-        continue
-    with open(process_file) as file:
-        json_file=json.load(file)
-        result=json_file['logs']
-        for item in tqdm(result):
-            doc=item['doc']
-            question_id=item['doc_id']
-            score=item['exact_match']
-            result_dic[question_id][model]=score
-with open('static_result/result_ai2d_new.json', 'w') as json_file:
-    json.dump(result_dic, json_file, indent=4)
\ No newline at end of file
+score_matrix = ScoreMatrix.from_logs(coco_file, metric)
+score_matrix.save(f'static_result/result_{task}_new.npz')
+print(f'{len(score_matrix.question_ids)} questions x {len(score_matrix.models)} models')
@@ -1,44 +1,28 @@
-import json
+import sys
+sys.path.append('.')
+from score_matrix import ScoreMatrix
 def filter_func(task_path,threshold=1.0):
     '''
         param:
-            task_path:统计结果路径
+            task_path:统计结果路径 (.npz score matrix, or the legacy nested json)
             Threshold:统计分数的阈值
         return:
             filter_list:需要double check的题目信息  
     '''
-    filter_list=[]
-    with open(task_path) as json_file:
-        data=json.load(json_file)
-        for k,model_scores in data.items():
-            model_scores=list(model_scores.values())
-            count = sum(1 for x in model_scores if x >= threshold)
-            if count==0:filter_list.append(k)
-    return filter_list
+    return ScoreMatrix.load(task_path).unsolved(threshold).tolist()
 
 def difficult_filter_func(task_path,threshold=1.0):
     '''
         param:
-            task_path:统计结果路径
+            task_path:统计结果路径 (.npz score matrix, or the legacy nested json)
             Threshold:统计分数的阈值
         return:
             easy_list:标记为easy的question
             middle_list:标记为middle的question
             hard_list:标记为hard的question
     '''
-    easy_list=[]
-    middle_list=[]
-    hard_list=[]
-    with open(task_path) as json_file:
-        data=json.load(json_file)
-        for k,model_scores in data.items():
-            model_scores=list(model_scores.values())
-            count = sum(1 for x in model_scores if x >= threshold)
-            if 0<count<3:hard_list.append(k)
-            elif 3<=count<5:middle_list.append(k)
-            elif 5<=count<=9:easy_list.append(k)
-            # elif count==9:easy_list.append(k)
-    return easy_list,middle_list,hard_list
+    easy,middle,hard=ScoreMatrix.load(task_path).difficulty_split(threshold)
+    return easy.tolist(),middle.tolist(),hard.tolist()
 
 
 if __name__=='__main__':
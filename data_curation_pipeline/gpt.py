@@ -1,17 +1,34 @@
 from openai import OpenAI
 import base64
+import threading
 API_KEY = 'your_api_key'
 BASE_URL = 'url_path'
+MODEL = 'gpt-4-vision-preview'
+
+# one client for all requests, it keeps a pool of http connections and is safe to share between threads
+_client = None
+_client_lock = threading.Lock()
 
 def load_model(model_path="GPT4V"):
     tokenizer = "GPT4V"
     model = "GPT4V"
     return tokenizer, model
 
+def get_client(base_url=None, api_key=None):
+    '''
+        Returns the shared client. Passing base_url/api_key (e.g. a local mock endpoint) replaces it.
+        Retries are left to the caller (RequestEngine), so the client never retries on its own.
+    '''
+    global _client
+    with _client_lock:
+        if _client is None or base_url is not None or api_key is not None:
+            _client = OpenAI(base_url=base_url or BASE_URL, api_key=api_key or API_KEY, max_retries=0)
+        return _client
+
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
-    
+
 def make_content(text, image_paths):
     text_elem = {
         "type": "text",
@@ -30,15 +47,26 @@ def make_content(text, image_paths):
         content.append(image_elem)
     return content
 
-def request(prompt, image_paths, timeout=60, max_tokens=1000):
-    client = OpenAI(
-        base_url=BASE_URL,
-        api_key=API_KEY,
+def request_content(content, timeout=60, max_tokens=1000):
+    '''Sends already built content (see make_content), raises on failure so that it can be retried.'''
+    response = get_client().chat.completions.create(
+        model=MODEL,
+        messages=[
+            {
+                "role": "user",
+                "content": content,
+            }
+        ],
+        max_tokens=max_tokens,
+        timeout=timeout,
     )
+    return response.choices[0].message.content
+
+def request(prompt, image_paths, timeout=60, max_tokens=1000):
     print(prompt)
     #print(image_paths)
-    response = client.chat.completions.create(
-        model="gpt-4-vision-preview",
+    response = get_client().chat.completions.create(
+        model=MODEL,
         messages=[
             {
                 "role": "user",
@@ -59,4 +87,4 @@ def infer(text, images):
         print(response)
     #print(images)
     #response = request(text, images).choices[0].message.content
-    return response
\ No newline at end of file
+    return response
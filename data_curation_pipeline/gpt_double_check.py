@@ -1,97 +1,168 @@
-from gpt import *
+import argparse
+import hashlib
 import json
 import os
 import re
+import sys
+sys.path.append('.')
+import gpt
+from filter_func import filter_func
+from lmms_eval.api.request_engine import RequestEngine
+from lmms_eval.api.sample_log import iter_samples
+
+PROMPT = '''
+                Instruction: Please judge whether the <Answer> is the golden answer to the <Question>.
+                If it is, please reply YES, otherwise reply NO.
+                <Question>: {question}
+                <Answer>: {answer}
+                <Your judgement>: <YES or NO>
+                '''
+# PROMPT = '''
+#                 Now there is an image captioning task.
+#                 Please first describe the content of the image, then compare the image content with the provided captions.
+#                 If the captions are suitable as captions for the image, please answer YES; if they are not suitable, please answer NO.
+#                 Respond with NO if any of the captions are unsuitable. Respond with YES only if all captions are suitable. You only need to reply with either YES or NO in <Your judgement>.
+#                 <Captions>: {answer}
+#                 <Desciption>: <Content of the image>
+#                 <Your judgement>: <ONLY YES or NO>
+#                 '''
+
 def load_json(path):
     ret = []
     with open(path,'r') as f:
         ret = json.load(f)
     return ret
 
-def get_file_names(directory):
-    # 获取指定目录下的所有文件和文件夹的名称
-    file_names = os.listdir(directory)
-    # 过滤掉目录，只保留文件
-    file_names = [f for f in file_names if os.path.isfile(os.path.join(directory, f))]
-    return file_names
+def extract_judgement(sentence):
+    match = re.search(r'<Your judgement>:\s*(YES|NO)', sentence)
+    if match:
+        return match.group(1)
+    return None
+
+def question_id_of(log, id_key='question_id'):
+    return str(log['doc_id'] if id_key == 'doc_id' else log['doc'][id_key])
 
-def filter_func(task_path,threshold=1.0):
+def build_log_index(log_path, id_list, id_key='question_id'):
     '''
         param:
-            task_path:统计结果路径
-            Threshold:统计分数的阈值
+            log_path: log of one model (index file, shard or legacy json log)
+            id_list: 需要double check的题目
         return:
-            filter_list:需要double check的题目信息  
+            question id (str) -> log, only for the questions of id_list, built in one pass over the log
     '''
-    filter_list=[]
-    with open(task_path) as json_file:
-        data=json.load(json_file)
-        for k,model_scores in data.items():
-            model_scores=list(model_scores.values())
-            count = sum(1 for x in model_scores if x >= threshold)
-            if count==0:filter_list.append(k)
-    return filter_list
+    wanted = set(map(str, id_list))
+    index = {}
+    for log in iter_samples(log_path):
+        question_id = question_id_of(log, id_key)
+        if question_id in wanted and question_id not in index:
+            index[question_id] = log
+    return index
 
-def extract_judgement(sentence):
-    match = re.search(r'<Your judgement>:\s*(YES|NO)', sentence)
-    if match:
-        return match.group(1)
-    return None
+def make_prompt(log):
+    question = log['doc']['question']
+    answers = '; '.join(set(log['doc']["reference_strs"]))
+    return PROMPT.format(question=question, answer=answers)
+
+def prompt_hash(prompt, image_paths):
+    key = [gpt.MODEL, prompt, list(image_paths)]
+    return hashlib.sha256(json.dumps(key, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class DoubleCheckStore:
+    '''
+        Resumable results: one json line {"question_id", "prompt_hash", "response", "judgement"} per answered request.
+        A line is appended and flushed as soon as its response arrives, so an interrupted run only re-sends what is missing.
+        Failed requests are not stored and are retried by the next run.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a line cut by an interrupted run
+                        continue
+                    self.results[(record['question_id'], record['prompt_hash'])] = record
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._f = open(path, 'a', encoding='utf-8')
+
+    def get(self, question_id, key):
+        return self.results.get((question_id, key))
+
+    def add(self, question_id, key, response):
+        record = {'question_id': question_id, 'prompt_hash': key, 'response': response, 'judgement': extract_judgement(response)}
+        self.results[(question_id, key)] = record
+        self._f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._f.flush()
+        return record
+
+    def close(self):
+        self._f.close()
+
+def double_check(id_list, log_index, img_path, store, max_in_flight=16, requests_per_second=None, max_retries=5):
+    '''
+        Sends the judge prompt of every question of id_list that has no stored result, max_in_flight at a time.
+        return:
+            question id -> judgement (YES / NO / None when the response has no judgement, 'wrong' when all retries failed)
+    '''
+    todo = []
+    judgements = {}
+    for num in map(str, id_list):
+        if num not in log_index:
+            continue
+        prompt = make_prompt(log_index[num])
+        image_paths = [img_path + '/' + num + '.jpg']
+        key = prompt_hash(prompt, image_paths)
+        record = store.get(num, key)
+        if record is not None:
+            judgements[num] = record['judgement']
+        else:
+            todo.append((num, key, prompt, image_paths))
+    print(f'{len(judgements)} results loaded from {store.path}, {len(todo)} to request')
+
+    def on_result(i, response):
+        num, key = todo[i][:2]
+        if response is None:
+            judgements[num] = 'wrong'
+        else:
+            judgements[num] = store.add(num, key, response)['judgement']
+
+    engine = RequestEngine(max_in_flight=max_in_flight, requests_per_second=requests_per_second, max_retries=max_retries, fallback=None)
+    # images are read and encoded once per request in the worker, retries reuse the built content
+    engine.run(gpt.request_content, todo, prepare=lambda item: gpt.make_content(item[2], item[3]), on_result=on_result)
+    return judgements
 
 if __name__ == '__main__':
-    img_path = 'image_root_path'
-    id_path = './static_result/taskfile.json'
-    log_path = './logs/model/result.json'
-    save_path = './double_check/ai2d.json'
-    id_list = filter_func(id_path,threshold=1.0)[:]
-    print(len(id_list))
-    log = load_json(log_path)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--img_path', default='image_root_path')
+    parser.add_argument('--id_path', default='./static_result/taskfile.json', help='score matrix (.npz) or legacy result json')
+    parser.add_argument('--log_path', default='./logs/model/result.json', help='{task}.index.json or legacy {task}.json log')
+    parser.add_argument('--save_path', default='./double_check/ai2d.json')
+    parser.add_argument('--results_path', default=None, help='resumable per-request results, defaults to save_path with .jsonl')
+    parser.add_argument('--id_key', default='question_id', help="doc field matched against the ids, or 'doc_id'")
+    parser.add_argument('--threshold', type=float, default=1.0)
+    parser.add_argument('--max_in_flight', type=int, default=16)
+    parser.add_argument('--requests_per_second', type=float, default=None)
+    parser.add_argument('--mock', action='store_true', help='answer from a local mock endpoint instead of the API')
+    args = parser.parse_args()
 
-    images_list = get_file_names(img_path) #
-    #print(images_list)
-    for i in range(len(images_list)):
-        images_list[i] = img_path +'/' + images_list[i]
-    #print(images_list)    
-    ret = []
-    for num in id_list:
-        for i in range(len(log['logs'])):
-            if log['logs'][i]['doc']["question_id"]==num:
-                question = log['logs'][i]['doc']['question']
-                answer = set(log['logs'][i]['doc']["reference_strs"])
-                answer = list(answer)
-                answers = ''
-                answers = '; '.join(answer)
-                text = '''
-                Instruction: Please judge whether the <Answer> is the golden answer to the <Question>. 
-                If it is, please reply YES, otherwise reply NO.
-                <Question>: {question}
-                <Answer>: {answer}
-                <Your judgement>: <YES or NO>
-                '''.format(question=question,answer=answers)
-                # text = '''
-                # Now there is an image captioning task. 
-                # Please first describe the content of the image, then compare the image content with the provided captions. 
-                # If the captions are suitable as captions for the image, please answer YES; if they are not suitable, please answer NO.
-                # Respond with NO if any of the captions are unsuitable. Respond with YES only if all captions are suitable. You only need to reply with either YES or NO in <Your judgement>.
-                # <Captions>: {answer}
-                # <Desciption>: <Content of the image>
-                # <Your judgement>: <ONLY YES or NO>
-                # '''.format(answer=answers)
-                response = infer(text, [img_path +'/'+num+'.jpg'])
-                try:
-                    extraction = extract_judgement(response)
-                except:
-                    extraction = 'wrong'
-                log['logs'][i]['remain'] = extraction
-                if extraction == 'YES':
-                    ret.append(log['logs'][i]['doc']['question_id'])
-                #log['logs'][i]['cot_judge'] = response
-                print(response)
-                break
+    if args.mock:
+        from mock_gpt import start_mock_server
+        server, base_url = start_mock_server()
+        gpt.get_client(base_url=base_url, api_key='mock')
+
+    id_list = filter_func(args.id_path,threshold=args.threshold)
+    print(len(id_list))
+    log_index = build_log_index(args.log_path, id_list, args.id_key)
+    store = DoubleCheckStore(args.results_path or os.path.splitext(args.save_path)[0] + '.jsonl')
+    try:
+        judgements = double_check(id_list, log_index, args.img_path, store, args.max_in_flight, args.requests_per_second)
+    finally:
+        store.close()
+    ret = [log_index[num]['doc'].get('question_id', num) for num in map(str, id_list) if judgements.get(num) == 'YES']
     save_json = {"double_check":ret}
-    with open(save_path,'w',encoding='utf-8') as f:
+    os.makedirs(os.path.dirname(args.save_path) or '.', exist_ok=True)
+    with open(args.save_path,'w',encoding='utf-8') as f:
         json.dump(save_json,f,ensure_ascii=False,indent=2)
-
-
-        
-    
@@ -0,0 +1,46 @@
+'''
+    Local mock of the OpenAI chat completions endpoint, to try gpt_double_check.py without an API key:
+        python gpt_double_check.py --mock
+    Every request is answered after `latency` seconds with `reply(prompt)`.
+'''
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def default_reply(prompt):
+    return '<Your judgement>: YES'
+
+
+def make_handler(latency, reply):
+    class MockChatCompletionsHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latency)
+            content = payload["messages"][0]["content"]
+            prompt = content if isinstance(content, str) else content[0]["text"]
+            body = json.dumps({
+                "id": "mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": reply(prompt)}}],
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockChatCompletionsHandler
+
+
+def start_mock_server(latency=0.1, reply=default_reply):
+    '''Starts the server on a free local port, returns (server, base_url for the OpenAI client).'''
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(latency, reply))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
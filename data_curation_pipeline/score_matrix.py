@@ -0,0 +1,101 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.append('.')
+from lmms_eval.api.sample_log import iter_scores
+
+
+class ScoreMatrix:
+    '''
+        Scores of several models on the questions of one task, stored column-wise:
+            question_ids: (Q,) question ids (the doc_id of the samples)
+            models: (M,) model names
+            scores: (Q, M) float32 matrix, NaN where a model has no score for a question
+        Saved as a single .npz, so filtering never loads docs, responses or images.
+    '''
+
+    def __init__(self, question_ids, models, scores):
+        self.question_ids = np.asarray(question_ids)
+        self.models = list(models)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        assert self.scores.shape == (len(self.question_ids), len(self.models))
+
+    @classmethod
+    def from_logs(cls, log_paths, metric):
+        '''
+            param:
+                log_paths: model name -> {task}.index.json written by --log_samples (or a legacy {task}.json log)
+                metric: metric to collect, e.g. exact_match
+        '''
+        columns = {}
+        for model, path in log_paths.items():
+            ids, values = [], []
+            # index files point to the per-rank .scores.jsonl, which only hold doc ids and metrics
+            for item in iter_scores(path):
+                value = item.get(metric)
+                if isinstance(value, (int, float)):
+                    ids.append(item['doc_id'])
+                    values.append(value)
+            columns[model] = (np.asarray(ids), np.asarray(values, dtype=np.float32))
+        return cls.from_columns(columns)
+
+    @classmethod
+    def from_columns(cls, columns):
+        '''columns: model name -> (question ids, scores)'''
+        question_ids = np.unique(np.concatenate([ids for ids, _ in columns.values()])) if columns else np.asarray([])
+        scores = np.full((len(question_ids), len(columns)), np.nan, dtype=np.float32)
+        for j, (ids, values) in enumerate(columns.values()):
+            scores[np.searchsorted(question_ids, ids), j] = values
+        return cls(question_ids, list(columns), scores)
+
+    @classmethod
+    def from_json(cls, path):
+        '''Reads the nested question_id -> model -> score json written by earlier versions of Models_Judges.py.'''
+        with open(path) as json_file:
+            data = json.load(json_file)
+        columns = {}
+        for question_id, model_scores in data.items():
+            for model, score in model_scores.items():
+                ids, values = columns.setdefault(model, ([], []))
+                ids.append(question_id)
+                values.append(score)
+        return cls.from_columns({model: (np.asarray(ids), np.asarray(values, dtype=np.float32)) for model, (ids, values) in columns.items()})
+
+    @classmethod
+    def load(cls, path):
+        if not path.endswith('.npz'):
+            return cls.from_json(path)
+        with np.load(path) as data:
+            return cls(data['question_ids'], data['models'].tolist(), data['scores'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, question_ids=self.question_ids, models=np.asarray(self.models), scores=self.scores)
+
+    def select_models(self, models):
+        columns = [self.models.index(model) for model in models if model in self.models]
+        return ScoreMatrix(self.question_ids, [self.models[j] for j in columns], self.scores[:, columns])
+
+    def pass_counts(self, threshold=1.0):
+        '''Number of models scoring at least `threshold` on every question, missing scores never pass.'''
+        return (np.nan_to_num(self.scores, nan=-np.inf) >= threshold).sum(axis=1)
+
+    def unsolved(self, threshold=1.0):
+        '''Questions that no model solves.'''
+        return self.question_ids[self.pass_counts(threshold) == 0]
+
+    def difficulty_split(self, threshold=1.0):
+        '''
+            return:
+                easy: solved by 5-9 models
+                middle: solved by 3-4 models
+                hard: solved by 1-2 models
+        '''
+        counts = self.pass_counts(threshold)
+        easy = self.question_ids[(counts >= 5) & (counts <= 9)]
+        middle = self.question_ids[(counts >= 3) & (counts < 5)]
+        hard = self.question_ids[(counts > 0) & (counts < 3)]
+        return easy, middle, hard
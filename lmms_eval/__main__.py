@@ -9,8 +9,10 @@ import argparse
 import numpy as np
 import datetime
 
+import gc
 import warnings
 import traceback
+import multiprocessing
 
 warnings.simplefilter("ignore", category=DeprecationWarning)
 
@@ -25,7 +27,9 @@ os.chdir('./')
 from lmms_eval import evaluator, utils
 from lmms_eval.tasks import initialize_tasks, include_path, get_task_dict
 from lmms_eval.api.registry import ALL_TASKS
+from lmms_eval.api.sample_log import SAMPLE_LOG_FORMATS, iter_samples, write_sample_index
 from lmms_eval.logging_utils import WandbLogger
+from lmms_eval.sweep import SweepSession, load_sweep_config
 from loguru import logger as eval_logger
 
 
@@ -107,6 +111,13 @@ def parse_eval_args() -> argparse.Namespace:
         default="model_outputs",
         help="Specify a suffix for the log_samples file name.",
     )
+    parser.add_argument(
+        "--log_samples_format",
+        type=str,
+        default="json",
+        choices=SAMPLE_LOG_FORMATS,
+        help="Format of the log_samples files. json (default) writes one {task}.json built in memory on rank 0, jsonl and jsonl.zst stream every rank's samples to its own shard with a {task}.index.json next to them.",
+    )
     parser.add_argument(
         "--predict_only",
         "-x",
@@ -114,6 +125,24 @@ def parse_eval_args() -> argparse.Namespace:
         default=False,
         help="Use with --log_samples. Only model outputs will be saved and metrics will not be evaluated.",
     )
+    parser.add_argument(
+        "--resume_dir",
+        type=str,
+        default=None,
+        help="Directory where every model response is journaled as soon as it is produced. Rerunning with the same directory only runs the missing requests.",
+    )
+    parser.add_argument(
+        "--sweep",
+        type=str,
+        default=None,
+        help="Path to a yaml list of models (model, model_args and optionally other arguments such as gen_kwargs) evaluated one after another on --tasks, loading the tasks and datasets only once.",
+    )
+    parser.add_argument(
+        "--sweep_devices",
+        type=str,
+        default=None,
+        help="Comma separated devices for --sweep, e.g. cuda:0,cuda:1. Models are spread over the devices, every device runs its models one after another in a process of its own.",
+    )
     parser.add_argument(
         "--show_config",
         action="store_true",
@@ -169,16 +198,33 @@ def cli_evaluate(args: Union[argparse.Namespace, None] = None) -> None:
         print("└───────────────────────────────────────────────────────────────────────────────┘")
         sys.exit(1)
 
-    # reset logger
-    eval_logger.remove()
-    eval_logger.add(sys.stdout, colorize=True, level=args.verbosity)
-    eval_logger.add(sys.stderr, level=args.verbosity)
-    eval_logger.info(f"Verbosity set to {args.verbosity}")
+    reset_logger(args.verbosity)
     os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+    if args.tasks == "list" and not args.config and not args.sweep:
+        # listing tasks needs neither the accelerator nor any model, models are only imported by `get_model`
+        register_tasks(args)
+        eval_logger.info("Available Tasks:\n - {}".format(f"\n - ".join(sorted(ALL_TASKS))))
+        return
+
     args_list = []
     results_list = []
-    if args.config:
+    sweep_session = None
+    if args.sweep:
+        # every entry overrides the model arguments of the command line, tasks and datasets are loaded once for all of them
+        for entry in load_sweep_config(args.sweep):
+            args_copy = argparse.Namespace(**vars(args))
+            for key, value in entry.items():
+                setattr(args_copy, key, value)
+            if args.resume_dir:
+                # response journals are per model
+                model_hash = hashlib.sha256(f"{args_copy.model_args}".encode("utf-8")).hexdigest()[:6]
+                args_copy.resume_dir = os.path.join(args.resume_dir, f"{args_copy.model}_{model_hash}")
+            args_list.append(args_copy)
+        sweep_session = SweepSession()
+        register_tasks(args)
+        sweep_session.tasks_initialized = True
+    elif args.config:
         if not os.path.exists(args.config):
             raise ValueError(f"Config file does not exist: {args.config}")
 
@@ -197,33 +243,29 @@ def cli_evaluate(args: Union[argparse.Namespace, None] = None) -> None:
     # initialize Accelerator
     kwargs_handler = InitProcessGroupKwargs(timeout=datetime.timedelta(seconds=60000))
     accelerator = Accelerator(kwargs_handlers=[kwargs_handler])
-    if accelerator.is_main_process:
-        is_main_process = True
-    else:
-        is_main_process = False
-
-    for args in args_list:
-        try:
-            if is_main_process and args.wandb_args:  # thoughtfully we should only init wandb once, instead of multiple ranks to avoid network traffics and unwanted behaviors.
-                wandb_logger = WandbLogger(args)
-
-            results, samples = cli_evaluate_single(args)
-            results_list.append(results)
 
-            accelerator.wait_for_everyone()
-            if is_main_process and args.wandb_args:
-                wandb_logger.post_init(results)
-                wandb_logger.log_eval_result()
-                if args.wandb_log_samples and samples is not None:
-                    wandb_logger.log_eval_samples(samples)
+    if sweep_session is not None and args.sweep_devices and accelerator.num_processes == 1:
+        # one process per device, each evaluates the models of its device one after another. Not threads:
+        # evaluate seeds the global RNGs, and tasks and filters keep the state of the running model.
+        devices = args.sweep_devices.split(",")
+        for idx, model_args in enumerate(args_list):
+            model_args.device = devices[idx % len(devices)]
+        device_args_lists = [args_list[slot :: len(devices)] for slot in range(len(devices)) if args_list[slot :: len(devices)]]
+        # not a Pool: its workers are daemonic and could not start the worker processes of tasks and data loaders
+        ctx = multiprocessing.get_context("spawn")
+        processes = [ctx.Process(target=sweep_device, args=(device_args,)) for device_args in device_args_lists]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        failed = [device_args[0].device for process, device_args in zip(processes, device_args_lists) if process.exitcode != 0]
+        if failed:
+            eval_logger.error(f"Sweep failed on {', '.join(failed)}")
+            sys.exit(1)
+        return
 
-                wandb_logger.finish()
-
-        except Exception as e:
-            traceback.print_exc()
-            eval_logger.error(f"Error during evaluation: {e}")
-            traceback.print_exc()
-            results_list.append(None)
+    for args in args_list:
+        results_list.append(evaluate_args(args, accelerator, sweep_session))
 
     for args, results in zip(args_list, results_list):
         # cli_evaluate will return none if the process is not the main process (rank 0)
@@ -231,15 +273,63 @@ def cli_evaluate(args: Union[argparse.Namespace, None] = None) -> None:
             print_results(args, results)
 
 
-def cli_evaluate_single(args: Union[argparse.Namespace, None] = None) -> None:
-    initialize_tasks(args.verbosity)
+def reset_logger(verbosity: str) -> None:
+    eval_logger.remove()
+    eval_logger.add(sys.stdout, colorize=True, level=verbosity)
+    eval_logger.add(sys.stderr, level=verbosity)
+    eval_logger.info(f"Verbosity set to {verbosity}")
+
+
+def evaluate_args(args: argparse.Namespace, accelerator: Accelerator, sweep_session: SweepSession = None):
+    """Evaluates one model of the run (one entry of a config or of a sweep), returns its results on the main process."""
+    try:
+        if accelerator.is_main_process and args.wandb_args:  # thoughtfully we should only init wandb once, instead of multiple ranks to avoid network traffics and unwanted behaviors.
+            wandb_logger = WandbLogger(args)
+
+        results, samples = cli_evaluate_single(args, sweep_session=sweep_session)
+
+        accelerator.wait_for_everyone()
+        if accelerator.is_main_process and args.wandb_args:
+            wandb_logger.post_init(results)
+            wandb_logger.log_eval_result()
+            if args.wandb_log_samples and samples is not None:
+                wandb_logger.log_eval_samples(samples)
+
+            wandb_logger.finish()
+        return results
+
+    except Exception as e:
+        traceback.print_exc()
+        eval_logger.error(f"Error during evaluation: {e}")
+        traceback.print_exc()
+        return None
+    finally:
+        # release the model before the next one of a sweep is loaded
+        gc.collect()
+
+
+def sweep_device(args_list) -> None:
+    """Evaluates the sweep models of one `--sweep_devices` device one after another, in a process of its own."""
+    reset_logger(args_list[0].verbosity)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    sweep_session = SweepSession()
+    register_tasks(args_list[0])
+    sweep_session.tasks_initialized = True
+    accelerator = Accelerator(kwargs_handlers=[InitProcessGroupKwargs(timeout=datetime.timedelta(seconds=60000))])
+    failed = 0
+    for args in args_list:
+        results = evaluate_args(args, accelerator, sweep_session)
+        if results is not None:
+            print_results(args, results)
+        else:
+            failed += 1
+    if failed:
+        # the error of each model was logged by evaluate_args, the exit code tells the parent process
+        sys.exit(1)
 
-    if args.predict_only:
-        args.log_samples = True
-    if (args.log_samples or args.predict_only) and not args.output_path:
-        raise ValueError("Specify --output_path if providing --log_samples or --predict_only")
-    if args.limit:
-        eval_logger.warning(" --limit SHOULD ONLY BE USED FOR TESTING." "REAL METRICS SHOULD NOT BE COMPUTED USING LIMIT.")
+
+def register_tasks(args: argparse.Namespace) -> None:
+    initialize_tasks(args.verbosity)
     if args.include_path is not None:
         eval_logger.info(f"Including path: {args.include_path}")
         include_path(args.include_path)
@@ -247,9 +337,20 @@ def cli_evaluate_single(args: Union[argparse.Namespace, None] = None) -> None:
     if os.environ.get("LMMS_EVAL_PLUGINS", None):
         for plugin in os.environ["LMMS_EVAL_PLUGINS"].split(","):
             package_tasks_location = importlib.util.find_spec(f"{plugin}.tasks").submodule_search_locations[0]
-            eval_logger.info(f"Including path: {args.include_path}")
+            eval_logger.info(f"Including path: {package_tasks_location}")
             include_path(package_tasks_location)
 
+
+def cli_evaluate_single(args: Union[argparse.Namespace, None] = None, sweep_session: SweepSession = None) -> None:
+    if sweep_session is None or not sweep_session.tasks_initialized:
+        register_tasks(args)
+
+    if args.predict_only:
+        args.log_samples = True
+    if (args.log_samples or args.predict_only) and not args.output_path:
+        raise ValueError("Specify --output_path if providing --log_samples or --predict_only")
+    if args.limit:
+        eval_logger.warning(" --limit SHOULD ONLY BE USED FOR TESTING." "REAL METRICS SHOULD NOT BE COMPUTED USING LIMIT.")
     if args.tasks is None:
         task_names = ALL_TASKS
     elif args.tasks == "list":
@@ -306,6 +407,11 @@ def cli_evaluate_single(args: Union[argparse.Namespace, None] = None) -> None:
     elif args.log_samples and not args.output_path:
         assert args.output_path, "Specify --output_path"
 
+    task_dict, model_datasets = None, None
+    if sweep_session is not None:
+        task_dict = sweep_session.task_dict(task_names, args.model, gen_kwargs=args.gen_kwargs)
+        model_datasets = sweep_session.model_datasets(task_dict)
+
     results = evaluator.simple_evaluate(
         model=args.model,
         model_args=args.model_args,
@@ -320,13 +426,17 @@ def cli_evaluate_single(args: Union[argparse.Namespace, None] = None) -> None:
         gen_kwargs=args.gen_kwargs,
         cli_args=args,
         predict_only=args.predict_only,
+        resume_dir=args.resume_dir,
+        log_samples_dir=args.output_path,
+        log_samples_format=args.log_samples_format,
+        task_dict=task_dict,
+        model_datasets=model_datasets,
     )
 
     if results is not None:
-        if args.log_samples:
-            samples = results.pop("samples")
-        else:
-            samples = None
+        sample_shards = results.pop("sample_shards", None)
+        # only the json format returns the samples, the other formats streamed them to their shards
+        samples = results.pop("samples", None)
         dumped = json.dumps(results, indent=4, default=_handle_non_serializable)
         if args.show_config:
             print(dumped)
@@ -341,7 +451,15 @@ def cli_evaluate_single(args: Union[argparse.Namespace, None] = None) -> None:
                 eval_logger.warning(f"Output file {result_file_path} already exists and will be overwritten.")
 
             result_file_path.open("w").write(dumped)
-            if args.log_samples:
+            if sample_shards is not None and samples is None:
+                for task_name, config in results["configs"].items():
+                    if task_name not in sample_shards:
+                        continue
+                    filename = write_sample_index(args.output_path, task_name, sample_shards[task_name], format=args.log_samples_format, args=vars(args), model_configs=config, time=datetime_str)
+                    eval_logger.info(f"Saved samples to {filename}")
+                if args.wandb_log_samples:
+                    samples = {task_name: list(iter_samples(str(args.output_path.joinpath(f"{task_name}.index.json")))) for task_name in sample_shards}
+            elif args.log_samples:
                 for task_name, config in results["configs"].items():
                     filename = args.output_path.joinpath(f"{task_name}.json")
                     # Structure the data with 'args' and 'logs' keys
@@ -349,6 +467,9 @@ def cli_evaluate_single(args: Union[argparse.Namespace, None] = None) -> None:
                     samples_dumped = json.dumps(data_to_dump, indent=4, default=_handle_non_serializable, ensure_ascii=False)
                     filename.open("w", encoding="utf-8").write(samples_dumped)
                     eval_logger.info(f"Saved samples to {filename}")
+                    if sample_shards is not None and task_name in sample_shards:
+                        # the index points score analyses to the per-rank score files instead of the whole log
+                        write_sample_index(args.output_path, task_name, sample_shards[task_name], format="json", log_file=filename.name, time=datetime_str)
 
         return results, samples
     return None, None
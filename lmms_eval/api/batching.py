@@ -0,0 +1,167 @@
+"""Cost-aware adaptive batching for local model adapters.
+
+With a fixed `batch_size` the largest batch of a task decides whether the run fits in
+memory: a batch of long prompts with several anyres images and `max_new_tokens=1024`
+needs many times the memory of a batch of short single-image questions, so runs fall
+back to `batch_size=1`. `AdaptiveBatcher` instead sizes every batch by its estimated
+cost, `len(batch) * max(request cost)` since the batch is padded to its longest request,
+where the cost of a request is its text tokens, its visual tokens and its
+`max_new_tokens`. The token budget of a batch is learned from the peak memory observed
+after each batch, shrinks on OOM and never grows back to a cost that ran out of memory.
+Adapters opt in through `Collator.get_batched_adaptive`.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Iterator, List, Optional, Sequence
+
+
+@dataclass
+class BatchingStats:
+    """Counters collected by an `AdaptiveBatcher`."""
+
+    batches: int = 0
+    requests: int = 0
+    ooms: int = 0
+    # sum of len(batch) * max(cost) and of the costs themselves, their ratio is the padding overhead
+    padded_cost: int = 0
+    cost: int = 0
+    budgets: List[int] = field(default_factory=list)
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.requests / self.batches if self.batches else 0.0
+
+    @property
+    def padding_ratio(self) -> float:
+        return 1 - self.cost / self.padded_cost if self.padded_cost else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "batches": self.batches,
+            "mean_batch_size": round(self.mean_batch_size, 2),
+            "ooms": self.ooms,
+            "padding_ratio": round(self.padding_ratio, 3),
+            "final_token_budget": self.budgets[-1] if self.budgets else None,
+        }
+
+
+class AdaptiveBatcher:
+    """Forms batches of at most `max_batch_size` requests whose padded cost fits `token_budget`.
+
+    `token_budget=None` starts without a limit other than `max_batch_size` and learns one from
+    the first `observe_memory` or `on_oom` call. The bytes used per token of batch cost are
+    estimated from `(peak - base) / batch_cost`, following increases at once and decreases
+    slowly, and the budget is set so that the peak stays at `target_memory_fraction` of the
+    device memory, growing by at most `max_growth` per batch.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 64,
+        token_budget: Optional[int] = None,
+        target_memory_fraction: float = 0.85,
+        max_growth: float = 2.0,
+        oom_backoff: float = 0.5,
+        visual_tokens_per_request: float = 0.0,
+    ) -> None:
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.token_budget = token_budget
+        self.target_memory_fraction = target_memory_fraction
+        self.max_growth = max_growth
+        self.oom_backoff = oom_backoff
+        # running estimate used until visuals are loaded, see `observe_visuals`
+        self.visual_tokens_per_request = visual_tokens_per_request
+        self.bytes_per_token = None
+        # smallest batch cost that ran out of memory, the budget stays below it
+        self.oom_ceiling = None
+        self._visual_requests = 0
+        self._visual_tokens = 0
+        self.stats = BatchingStats(budgets=[token_budget] if token_budget is not None else [])
+
+    def request_cost(self, text_cost: float) -> float:
+        """Cost of a request whose text tokens plus `max_new_tokens` are `text_cost`, with the estimated visual tokens."""
+        return text_cost + self.visual_tokens_per_request
+
+    def batch_cost(self, costs: Sequence[float]) -> float:
+        """Padded cost of a batch of requests of `costs`."""
+        return len(costs) * max(costs) if costs else 0
+
+    def batch_size_for(self, cost: float) -> int:
+        """Number of requests of at most `cost` each that fit in a batch."""
+        if self.token_budget is None:
+            return self.max_batch_size
+        return max(1, min(self.max_batch_size, int(self.token_budget // max(cost, 1))))
+
+    def batches(self, values: Sequence[Any], text_costs: Sequence[float]) -> Iterator[List[Any]]:
+        """Yields consecutive batches of `values`, sorted by decreasing `text_costs`.
+
+        The size of each batch is decided when it is taken. When the batches are consumed through
+        `lmms.prefetch_visuals`, they are taken `prefetch_depth` batches ahead of generation, so a
+        budget update only affects the batches taken after it. Batches taken before a budget
+        decrease are brought back under it by `split`; batches taken before an increase stay small.
+        """
+        start = 0
+        while start < len(values):
+            # costs are decreasing, the first request of a batch is the one it is padded to
+            size = self.batch_size_for(self.request_cost(text_costs[start]))
+            batch = values[start : start + size]
+            self._record(batch, [self.request_cost(c) for c in text_costs[start : start + size]])
+            start += size
+            yield batch
+
+    def split(self, costs: Sequence[float]) -> List[slice]:
+        """Splits a batch whose actual request `costs` are known (e.g. after loading its visuals) into parts that fit the budget."""
+        if self.token_budget is None or self.batch_cost(costs) <= self.token_budget:
+            return [slice(0, len(costs))]
+        parts, start = [], 0
+        while start < len(costs):
+            end = start + 1
+            while end < len(costs) and self.batch_cost(costs[start : end + 1]) <= self.token_budget:
+                end += 1
+            parts.append(slice(start, end))
+            start = end
+        return parts
+
+    def _record(self, batch: Sequence[Any], costs: Sequence[float]) -> None:
+        self.stats.batches += 1
+        self.stats.requests += len(batch)
+        self.stats.padded_cost += int(self.batch_cost(costs))
+        self.stats.cost += int(sum(costs))
+
+    def _set_budget(self, budget: float) -> None:
+        if self.oom_ceiling is not None:
+            budget = min(budget, self.oom_ceiling * 0.9)
+        self.token_budget = max(1, int(budget))
+        self.stats.budgets.append(self.token_budget)
+
+    def observe_visuals(self, num_requests: int, visual_tokens: int) -> None:
+        """Updates the visual tokens per request estimate with a loaded batch."""
+        self._visual_requests += num_requests
+        self._visual_tokens += visual_tokens
+        self.visual_tokens_per_request = self._visual_tokens / self._visual_requests
+
+    def observe_memory(self, batch_cost: float, peak_memory: int, base_memory: int, total_memory: int) -> None:
+        """Updates the budget with the peak memory of a batch of padded cost `batch_cost`.
+
+        `base_memory` is the memory allocated before the batch (weights, cache), `total_memory`
+        the memory of the device.
+        """
+        if batch_cost <= 0 or peak_memory <= base_memory:
+            return
+        observed = (peak_memory - base_memory) / batch_cost
+        if self.bytes_per_token is None or observed > self.bytes_per_token:
+            self.bytes_per_token = observed
+        else:
+            self.bytes_per_token = 0.8 * self.bytes_per_token + 0.2 * observed
+        budget = (self.target_memory_fraction * total_memory - base_memory) / self.bytes_per_token
+        if self.token_budget is not None:
+            budget = min(budget, self.token_budget * self.max_growth)
+        self._set_budget(budget)
+
+    def on_oom(self, batch_cost: float) -> None:
+        """Shrinks the budget after a batch of padded cost `batch_cost` ran out of memory."""
+        self.stats.ooms += 1
+        self.oom_ceiling = batch_cost if self.oom_ceiling is None else min(self.oom_ceiling, batch_cost)
+        budget = batch_cost * self.oom_backoff
+        if self.token_budget is not None:
+            budget = min(budget, self.token_budget * self.oom_backoff)
+        self._set_budget(budget)
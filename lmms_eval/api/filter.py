@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 from typing import List
 
-from lmms_eval.api.instance import Instance
+from lmms_eval.api.instance import Instance, InstanceStore
 from datasets import Dataset
 
 
@@ -49,5 +49,8 @@ class FilterEnsemble:
 
         # add the end results after filtering to filtered_requests of their respective source instances.
         # has key `self.name`: each FilterEnsemble applied in a given run should use a different name.
+        if isinstance(instances, InstanceStore):
+            instances.set_filtered_resps(self.name, resps)
+            return
         for inst, resp in zip(instances, resps):
             inst.filtered_resps[self.name] = resp
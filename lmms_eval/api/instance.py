@@ -1,5 +1,9 @@
+import array
+import collections
+import sys
+from collections.abc import MutableMapping, Sequence
 from dataclasses import dataclass, field
-from typing import Literal, Tuple
+from typing import Dict, Iterable, Iterator, List, Literal, Optional, Tuple
 
 
 @dataclass
@@ -27,3 +31,244 @@ class Instance:
         Returns (string,) where `string` is the string to calculate loglikelihood over
         """
         return self.arguments if isinstance(self.arguments, tuple) else (self.arguments,)
+
+
+def group_by_doc_id(instances: Iterable[Instance]) -> Dict[int, List[Instance]]:
+    """Index instances by `doc_id`, each bucket sorted by `idx`.
+
+    Built once per task after `build_all_requests()` so that postprocessing can look
+    up the requests of a document in O(1) instead of scanning every instance.
+    """
+    index = collections.defaultdict(list)
+    for inst in instances:
+        index[inst.doc_id].append(inst)
+    for doc_instances in index.values():
+        doc_instances.sort(key=lambda x: x.idx)
+    return dict(index)
+
+
+# marks a row without a response for a filter in `InstanceStore` filtered response columns
+_MISSING = object()
+
+
+class StoredInstance:
+    """One request of an `InstanceStore`, with the attributes of `Instance` read from the store's columns.
+
+    Model adapters use it like an `Instance`: `args` returns the same tuple, and `resps` and
+    `filtered_resps` can be appended to and assigned as before.
+    """
+
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store: "InstanceStore", row: int) -> None:
+        self._store = store
+        self._row = row
+
+    @property
+    def request_type(self) -> str:
+        return self._store._request_types[self._store._type_codes[self._row]]
+
+    @property
+    def arguments(self) -> tuple:
+        return self._store.arguments(self._row)
+
+    @property
+    def args(self):
+        """
+        Returns (string,) where `string` is the string to calculate loglikelihood over
+        """
+        return self.arguments
+
+    @property
+    def idx(self) -> int:
+        return self._store._idxs[self._row]
+
+    @property
+    def doc_id(self) -> int:
+        return self._store._doc_ids[self._row]
+
+    @property
+    def task_name(self) -> str:
+        return self._store.task_name
+
+    @property
+    def repeats(self) -> int:
+        return self._store.repeats
+
+    @property
+    def metadata(self) -> Tuple[str, int, int]:
+        return (self.task_name, self.doc_id, self.repeats)
+
+    @property
+    def doc(self) -> dict:
+        return None
+
+    @property
+    def resps(self) -> list:
+        resps = self._store._resps[self._row]
+        if resps is None:
+            resps = self._store._resps[self._row] = []
+        return resps
+
+    @resps.setter
+    def resps(self, value: list) -> None:
+        self._store._resps[self._row] = value
+
+    @property
+    def filtered_resps(self) -> "FilteredResps":
+        return FilteredResps(self._store, self._row)
+
+    @filtered_resps.setter
+    def filtered_resps(self, value: dict) -> None:
+        for column in self._store._filtered_resps.values():
+            column[self._row] = _MISSING
+        for name, resp in value.items():
+            self._store.filtered_resps_column(name)[self._row] = resp
+
+    def __repr__(self) -> str:
+        return (
+            f"Instance(request_type={self.request_type!r}, arguments={self.arguments!r}, idx={self.idx!r}, metadata={self.metadata!r}, "
+            f"resps={self.resps!r}, filtered_resps={dict(self.filtered_resps)!r}, task_name={self.task_name!r}, doc_id={self.doc_id!r}, repeats={self.repeats!r}, doc=None)"
+        )
+
+
+class FilteredResps(MutableMapping):
+    """`filtered_resps` dict of a `StoredInstance`, filter name -> filtered response, backed by the store's columns."""
+
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store: "InstanceStore", row: int) -> None:
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, name: str):
+        column = self._store._filtered_resps.get(name)
+        if column is None or column[self._row] is _MISSING:
+            raise KeyError(name)
+        return column[self._row]
+
+    def __setitem__(self, name: str, resp) -> None:
+        self._store.filtered_resps_column(name)[self._row] = resp
+
+    def __delitem__(self, name: str) -> None:
+        if name not in self:
+            raise KeyError(name)
+        self._store._filtered_resps[name][self._row] = _MISSING
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name, column in self._store._filtered_resps.items() if column[self._row] is not _MISSING)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class InstanceStore(Sequence):
+    """The instances of one task, stored column-wise.
+
+    A task builds hundreds of thousands of requests which share their task name, split,
+    repeats and `doc_to_visual`, and mostly their second argument (the generation kwargs or
+    `doc_to_target`). An `Instance` keeps all of them in its own `__dict__`, together with
+    an arguments tuple, a fresh bound method, a metadata tuple, a resps list and a
+    filtered_resps dict. The store keeps the shared values once, the doc ids and indices in
+    int32 arrays, and the responses in columns; a row is handed out as a slotted
+    `StoredInstance`, created the first time it is accessed.
+    """
+
+    def __init__(self, task_name: str, split: Optional[str], repeats: int) -> None:
+        self.task_name = sys.intern(task_name) if isinstance(task_name, str) else task_name
+        self.split = sys.intern(split) if isinstance(split, str) else split
+        self.repeats = repeats
+        self._request_types = []
+        self._type_codes = array.array("B")
+        self._doc_ids = array.array("i")
+        self._idxs = array.array("i")
+        self._contexts = []
+        self._seconds = []
+        # the value of shared arguments (doc_to_visual, generation kwargs, doc_to_target) -> that value,
+        # so that equal bound methods and dicts created per request are kept once
+        self._shared = {}
+        self._doc_to_visual = None
+        # row -> arguments tuple, for the few requests not shaped (ctx, x, doc_to_visual, doc_id, task, split)
+        self._irregular_arguments = {}
+        self._resps = []
+        self._filtered_resps = {}
+        self._views = []
+
+    def _share(self, value):
+        if isinstance(value, str):
+            # continuations differ from request to request, sharing them would only cost memory
+            return value
+        try:
+            return self._shared.setdefault(value, value)
+        except TypeError:
+            # unhashable, e.g. the generation kwargs dict, shared when it is the same object
+            return self._shared.setdefault(id(value), value)
+
+    def append(self, instance: Instance) -> None:
+        """Stores `instance` as the next row, its `StoredInstance` is `store[row]`."""
+        row = len(self._doc_ids)
+        if instance.request_type not in self._request_types:
+            self._request_types.append(instance.request_type)
+        self._type_codes.append(self._request_types.index(instance.request_type))
+        self._doc_ids.append(instance.doc_id)
+        self._idxs.append(instance.idx)
+
+        args = instance.args
+        if len(args) == 6 and args[3] == instance.doc_id and args[4] == self.task_name and args[5] == self.split and (self._doc_to_visual is None or args[2] == self._doc_to_visual):
+            if self._doc_to_visual is None:
+                self._doc_to_visual = args[2]
+            self._contexts.append(args[0])
+            self._seconds.append(self._share(args[1]))
+        else:
+            self._irregular_arguments[row] = args
+            self._contexts.append(None)
+            self._seconds.append(None)
+
+        self._resps.append(instance.resps or None)
+        for column in self._filtered_resps.values():
+            column.append(_MISSING)
+        for name, resp in instance.filtered_resps.items():
+            self.filtered_resps_column(name)[row] = resp
+        self._views.append(None)
+
+    def arguments(self, row: int) -> tuple:
+        if row in self._irregular_arguments:
+            return self._irregular_arguments[row]
+        return (self._contexts[row], self._seconds[row], self._doc_to_visual, self._doc_ids[row], self.task_name, self.split)
+
+    def filtered_resps_column(self, name: str) -> list:
+        """The responses of every row after the filter ensemble `name`."""
+        if name not in self._filtered_resps:
+            self._filtered_resps[name] = [_MISSING] * len(self)
+        return self._filtered_resps[name]
+
+    def set_filtered_resps(self, name: str, resps: List) -> None:
+        """Sets the responses of every row after the filter ensemble `name`, in row order."""
+        column = list(resps)
+        assert len(column) == len(self), f"{len(column)} filtered responses for {len(self)} instances"
+        self._filtered_resps[name] = column
+
+    def clear_resps(self) -> None:
+        """Drops the responses, so that the same requests can be sent to another model."""
+        self._resps = [None] * len(self)
+        self._filtered_resps = {}
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        view = self._views[row]
+        if view is None:
+            view = self._views[row] = StoredInstance(self, row)
+        return view
+
+    def __iter__(self) -> Iterator[StoredInstance]:
+        for row in range(len(self)):
+            yield self[row]
+
+    def __repr__(self) -> str:
+        return f"InstanceStore(task_name={self.task_name!r}, split={self.split!r}, instances={len(self)})"
@@ -0,0 +1,161 @@
+"""Append-only journal of model responses, used by `--resume_dir`.
+
+Every task gets one JSON-lines file per rank, `{task}_rank{rank}_of{world_size}.jsonl`. Its first
+line is a header `{"fingerprint"}`, a hash of the model, its arguments, the task config and the
+limit (see `journal_fingerprint`). A journal whose header does not match the run was written by a
+different run: it is moved aside to `.stale` and the task starts over. Then comes one record per
+response: `{"doc_id", "idx", "n", "prompt", "resp"}`. `n` counts the occurrences of the same
+`(doc_id, idx)` request in the run (repeats and distributed padding), so a restarted run can tell
+exactly which responses it already has, and `prompt` is a hash of the request's text arguments,
+so a response is only reused for the same prompt. Records are buffered and written, flushed and
+fsynced once per commit, so journaling costs one write per chunk of requests rather than one
+per response. A truncated last line left by a crash is dropped when the journal is loaded.
+"""
+import collections
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from loguru import logger as eval_logger
+
+
+def _decode_resp(resp: Any) -> Any:
+    # loglikelihood responses are (logprob, is_greedy) tuples, which json stores as lists
+    return tuple(resp) if isinstance(resp, list) else resp
+
+
+def journal_fingerprint(**fields) -> str:
+    """Hash of the `fields` that decide the responses of a task, e.g. model, model_args, task config and limit."""
+    text = json.dumps(fields, sort_keys=True, default=str)
+    # functions print with their address, which changes from one run to the next
+    text = re.sub(r" at 0x[0-9a-fA-F]+", "", text)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def prompt_hash(req) -> str:
+    # the text arguments of a request: its context, and the continuation of loglikelihood requests
+    text = "\x00".join(arg for arg in req.args if isinstance(arg, str))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class ResponseJournal:
+    def __init__(self, resume_dir: str, rank: int = 0, world_size: int = 1, fingerprints: Optional[Dict[str, str]] = None) -> None:
+        """`fingerprints` maps a task name to the `journal_fingerprint` of this run, written in the header of its journal."""
+        self.resume_dir = resume_dir
+        self.rank = rank
+        self.world_size = world_size
+        self.fingerprints = fingerprints or {}
+        self._pending = collections.defaultdict(list)
+        os.makedirs(resume_dir, exist_ok=True)
+
+    def path(self, task_name: str) -> str:
+        return os.path.join(self.resume_dir, f"{task_name}_rank{self.rank}_of{self.world_size}.jsonl")
+
+    @staticmethod
+    def _drop_partial_line(path: str) -> None:
+        # a crash in the middle of a commit can leave a last line without newline, cut it so the next append starts clean
+        with open(path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def _header_matches(self, task_name: str, path: str) -> bool:
+        with open(path, "r") as f:
+            first_line = f.readline()
+        try:
+            header = json.loads(first_line)
+        except json.JSONDecodeError:
+            return False
+        return isinstance(header, dict) and "fingerprint" in header and header["fingerprint"] == self.fingerprints.get(task_name)
+
+    def load(self, task_name: str) -> Dict[Tuple[int, int, int], Tuple[str, Any]]:
+        """Returns the journaled `(prompt hash, response)` of `task_name`, keyed by `(doc_id, idx, n)`."""
+        path = self.path(task_name)
+        responses = {}
+        if not os.path.exists(path):
+            return responses
+        self._drop_partial_line(path)
+        if os.path.getsize(path) == 0:
+            return responses
+        if not self._header_matches(task_name, path):
+            eval_logger.warning(f"{path} was written by a run with a different model, model_args, task config or limit, moving it to {path}.stale and running {task_name} again")
+            os.replace(path, f"{path}.stale")
+            return responses
+        with open(path, "r") as f:
+            next(f)
+            for line_no, line in enumerate(f, start=1):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    eval_logger.warning(f"Skipping corrupted line {line_no} of {path}, it will be re-run")
+                    continue
+                responses[(record["doc_id"], record["idx"], record["n"])] = (record["prompt"], _decode_resp(record["resp"]))
+        return responses
+
+    def append(self, task_name: str, doc_id: int, idx: int, n: int, prompt: str, resp: Any) -> None:
+        self._pending[task_name].append(json.dumps({"doc_id": doc_id, "idx": idx, "n": n, "prompt": prompt, "resp": resp}, ensure_ascii=False))
+
+    def commit(self) -> None:
+        """Writes all buffered records to disk, after the header of a new journal."""
+        for task_name, lines in self._pending.items():
+            if not lines:
+                continue
+            path = self.path(task_name)
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                lines = [json.dumps({"fingerprint": self.fingerprints.get(task_name)})] + lines
+            with open(path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        self._pending.clear()
+
+
+def run_requests_with_journal(lm, reqtype: str, cloned_reqs: List, journal: ResponseJournal, commit_every: int = 512) -> List[Any]:
+    """Runs `getattr(lm, reqtype)` over `cloned_reqs`, skipping requests already in `journal`.
+
+    The missing requests are sent to the model in chunks of `commit_every`, and the journal
+    is committed after each chunk. Ranks resume with different numbers of missing requests, so
+    they agree on the largest one and the ranks with fewer pad their chunks with their last
+    request: every rank makes the same model calls with the same sizes, as the distributed
+    padding of `evaluate` requires. Returns the responses in the order of `cloned_reqs`.
+    """
+    journaled = {}
+    occurrences = collections.Counter()
+    keys = []
+    for req in cloned_reqs:
+        if req.task_name not in journaled:
+            journaled[req.task_name] = journal.load(req.task_name)
+        n = occurrences[(req.task_name, req.doc_id, req.idx)]
+        occurrences[(req.task_name, req.doc_id, req.idx)] += 1
+        keys.append((req.doc_id, req.idx, n))
+    prompts = [prompt_hash(req) for req in cloned_reqs]
+
+    resps = [None] * len(cloned_reqs)
+    missing = []
+    for i, (req, key) in enumerate(zip(cloned_reqs, keys)):
+        record = journaled[req.task_name].get(key)
+        if record is not None and record[0] == prompts[i]:
+            resps[i] = record[1]
+        else:
+            missing.append(i)
+    if len(missing) < len(cloned_reqs):
+        eval_logger.info(f"Resuming {reqtype}: {len(cloned_reqs) - len(missing)} responses loaded from {journal.resume_dir}, {len(missing)} to run")
+
+    num_missing = len(missing)
+    if lm.world_size > 1:
+        gathered = lm.accelerator.gather(torch.tensor(num_missing, device=lm.device)).cpu().detach().numpy().tolist()
+        num_missing = max(gathered)
+
+    for start in range(0, num_missing, commit_every):
+        chunk = missing[start : start + commit_every]
+        padding = cloned_reqs[-1:] * (min(commit_every, num_missing - start) - len(chunk))
+        chunk_resps = getattr(lm, reqtype)([cloned_reqs[i] for i in chunk] + padding)
+        for i, resp in zip(chunk, chunk_resps):
+            resps[i] = resp
+            doc_id, idx, n = keys[i]
+            journal.append(cloned_reqs[i].task_name, doc_id, idx, n, prompts[i], resp)
+        journal.commit()
+    return resps
@@ -395,16 +395,127 @@ class _bootstrap_internal:
         return res
 
 
-def bootstrap_stderr(f, xs, iters):
-    import multiprocessing as mp
+# upper bound on the number of resampled indices held in memory at once by the vectorized bootstrap
+BOOTSTRAP_BLOCK_ELEMENTS = 2**24
+BOOTSTRAP_SEED = 1234
 
-    pool = mp.Pool(mp.cpu_count())
+
+def _bootstrap_mean(xs):
+    values = np.asarray(xs, dtype=np.float64)
+    return lambda idx: values[idx].mean(axis=1)
+
+
+def _bootstrap_median(xs):
+    # matches `median`, which takes the middle element of the (unsorted) resample
+    values = np.asarray(xs, dtype=np.float64)
+    return lambda idx: values[idx[:, len(values) // 2]]
+
+
+def _bootstrap_perplexity(xs):
+    values = np.exp(np.asarray(xs, dtype=np.float64))
+    return lambda idx: values[idx].mean(axis=1)
+
+
+def _confusion_counts(items):
+    """Encodes (gold, pred) pairs as cells of a KxK confusion matrix, returns a function counting them per resample."""
+    pairs = np.asarray(items)
+    if pairs.ndim != 2 or pairs.shape[1] != 2 or pairs.dtype == object:
+        raise ValueError("expected a list of scalar (gold, pred) pairs")
+    labels, codes = np.unique(pairs, return_inverse=True)
+    codes = codes.reshape(pairs.shape)
+    num_labels = len(labels)
+    cells = codes[:, 0] * num_labels + codes[:, 1]
+
+    def counts(idx):
+        num_samples = idx.shape[0]
+        offsets = (np.arange(num_samples) * num_labels * num_labels)[:, None]
+        return np.bincount((cells[idx] + offsets).ravel(), minlength=num_samples * num_labels * num_labels).reshape(num_samples, num_labels, num_labels)
+
+    return labels, counts
+
+
+def _bootstrap_f1(items):
+    labels, counts = _confusion_counts(items)
+    # `f1_score` is sklearn's binary f1 with pos_label=1, only vectorize the plain 0/1 case
+    if not set(labels.tolist()) <= {0, 1}:
+        raise ValueError("vectorized f1 only supports 0/1 labels")
+    positive = labels.tolist().index(1) if 1 in labels.tolist() else None
+
+    def f1(idx):
+        if positive is None:
+            return np.zeros(idx.shape[0])
+        confusion = counts(idx)
+        tp = confusion[:, positive, positive]
+        fp = confusion[:, :, positive].sum(axis=1) - tp
+        fn = confusion[:, positive, :].sum(axis=1) - tp
+        denom = 2 * tp + fp + fn
+        return np.divide(2 * tp, denom, out=np.zeros(len(tp), dtype=np.float64), where=denom > 0)
+
+    return f1
+
+
+def _bootstrap_matthews_corrcoef(items):
+    _, counts = _confusion_counts(items)
+
+    def mcc(idx):
+        # multiclass MCC as in sklearn.metrics.matthews_corrcoef, 0 when undefined
+        confusion = counts(idx).astype(np.float64)
+        t_sum = confusion.sum(axis=2)
+        p_sum = confusion.sum(axis=1)
+        n_correct = np.trace(confusion, axis1=1, axis2=2)
+        n_samples = idx.shape[1]
+        cov_ytyp = n_correct * n_samples - (t_sum * p_sum).sum(axis=1)
+        cov_ypyp = n_samples**2 - (p_sum * p_sum).sum(axis=1)
+        cov_ytyt = n_samples**2 - (t_sum * t_sum).sum(axis=1)
+        denom = np.sqrt(cov_ytyt * cov_ypyp)
+        return np.divide(cov_ytyp, denom, out=np.zeros(len(denom)), where=denom > 0)
+
+    return mcc
+
+
+def _vectorized_bootstrap_stderr(statistic, n, iters, seed):
+    rng = np.random.default_rng(seed)
+    block = max(1, min(iters, BOOTSTRAP_BLOCK_ELEMENTS // max(n, 1)))
+    res = []
+    for start in range(0, iters, block):
+        # each row of the index matrix is one resample with replacement
+        idx = rng.integers(0, n, size=(min(block, iters - start), n))
+        res.append(statistic(idx))
+    return float(np.std(np.concatenate(res), ddof=1))
+
+
+_bootstrap_pool = None
+
+
+def _get_bootstrap_pool():
+    # one pool for the whole run, creating a pool per metric used to dominate aggregation time
+    global _bootstrap_pool
+    if _bootstrap_pool is None:
+        import atexit
+        import multiprocessing as mp
+
+        _bootstrap_pool = mp.Pool(mp.cpu_count())
+        atexit.register(_bootstrap_pool.terminate)
+    return _bootstrap_pool
+
+
+def bootstrap_stderr(f, xs, iters, seed=BOOTSTRAP_SEED):
     # this gives a biased estimate of the stderr (i.e w/ the mean, it gives something
     # equivalent to stderr calculated without Bessel's correction in the stddev.
     # Unfortunately, I haven't been able to figure out what the right correction is
     # to make the bootstrap unbiased - i considered multiplying by sqrt(n/(n-1)) but
     # that would be ad-hoc and I can't prove that that would actually be an unbiased estimator)
     # Thankfully, shouldn't matter because our samples are pretty big usually anyways
+    if f in _VECTORIZED_BOOTSTRAP:
+        try:
+            statistic = _VECTORIZED_BOOTSTRAP[f](xs)
+        except (ValueError, TypeError) as e:
+            eval_logger.debug(f"Falling back to the pool bootstrap for {f.__name__}: {e}")
+        else:
+            return _vectorized_bootstrap_stderr(statistic, len(xs), iters, seed)
+
+    # corpus-level metrics such as bleu/chrf/ter cannot be vectorized, resample them in the worker pool
+    pool = _get_bootstrap_pool()
     res = []
     chunk_size = min(1000, iters)
     from tqdm import tqdm
@@ -413,14 +524,13 @@ def bootstrap_stderr(f, xs, iters):
     for bootstrap in tqdm(
         pool.imap(
             _bootstrap_internal(f, chunk_size),
-            [(i, xs) for i in range(iters // chunk_size)],
+            [(seed + i, xs) for i in range(iters // chunk_size)],
         ),
         total=iters // chunk_size,
     ):
         # sample w replacement
         res.extend(bootstrap)
 
-    pool.close()
     return sample_stddev(res)
 
 
@@ -441,3 +551,12 @@ def stderr_for_metric(metric, bootstrap_iters):
     stderr = {mean: mean_stderr, acc_all: acc_all_stderr}
 
     return stderr.get(metric, None)
+
+
+_VECTORIZED_BOOTSTRAP = {
+    mean: _bootstrap_mean,
+    median: _bootstrap_median,
+    perplexity: _bootstrap_perplexity,
+    f1_score: _bootstrap_f1,
+    matthews_corrcoef: _bootstrap_matthews_corrcoef,
+}
@@ -6,6 +6,7 @@ from sqlitedict import SqliteDict
 import json
 import hashlib
 from lmms_eval.api.instance import Instance
+from lmms_eval.api.prefetch import VisualPrefetcher
 from tqdm import tqdm
 from lmms_eval import utils
 
@@ -108,6 +109,21 @@ class lmms(abc.ABC):
     def set_cache_hook(self, cache_hook) -> None:
         self.cache_hook = cache_hook
 
+    # number of chunks whose visuals are loaded ahead of generation by `prefetch_visuals`, 0 loads them inline
+    prefetch_depth: int = 0
+    prefetch_workers: int = 2
+
+    def prefetch_visuals(self, chunks, load_fn):
+        """Yields `(chunk, load_fn(chunk))` for every chunk, loading the next `prefetch_depth` chunks in the background.
+
+        `load_fn` should only do CPU work (`doc_to_visual`, decoding, image preprocessing) and must not
+        touch the GPU. The stall time and queue depth are logged at the end and kept in `self.prefetch_stats`.
+        """
+        prefetcher = VisualPrefetcher(chunks, load_fn, depth=self.prefetch_depth, num_workers=self.prefetch_workers)
+        self.prefetch_stats = prefetcher.stats
+        yield from prefetcher
+        prefetcher.log_stats(f"{type(self).__name__} visual prefetch")
+
 
 ### SQLite-based caching of LMM responses
 def hash_args(attr, args):
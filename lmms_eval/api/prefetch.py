@@ -0,0 +1,95 @@
+"""Background prefetching of visual inputs for local model adapters.
+
+`doc_to_visual` (PIL decode, `.convert("RGB")`, video frame reads) and the image
+preprocessing of an adapter are CPU work. Run inline, the GPU waits for them before
+every batch. `VisualPrefetcher` runs the loading of the next `depth` chunks on a
+thread pool while the current chunk generates, and yields chunks in their original
+order. Adapters opt in through `lmms.prefetch_visuals`.
+"""
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Tuple
+
+from loguru import logger as eval_logger
+
+
+@dataclass
+class PrefetchStats:
+    """Counters collected while iterating a `VisualPrefetcher`."""
+
+    chunks: int = 0
+    # total time the consumer waited for a chunk that was not loaded yet
+    stall_time: float = 0.0
+    # sum / max of the number of chunks already loaded ahead of the one being taken
+    queue_depth_sum: int = 0
+    queue_depth_max: int = 0
+
+    @property
+    def mean_queue_depth(self) -> float:
+        return self.queue_depth_sum / self.chunks if self.chunks else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "chunks": self.chunks,
+            "stall_time": round(self.stall_time, 3),
+            "mean_queue_depth": round(self.mean_queue_depth, 3),
+            "max_queue_depth": self.queue_depth_max,
+        }
+
+
+class VisualPrefetcher:
+    """Iterates `(chunk, load_fn(chunk))`, loading up to `depth` chunks ahead on `num_workers` threads.
+
+    With `depth=0` chunks are loaded inline on the calling thread, which is the old behaviour,
+    but the stall time is still recorded so both modes can be compared.
+    """
+
+    def __init__(self, chunks: Iterable[Any], load_fn: Callable[[Any], Any], depth: int = 2, num_workers: int = 2) -> None:
+        self.chunks = chunks
+        self.load_fn = load_fn
+        self.depth = max(0, int(depth))
+        self.num_workers = max(1, int(num_workers))
+        self.stats = PrefetchStats()
+
+    def _take(self, get: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        loaded = get()
+        self.stats.stall_time += time.perf_counter() - start
+        self.stats.chunks += 1
+        return loaded
+
+    def __iter__(self) -> Iterator[Tuple[Any, Any]]:
+        if self.depth == 0:
+            for chunk in self.chunks:
+                yield chunk, self._take(lambda: self.load_fn(chunk))
+            return
+
+        chunk_iter = iter(self.chunks)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="visual_prefetch") as executor:
+
+            def fill():
+                # keep the current chunk plus `depth` chunks ahead in flight
+                while len(pending) <= self.depth:
+                    chunk = next(chunk_iter, _EXHAUSTED)
+                    if chunk is _EXHAUSTED:
+                        return
+                    pending.append((chunk, executor.submit(self.load_fn, chunk)))
+
+            fill()
+            while pending:
+                chunk, future = pending.popleft()
+                ready = sum(1 for _, f in pending if f.done())
+                self.stats.queue_depth_sum += ready
+                self.stats.queue_depth_max = max(self.stats.queue_depth_max, ready)
+                loaded = self._take(future.result)
+                fill()
+                yield chunk, loaded
+
+    def log_stats(self, desc: str = "Visual prefetch") -> None:
+        eval_logger.info(f"{desc}: {self.stats.as_dict()}")
+
+
+_EXHAUSTED = object()
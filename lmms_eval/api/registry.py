@@ -1,11 +1,13 @@
+import importlib
+
 from lmms_eval.api.model import lmms
 
 from typing import Callable, Dict
-import evaluate as hf_evaluate
 
 from loguru import logger as eval_logger
 
 MODEL_REGISTRY = {}
+LAZY_MODEL_REGISTRY = {}  # Key: model name, Value: module that registers the model when imported
 
 
 def register_model(*names):
@@ -24,14 +26,28 @@ def register_model(*names):
     return decorate
 
 
+def register_lazy_model(name, module_path):
+    # the module is only imported once `get_model` is asked for `name`
+    if name not in LAZY_MODEL_REGISTRY:
+        LAZY_MODEL_REGISTRY[name] = module_path
+
+
 def get_model(model_name):
+    if model_name not in MODEL_REGISTRY and model_name in LAZY_MODEL_REGISTRY:
+        module_path = LAZY_MODEL_REGISTRY[model_name]
+        try:
+            importlib.import_module(module_path)
+        except ImportError as e:
+            raise ImportError(f"Failed to import model '{model_name}' from {module_path}, please check that its dependencies are installed: {e}") from e
     try:
         return MODEL_REGISTRY[model_name]
     except KeyError:
-        raise ValueError(f"Attempted to load model '{model_name}', but no model for this name found! Supported model names: {', '.join(MODEL_REGISTRY.keys())}")
+        supported = sorted(set(MODEL_REGISTRY) | set(LAZY_MODEL_REGISTRY))
+        raise ValueError(f"Attempted to load model '{model_name}', but no model for this name found! Supported model names: {', '.join(supported)}")
 
 
 TASK_REGISTRY = {}  # Key: task name, Value: task ConfigurableTask class
+LAZY_TASK_REGISTRY = {}  # Key: task name, Value: yaml path of the task, moved to TASK_REGISTRY when the task is built
 GROUP_REGISTRY = {}  # Key: group name, Value: list of task names or group names
 ALL_TASKS = set()  # Set of all task names and group names
 func2task_index = {}  # Key: task ConfigurableTask class, Value: task name
@@ -49,6 +65,12 @@ def register_task(name):
     return decorate
 
 
+def register_lazy_task(name, yaml_path):
+    assert name not in TASK_REGISTRY and name not in LAZY_TASK_REGISTRY, f"task named '{name}' conflicts with existing registered task!"
+    LAZY_TASK_REGISTRY[name] = yaml_path
+    ALL_TASKS.add(name)
+
+
 def register_group(name):
     def decorate(fn):
         func_name = func2task_index[fn.__name__]
@@ -113,6 +135,8 @@ def get_metric(name: str, hf_evaluate_metric=False) -> Callable:
             eval_logger.warning(f"Could not find registered metric '{name}' in lm-eval, searching in HF Evaluate library...")
 
     try:
+        import evaluate as hf_evaluate
+
         metric_object = hf_evaluate.load(name)
         return metric_object.compute
     except Exception:
@@ -0,0 +1,141 @@
+"""Concurrent request engine shared by the API-backed models (gpt4v, claude, gemini_api, qwen_vl_api).
+
+The API models used to send one blocking request per instance and sleep a fixed
+number of seconds between retries. `RequestEngine` keeps up to `max_in_flight`
+requests open at once, throttles them with a token bucket, retries failures with
+exponential backoff plus jitter and hands the results back in input order.
+
+Threads are used rather than asyncio because the vendor SDKs (anthropic,
+google.generativeai, dashscope) and `requests` are all blocking.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, List, Optional, Sequence
+
+from loguru import logger as eval_logger
+
+
+class PermanentRequestError(Exception):
+    """Raised by `send` for a failure that retrying cannot fix (e.g. an HTTP 400): the item gets the fallback at once."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `capacity` stored."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Block until `tokens` tokens are available, then take them."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RequestEngine:
+    """Runs `send` over many items concurrently, with rate limiting and retries.
+
+    :param max_in_flight: maximum number of requests open at the same time.
+    :param requests_per_second: token-bucket rate; `None` disables rate limiting.
+    :param burst: token-bucket capacity, defaults to `max(1, requests_per_second)`.
+    :param max_retries: number of attempts per item before giving up.
+    :param base_delay: backoff before the first retry, doubled after every failure.
+    :param max_delay: upper bound of a single backoff.
+    :param fallback: result used for an item whose attempts all failed.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 8,
+        requests_per_second: Optional[float] = None,
+        burst: Optional[float] = None,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        fallback: Any = "",
+    ) -> None:
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be at least 1, got {max_in_flight}")
+        if max_retries < 1:
+            raise ValueError(f"max_retries must be at least 1, got {max_retries}")
+        self.max_in_flight = int(max_in_flight)
+        self.rate_limiter = TokenBucket(requests_per_second, burst) if requests_per_second else None
+        self.max_retries = int(max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.fallback = fallback
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retry number `attempt + 1`: full jitter over an exponentially growing window."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2**attempt)))
+
+    def _call_with_retries(self, send: Callable[[Any], Any], payload: Any, index: int) -> Any:
+        for attempt in range(self.max_retries):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                return send(payload)
+            except PermanentRequestError as e:
+                eval_logger.error(f"Request {index}: failed with an error that retrying cannot fix: {str(e)}")
+                return self.fallback
+            except Exception as e:
+                if attempt < self.max_retries - 1:
+                    delay = self.backoff(attempt)
+                    eval_logger.info(f"Request {index}: attempt {attempt + 1} failed with error: {str(e)}. Retrying in {delay:.1f}s")
+                    time.sleep(delay)
+                else:
+                    eval_logger.error(f"Request {index}: all {self.max_retries} attempts failed. Last error message: {str(e)}")
+        return self.fallback
+
+    def _run_one(self, send, prepare, item, index):
+        if prepare is not None:
+            try:
+                item = prepare(item)
+            except Exception as e:
+                eval_logger.error(f"Request {index}: failed to build the payload: {str(e)}")
+                return self.fallback
+        return self._call_with_retries(send, item, index)
+
+    def run(
+        self,
+        send: Callable[[Any], Any],
+        items: Sequence[Any],
+        prepare: Optional[Callable[[Any], Any]] = None,
+        on_result: Optional[Callable[[int, Any], None]] = None,
+        pbar=None,
+    ) -> List[Any]:
+        """Call `send(prepare(item))` for every item and return the results in the order of `items`.
+
+        `prepare` runs once per item inside the worker (e.g. to encode images) and is not
+        retried; `send` is retried on any exception but `PermanentRequestError`. `on_result(index, result)` is called
+        from the calling thread as results complete, so it may write caches without locking.
+        """
+        results = [self.fallback] * len(items)
+        if len(items) == 0:
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(items))) as executor:
+            futures = {executor.submit(self._run_one, send, prepare, item, index): index for index, item in enumerate(items)}
+            for future in as_completed(futures):
+                index = futures[future]
+                results[index] = future.result()
+                if on_result is not None:
+                    on_result(index, results[index])
+                if pbar is not None:
+                    pbar.update(1)
+        return results
@@ -0,0 +1,143 @@
+"""Per-sample logs: streaming shards written by `--log_samples --log_samples_format jsonl` (or `jsonl.zst`), and score files for every format.
+
+Every rank writes the samples of a task to its own JSON-lines shard,
+`{task}_rank{rank}_of{world_size}.jsonl` (or `.jsonl.zst` when compressed), as soon as
+they are produced in the postprocessing loop, so no rank keeps its samples in memory
+and nothing has to be gathered to rank 0. Once all ranks are done, rank 0 writes
+`{task}.index.json` next to the shards:
+
+    {"args": ..., "model_configs": ..., "time": ..., "format": "jsonl", "shards": [{"file": ..., "num_samples": ...}, ...]}
+
+`iter_samples` reads an index (or a single shard, or a legacy `{task}.json` log) lazily,
+one sample at a time. Whatever the format, every rank also writes
+`{task}_rank{rank}_of{world_size}.scores.jsonl`, which holds only the doc id and the numeric
+metrics of each sample; `iter_scores` reads it so that score analyses (e.g.
+`data_curation_pipeline`) never parse docs or responses. With the default `json` format, the
+samples are still gathered into `{task}.json`, and `{task}.index.json` (format "json") points to
+that log and to the score files.
+"""
+import io
+import json
+import numbers
+import os
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+SAMPLE_LOG_FORMATS = ["json", "jsonl", "jsonl.zst"]
+INDEX_SUFFIX = ".index.json"
+
+
+def handle_non_serializable(o: Any) -> Any:
+    if isinstance(o, np.int64) or isinstance(o, np.int32):
+        return int(o)
+    elif isinstance(o, set):
+        return list(o)
+    else:
+        return str(o)
+
+
+def _open_zstd(path: str, mode: str):
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("Compressed sample logs need the `zstandard` package, install it with `pip install zstandard`") from e
+    if mode == "w":
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True), encoding="utf-8")
+    return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True), encoding="utf-8")
+
+
+class ScoreLogWriter:
+    """Appends the doc id and numeric metrics of the samples of one task on one rank to a JSON-lines score file."""
+
+    def __init__(self, output_dir: str, task_name: str, rank: int = 0, world_size: int = 1) -> None:
+        os.makedirs(output_dir, exist_ok=True)
+        self.scores_file = f"{task_name}_rank{rank}_of{world_size}.scores.jsonl"
+        self.num_samples = 0
+        self._scores_f = open(os.path.join(output_dir, self.scores_file), "w", encoding="utf-8")
+
+    def write(self, sample: Dict[str, Any], scores: Dict[str, Any] = None) -> None:
+        """Appends the numeric `scores` (the metrics returned by `process_results`) of `sample`."""
+        numeric = {k: float(v) for k, v in (scores or {}).items() if isinstance(v, numbers.Real)}
+        self._scores_f.write(json.dumps({"doc_id": sample["doc_id"], **numeric}) + "\n")
+        self.num_samples += 1
+
+    def close(self) -> Dict[str, Any]:
+        """Closes the score file and returns its entry for the index."""
+        self._scores_f.close()
+        return {"scores_file": self.scores_file, "num_samples": self.num_samples}
+
+
+class SampleLogWriter(ScoreLogWriter):
+    """Appends the samples of one task on one rank to a JSON-lines shard, and their scores to a score file."""
+
+    def __init__(self, output_dir: str, task_name: str, rank: int = 0, world_size: int = 1, format: str = "jsonl") -> None:
+        assert format in ["jsonl", "jsonl.zst"], f"Unsupported streaming sample log format {format}"
+        super().__init__(output_dir, task_name, rank=rank, world_size=world_size)
+        self.file = f"{task_name}_rank{rank}_of{world_size}.{format}"
+        self.path = os.path.join(output_dir, self.file)
+        self._f = _open_zstd(self.path, "w") if format == "jsonl.zst" else open(self.path, "w", encoding="utf-8")
+
+    def write(self, sample: Dict[str, Any], scores: Dict[str, Any] = None) -> None:
+        """Appends `sample`, and its numeric `scores` to the score file."""
+        self._f.write(json.dumps(sample, default=handle_non_serializable, ensure_ascii=False) + "\n")
+        super().write(sample, scores)
+
+    def close(self) -> Dict[str, Any]:
+        """Closes the shard and returns its entry for the index."""
+        self._f.close()
+        return {"file": self.file, **super().close()}
+
+
+def write_sample_index(output_dir: str, task_name: str, shards: List[Dict[str, Any]], format: str = "jsonl", **header) -> str:
+    """Writes `{task_name}.index.json`, listing the shards of a task in rank order. `header` holds args, configs and time.
+
+    With the "json" format, the shards only have score files and the header names the `log_file` holding the samples.
+    """
+    path = os.path.join(output_dir, f"{task_name}{INDEX_SUFFIX}")
+    index = {**header, "format": format, "num_samples": sum(shard["num_samples"] for shard in shards), "shards": shards}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=4, default=handle_non_serializable, ensure_ascii=False)
+    return path
+
+
+def read_sample_index(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _iter_shard(path: str) -> Iterator[Dict[str, Any]]:
+    with _open_zstd(path, "r") if path.endswith(".zst") else open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_scores(path: str) -> Iterator[Dict[str, Any]]:
+    """Yields `{"doc_id", <metric>: float, ...}` for every sample of an index, falling back to the samples for older logs."""
+    if path.endswith(".json") and not path.endswith(INDEX_SUFFIX) and os.path.exists(path[: -len(".json")] + INDEX_SUFFIX):
+        # a json log with an index next to it, its scores are in the score files
+        path = path[: -len(".json")] + INDEX_SUFFIX
+    if path.endswith(INDEX_SUFFIX):
+        index = read_sample_index(path)
+        if all("scores_file" in shard for shard in index["shards"]):
+            for shard in index["shards"]:
+                yield from _iter_shard(os.path.join(os.path.dirname(path), shard["scores_file"]))
+            return
+    yield from iter_samples(path)
+
+
+def iter_samples(path: str) -> Iterator[Dict[str, Any]]:
+    """Yields the logged samples of `path`, which is an index file, a single shard or a legacy `{task}.json` log."""
+    if path.endswith(INDEX_SUFFIX):
+        index = read_sample_index(path)
+        if index["format"] == "json":
+            yield from iter_samples(os.path.join(os.path.dirname(path), index["log_file"]))
+            return
+        for shard in index["shards"]:
+            yield from _iter_shard(os.path.join(os.path.dirname(path), shard["file"]))
+    elif path.endswith(".jsonl") or path.endswith(".jsonl.zst"):
+        yield from _iter_shard(path)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)["logs"]
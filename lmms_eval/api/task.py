@@ -1,5 +1,6 @@
 import abc
 import ast
+import copy
 import itertools
 import json
 
@@ -11,7 +12,7 @@ import subprocess
 from collections.abc import Callable
 from dataclasses import dataclass, field, asdict
 from glob import glob
-from typing import Any, List, Union
+from typing import Any, List, Tuple, Union
 
 import datasets
 import numpy as np
@@ -24,7 +25,7 @@ from tqdm import tqdm
 from accelerate import Accelerator
 from lmms_eval import utils
 from lmms_eval.api import samplers
-from lmms_eval.api.instance import Instance
+from lmms_eval.api.instance import Instance, InstanceStore, group_by_doc_id
 from lmms_eval.api.registry import (
     AGGREGATION_REGISTRY,
     DEFAULT_METRIC_REGISTRY,
@@ -50,6 +51,25 @@ ALL_OUTPUT_TYPES = [
 ]
 
 
+def remove_image_columns(dataset: datasets.Dataset) -> datasets.Dataset:
+    """Returns a column-projected view of `dataset` without Image/Sequence(Image) features.
+
+    The projection only drops columns from the underlying Arrow table, so no data is
+    copied or reloaded, and iterating over the view never decodes images.
+    """
+    remove_cols = []
+    features = dataset.features
+    # If it is an Image instance or a Sequence of Image instance. Remove it
+    for feature in features:
+        if isinstance(features[feature], Image):
+            remove_cols.append(feature)
+        elif isinstance(features[feature], Sequence) and isinstance(features[feature].feature, Image):
+            remove_cols.append(feature)
+    if remove_cols:
+        dataset = dataset.remove_columns(remove_cols)
+    return dataset
+
+
 @dataclass
 class TaskConfig(dict):
     # task naming/registry
@@ -75,6 +95,10 @@ class TaskConfig(dict):
     doc_to_target: Union[Callable, str] = None
     doc_to_choice: Union[Callable, str, dict, list] = None
     process_results: Union[Callable, str] = None
+    prefetch_results: Callable = None
+    # docs sharing the value of this field are scored together by process_group_results
+    doc_group_key: str = None
+    process_group_results: Callable = None
     use_prompt: str = None
     description: str = ""
     target_delimiter: str = " "
@@ -96,6 +120,8 @@ class TaskConfig(dict):
     model_specific_prompt_kwargs: dict = None
     model_specific_generation_kwargs: dict = None
     model_specific_target_kwargs: dict = None
+    # keep image columns in the docs passed to process_results (e.g. for gpt-4v judged tasks)
+    process_results_use_image: bool = False
 
     def __post_init__(self) -> None:
         if self.dataset_path and os.path.exists(os.path.dirname(self.dataset_path)):
@@ -204,6 +230,7 @@ class Task(abc.ABC):
         self._training_docs = None
         self._fewshot_docs = None
         self._instances = None
+        self._instances_by_doc_id = None
 
         self._config = TaskConfig({**config}) if config else TaskConfig()
 
@@ -241,24 +268,14 @@ class Task(abc.ABC):
             cache_dir=cache_dir,
             download_mode=download_mode,
         )
-        self.dataset_no_image = datasets.load_dataset(
-            path=self.DATASET_PATH,
-            name=self.DATASET_NAME,
-            data_dir=data_dir,
-            cache_dir=cache_dir,
-            download_mode=download_mode,
-        )
-        for doc_name in self.dataset_no_image:
-            remove_cols = []
-            features = self.dataset_no_image[doc_name].features
-            # If it is an Image instance or a Sequence of Image instance. Remove it
-            for feature in features:
-                if isinstance(features[feature], Image):
-                    remove_cols.append(feature)
-                elif isinstance(features[feature], Sequence) and isinstance(features[feature].feature, Image):
-                    remove_cols.append(feature)
-            for remove_col in remove_cols:
-                self.dataset_no_image[doc_name] = self.dataset_no_image[doc_name].remove_columns(remove_col)
+        self._dataset_no_image = None
+
+    @property
+    def dataset_no_image(self):
+        """Text-only view of `self.dataset`, projected lazily from the single loaded copy."""
+        if getattr(self, "_dataset_no_image", None) is None:
+            self._dataset_no_image = datasets.DatasetDict({split: remove_image_columns(docs) for split, docs in self.dataset.items()})
+        return self._dataset_no_image
 
     @property
     def config(self):
@@ -333,6 +350,13 @@ class Task(abc.ABC):
         """
         return self._instances
 
+    @property
+    def instances_by_doc_id(self):
+        """Instances grouped by `doc_id` and sorted by `idx`, built alongside `task.instances`."""
+        if self._instances_by_doc_id is None and self._instances is not None:
+            self._instances_by_doc_id = group_by_doc_id(self._instances)
+        return self._instances_by_doc_id
+
     def fewshot_examples(self, k, rnd):
         if self._training_docs is None:
             self._training_docs = list(self.training_docs())
@@ -364,7 +388,7 @@ class Task(abc.ABC):
             assert False, f"Task dataset (path={self.DATASET_PATH}, name={self.DATASET_NAME}) must have valid or test docs!"
 
         eval_logger.info(f"Building contexts for task {self.CONFIG.task} on rank {rank}...")
-        instances = []
+        instances = InstanceStore(self.config["task"], split, self.config.repeats)
         doc_id_iterator = utils.create_iterator([i for i in range(len(docs))], rank, world_size, limit)
         doc_id_iterator, doc_id_iterator_counting = itertools.tee(doc_id_iterator)
         total_docs = sum(1 for _ in doc_id_iterator_counting)
@@ -379,12 +403,31 @@ class Task(abc.ABC):
             if not isinstance(inst, list):
                 inst = [inst]
 
-            instances.extend(inst)
+            for i in inst:
+                instances.append(i)
             pbar.update(1)
 
         pbar.close()
         self._instances = instances
         assert len(self._instances) != 0, "task.build_requests() did not find any docs!"
+        self._instances_by_doc_id = group_by_doc_id(self._instances)
+        self._requests_built_for = (limit, rank, world_size)
+
+    def reuse_requests(self, limit=None, rank=None, world_size=None) -> bool:
+        """Clears the responses of the instances built by a previous `build_all_requests` with the same arguments.
+
+        Returns False when there are no such instances and `build_all_requests` has to run. Used when the
+        same task object is evaluated with several models, see `lmms_eval.sweep`.
+        """
+        if self._instances is None or getattr(self, "_requests_built_for", None) != (limit, rank, world_size):
+            return False
+        if isinstance(self._instances, InstanceStore):
+            self._instances.clear_resps()
+        else:
+            for inst in self._instances:
+                inst.resps = []
+                inst.filtered_resps = {}
+        return True
 
     @abc.abstractmethod
     def construct_requests(self, doc_id, ctx, **kwargs):
@@ -540,8 +583,8 @@ class ConfigurableTask(Task):
     CONFIG = None
 
     def __init__(self, model_name) -> None:  # TODO no super() call here
-        # Get pre-configured attributes
-        self._config = self.CONFIG
+        # Get pre-configured attributes, copied so that model-specific and command line overrides stay on this instance
+        self._config = copy.deepcopy(self.CONFIG)
         # different model requires different prompt, we have to take those into account.
 
         self.model_name = model_name
@@ -560,6 +603,8 @@ class ConfigurableTask(Task):
         self.download(self.config.dataset_kwargs)
         self._training_docs = None
         self._fewshot_docs = None
+        self._instances = None
+        self._instances_by_doc_id = None
 
         if self.config.filter_list is not None:
             self._filters = []
@@ -585,6 +630,8 @@ class ConfigurableTask(Task):
         else:
             assert False, f"Task dataset (path={self.DATASET_PATH}, name={self.DATASET_NAME}) must have valid or test docs!"
 
+        self._task_docs_no_image = None
+
         # Test One Doc
         self.features = list(self.task_docs.features.keys())
         self.multiple_input = 0
@@ -627,29 +674,44 @@ class ConfigurableTask(Task):
                 elif (not delimiter_has_whitespace) and (not choice_has_whitespace):
                     eval_logger.warning(f'Both target_delimiter "{self.config.target_delimiter}" and target choice: "{choice}" do not have whitespace, ignore if the language you are evaluating on does not require/use whitespace')
 
-    def _prepare_model_specific_config(self):
-        self.model_specific_prompt_kwargs = self.config.model_specific_prompt_kwargs
-        if self.model_specific_prompt_kwargs is not None:
-            if self.model_name in self.model_specific_prompt_kwargs:
-                self.model_specific_prompt_kwargs = self.model_specific_prompt_kwargs[self.model_name]
-            else:
-                self.model_specific_prompt_kwargs = self.model_specific_prompt_kwargs.get("default", None)
+    def _model_specific_kwargs(self, model_name):
+        """Returns the (prompt, target, generation) kwargs that the config selects for `model_name`."""
+        resolved = []
+        for kwargs, default in [
+            (self.CONFIG.model_specific_prompt_kwargs, None),
+            (self.CONFIG.model_specific_target_kwargs, None),
+            (self.CONFIG.model_specific_generation_kwargs, {}),
+        ]:
+            if kwargs is not None:
+                kwargs = kwargs[model_name] if model_name in kwargs else kwargs.get("default", default)
+            resolved.append(kwargs)
+        return tuple(resolved)
+
+    def model_specific_signature(self, model_name) -> str:
+        """Key that is equal for two model names iff they get the same prompts, targets and generation kwargs."""
+        return json.dumps(self._model_specific_kwargs(model_name), sort_keys=True, default=str)
 
-        self.model_specific_target_kwargs = self.config.model_specific_target_kwargs
-        if self.model_specific_target_kwargs is not None:
-            if self.model_name in self.model_specific_target_kwargs:
-                self.model_specific_target_kwargs = self.model_specific_target_kwargs[self.model_name]
-            else:
-                self.model_specific_target_kwargs = self.model_specific_target_kwargs.get("default", None)
-        self.model_specific_generation_kwargs = self.config.model_specific_generation_kwargs
+    def _prepare_model_specific_config(self):
+        self.model_specific_prompt_kwargs, self.model_specific_target_kwargs, self.model_specific_generation_kwargs = self._model_specific_kwargs(self.model_name)
         if self.model_specific_generation_kwargs is not None:
-            if self.model_name in self.model_specific_generation_kwargs:
-                self.model_specific_generation_kwargs = self.model_specific_generation_kwargs[self.model_name]
-            else:
-                self.model_specific_generation_kwargs = self.model_specific_generation_kwargs.get("default", {})
-
             self.config.generation_kwargs.update(self.model_specific_generation_kwargs)
 
+    def for_model(self, model_name) -> "ConfigurableTask":
+        """Returns a copy of this task configured for `model_name`, sharing the downloaded dataset and docs.
+
+        The copy has a fresh config and no instances, so it can be evaluated alongside this task.
+        """
+        task = copy.copy(self)
+        task._config = copy.deepcopy(self.CONFIG)
+        task.model_name = model_name
+        task._prepare_model_specific_config()
+        task._instances = None
+        task._instances_by_doc_id = None
+        task._requests_built_for = None
+        if task.config.fewshot_config is not None:
+            task.sampler = samplers.get_sampler(task.config.fewshot_config.get("sampler", "default"))(list(task.fewshot_docs()), task, rnd=random.Random(1234))
+        return task
+
     def _prepare_metric_and_aggregation(self):
         self._metric_fn_list = {}
         self._metric_fn_kwargs = {}
@@ -763,8 +825,7 @@ class ConfigurableTask(Task):
                 downloaded_video_ids = [i.split(".mp4")[0] for i in os.listdir(os.path.expanduser(video_path)) if i.endswith(".mp4")]
                 # Filtered the existing dataset with the downloaded video ids
                 self.dataset = datasets.DatasetDict({split: self.all_dataset[split].filter(lambda x: x["videoID"] in downloaded_video_ids)})
-
-                self.dataset_no_image = self.dataset
+                self._dataset_no_image = None
                 dataset_kwargs.pop("From_YouTube")
                 return
 
@@ -857,24 +918,7 @@ class ConfigurableTask(Task):
             download_config=download_config,
             **dataset_kwargs if dataset_kwargs is not None else {},
         )
-        self.dataset_no_image = datasets.load_dataset(
-            path=self.DATASET_PATH,
-            name=self.DATASET_NAME,
-            download_mode=datasets.DownloadMode.REUSE_DATASET_IF_EXISTS,
-            download_config=download_config,
-            **dataset_kwargs if dataset_kwargs is not None else {},
-        )
-        for doc_name in self.dataset_no_image:
-            remove_cols = []
-            features = self.dataset_no_image[doc_name].features
-            # If it is an Image instance or a Sequence of Image instance. Remove it
-            for feature in features:
-                if isinstance(features[feature], Image):
-                    remove_cols.append(feature)
-                elif isinstance(features[feature], Sequence) and isinstance(features[feature].feature, Image):
-                    remove_cols.append(feature)
-            for remove_col in remove_cols:
-                self.dataset_no_image[doc_name] = self.dataset_no_image[doc_name].remove_columns(remove_col)
+        self._dataset_no_image = None
 
     def has_training_docs(self) -> bool:
         if self.config.training_split is not None:
@@ -912,6 +956,13 @@ class ConfigurableTask(Task):
                 return self.config.process_docs(self.dataset[self.config.test_split])
             return self.dataset[self.config.test_split]
 
+    @property
+    def task_docs_no_image(self) -> datasets.Dataset:
+        """Column-projected view of `self.task_docs` without image features, for text-only access."""
+        if self._task_docs_no_image is None:
+            self._task_docs_no_image = remove_image_columns(self.task_docs)
+        return self._task_docs_no_image
+
     def fewshot_docs(self):
         if self.config.fewshot_split is not None:
             return self.dataset[self.config.fewshot_split]
@@ -1097,7 +1148,7 @@ class ConfigurableTask(Task):
         if self.OUTPUT_TYPE == "loglikelihood":
             arguments = (ctx, self.doc_to_target, self.doc_to_visual, doc_id, self.config.task, split)
         elif self.OUTPUT_TYPE == "multiple_choice":
-            doc = self.dataset[split][doc_id]
+            doc = self.dataset_no_image[split][doc_id]
             choices = self.doc_to_choice(doc)
             target_delimiter = self.config.target_delimiter
             if self.multiple_input:
@@ -1143,17 +1194,40 @@ class ConfigurableTask(Task):
             arguments = (ctx, self.config.generation_kwargs, self.doc_to_visual, doc_id, self.config.task, split)
         return Instance(request_type=self.OUTPUT_TYPE, arguments=arguments, idx=0, **kwargs)
 
-    # TODO: we add a full_docs interface here for some evaluations that needs to access the full datasets during process_results function. we may have better ways to handle this.
+    def prefetch_results(self, docs, results) -> None:
+        """Passes all `docs` and their results at once to the task's `prefetch_results`, ahead of `process_results`."""
+        if not callable(self.config.prefetch_results):
+            return
+        if self.OUTPUT_TYPE == "generate_until":
+            results = [[result[0].strip()] + result[1:] for result in results]
+        self.config.prefetch_results(docs, results)
+
+    def doc_group(self, doc):
+        """Group of `doc` when the task sets `doc_group_key`, the docs of a group are scored together."""
+        return doc[self.config.doc_group_key]
+
+    def process_group_results(self, docs, results) -> List[Tuple[List[int], dict]]:
+        """Scores a complete group of `docs` with their `results`.
+
+        Returns one `(positions, metrics)` per sample of the group, `positions` being the indices in
+        `docs` of the docs the sample comes from. Without `process_group_results` in the config,
+        every doc is scored alone by `process_results`.
+        """
+        if not callable(self.config.process_group_results):
+            return [([i], self.process_results(doc, result)) for i, (doc, result) in enumerate(zip(docs, results))]
+        if self.OUTPUT_TYPE == "generate_until":
+            results = [[result[0].strip()] + result[1:] for result in results]
+        entries = self.config.process_group_results(docs, results)
+        # a single dict of metrics is one sample made of the whole group
+        return [(list(range(len(docs))), entries)] if isinstance(entries, dict) else entries
+
     @retry(stop=(stop_after_attempt(5) | stop_after_delay(1200)), wait=wait_fixed(2))
-    def process_results(self, doc, results, full_docs=None):
+    def process_results(self, doc, results):
         if self.OUTPUT_TYPE == "generate_until":
             results[0] = results[0].strip()
 
-        kwargs = {}
-        if full_docs is not None:
-            kwargs["full_docs"] = full_docs
         if callable(self.config.process_results):
-            return self.config.process_results(doc, results, **kwargs)
+            return self.config.process_results(doc, results)
 
         result_dict = {}
         use_metric = list(self._metric_fn_list.keys())
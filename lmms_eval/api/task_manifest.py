@@ -0,0 +1,158 @@
+"""Cached index of the task yamls of a directory, used to register tasks without loading them.
+
+Registering the tasks of `lmms_eval/tasks` used to fully load every yaml twice (once for tasks,
+once for groups), re-parsing included templates and executing the `utils.py` of every
+`!function` tag, which imports the dependencies of every task before one is selected.
+`TaskManifest` keeps, for every yaml of a directory, the task or group it defines and the
+groups a task belongs to, read with a loader that leaves `!function` tags unresolved. It is
+stored under `LMMS_EVAL_TASK_MANIFEST_CACHE` (defaults to ~/.cache/lmms_eval/task_manifest)
+with the content hash of every yaml and included file, and an entry is only re-read when one
+of its files changed (a file whose size and mtime are unchanged is not even hashed).
+
+The yaml of a task is then fully loaded, and its functions imported, when the task is built.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+from loguru import logger as eval_logger
+
+MANIFEST_VERSION = 1
+MANIFEST_CACHE_DIR = os.getenv("LMMS_EVAL_TASK_MANIFEST_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "lmms_eval", "task_manifest"))
+
+
+class _ScanLoader(getattr(yaml, "CFullLoader", yaml.FullLoader)):
+    pass
+
+
+# keep `!function` tags as their names, nothing is imported while scanning
+_ScanLoader.add_constructor("!function", lambda loader, node: loader.construct_scalar(node))
+
+
+def _scan_yaml(yaml_path: str, deps: List[str]) -> dict:
+    """Config of `yaml_path` with its includes merged like `utils.load_yaml_config`, appending every file read to `deps`."""
+    deps.append(yaml_path)
+    with open(yaml_path, "rb") as f:
+        config = yaml.load(f, Loader=_ScanLoader)
+    assert config is not None, f"Failed to load yaml config from {yaml_path}"
+    if "include" not in config:
+        return config
+    include_path = config.pop("include")
+    if type(include_path) == str:
+        include_path = [include_path]
+    final_config = {}
+    for path in reversed(include_path):
+        if not os.path.isfile(path):
+            path = os.path.join(os.path.dirname(yaml_path), path)
+        final_config.update(_scan_yaml(path, deps))
+    final_config.update(config)
+    return final_config
+
+
+def _entry(config: dict) -> Optional[dict]:
+    """What registration needs from a config: a task and its groups, or a group and its task patterns."""
+    if "task" not in config:
+        return None
+    if type(config["task"]) == str:
+        groups = config.get("group", [])
+        return {"task": config["task"], "groups": [groups] if type(groups) == str else list(groups)}
+    if type(config["task"]) == list:
+        return {"group": config["group"], "tasks": config["task"]}
+    return None
+
+
+class TaskManifest:
+    """Entries of the yamls under `task_dir`, in `os.walk` order, rebuilt incrementally from the cached manifest."""
+
+    def __init__(self, task_dir: str, cache_dir: str = MANIFEST_CACHE_DIR) -> None:
+        self.task_dir = os.path.abspath(task_dir)
+        self.cache_path = os.path.join(cache_dir, hashlib.sha1(self.task_dir.encode("utf-8")).hexdigest() + ".json")
+        # path -> [mtime_ns, size, sha1] of the yamls and includes read
+        self.files: Dict[str, list] = {}
+        # yaml path -> {"entry": ..., "deps": {path: sha1}}
+        self.yamls: Dict[str, dict] = {}
+        self.rescanned = 0
+        self._load_cache()
+        self._update()
+
+    def _load_cache(self) -> None:
+        try:
+            with open(self.cache_path, "r") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        if cached.get("version") == MANIFEST_VERSION and cached.get("task_dir") == self.task_dir:
+            self.files = cached["files"]
+            self.yamls = cached["yamls"]
+
+    def _save_cache(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            # write then rename, so that concurrent ranks never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.cache_path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": MANIFEST_VERSION, "task_dir": self.task_dir, "files": self.files, "yamls": self.yamls}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            eval_logger.debug(f"Could not write the task manifest {self.cache_path}: {e}")
+
+    def _file_hash(self, path: str, checked: Dict[str, Optional[str]]) -> Optional[str]:
+        if path in checked:
+            return checked[path]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            checked[path] = None
+            return None
+        cached = self.files.get(path)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            checked[path] = cached[2]
+            return cached[2]
+        with open(path, "rb") as f:
+            sha1 = hashlib.sha1(f.read()).hexdigest()
+        self.files[path] = [stat.st_mtime_ns, stat.st_size, sha1]
+        checked[path] = sha1
+        return sha1
+
+    def _update(self) -> None:
+        checked = {}
+        yaml_paths = []
+        for root, subdirs, file_list in os.walk(self.task_dir):
+            for f in file_list:
+                if f.endswith(".yaml"):
+                    yaml_paths.append(os.path.join(root, f))
+
+        changed = set(self.yamls) != set(yaml_paths)
+        yamls = {}
+        for yaml_path in yaml_paths:
+            cached = self.yamls.get(yaml_path)
+            if cached is not None and all(self._file_hash(path, checked) == sha1 for path, sha1 in cached["deps"].items()):
+                yamls[yaml_path] = cached
+                continue
+            changed = True
+            self.rescanned += 1
+            deps = []
+            try:
+                entry = _entry(_scan_yaml(yaml_path, deps))
+            except Exception as error:
+                # Log this silently and show it only when
+                # the user defines the appropriate verbosity.
+                eval_logger.debug(f"Failed to load config in {yaml_path}. Config will not be added to registry\n" f"Error: {error}")
+                entry = None
+            yamls[yaml_path] = {"entry": entry, "deps": {path: self._file_hash(path, checked) for path in deps}}
+        self.yamls = yamls
+        # forget the files no yaml depends on anymore
+        used = {path for cached in yamls.values() for path in cached["deps"]}
+        if set(self.files) != used:
+            self.files = {path: signature for path, signature in self.files.items() if path in used}
+            changed = True
+        if changed:
+            self._save_cache()
+
+    def entries(self) -> List[Tuple[str, dict]]:
+        """(yaml path, entry) of the yamls that define a task or a group."""
+        return [(yaml_path, cached["entry"]) for yaml_path, cached in self.yamls.items() if cached["entry"] is not None]
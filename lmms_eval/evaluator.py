@@ -9,13 +9,14 @@ from tqdm import tqdm
 import torch
 
 import numpy as np
-from datasets import Image, Sequence
 
 import lmms_eval.api
 import lmms_eval.tasks
 import lmms_eval.models
 import lmms_eval.api.metrics
 import lmms_eval.api.registry
+from lmms_eval.api.journal import ResponseJournal, journal_fingerprint, run_requests_with_journal
+from lmms_eval.api.sample_log import SampleLogWriter, ScoreLogWriter
 
 from lmms_eval.utils import (
     positional_deprecated,
@@ -45,6 +46,11 @@ def simple_evaluate(
     gen_kwargs: str = None,
     cli_args=None,  # Bo: put args into more functions (cost 48 Bytes per call)
     predict_only: bool = False,
+    resume_dir: str = None,
+    log_samples_dir: str = None,
+    log_samples_format: str = "json",
+    task_dict: dict = None,
+    model_datasets: dict = None,
 ):
     """Instantiate and evaluate a model on a list of tasks.
 
@@ -74,6 +80,17 @@ def simple_evaluate(
     :param gen_kwargs: str
         String arguments for model generation
         Ignored for all tasks with loglikelihood output_type
+    :param resume_dir: str, optional
+        Directory of the per-task, per-rank response journals. Responses are appended as they are produced,
+        and a restarted run with the same directory only runs the requests that are missing
+    :param log_samples_dir: str, optional
+        Directory the per-rank sample shards are streamed to, see `lmms_eval.api.sample_log`
+    :param log_samples_format: str
+        "json" keeps the samples in memory and returns them under "samples", "jsonl" and "jsonl.zst" stream them to `log_samples_dir`
+    :param task_dict: dict, optional
+        Tasks already built for this model, used instead of loading `tasks`, see `lmms_eval.sweep`
+    :param model_datasets: dict, optional
+        Task name to the dataset view the model reads its docs from, defaults to `task.dataset`
     :return
         Dictionary of results
     """
@@ -99,14 +116,15 @@ def simple_evaluate(
         },
     )
 
-    task_dict = lmms_eval.tasks.get_task_dict(tasks, model_name=model)
+    if task_dict is None:
+        task_dict = lmms_eval.tasks.get_task_dict(tasks, model_name=model)
     for task_name in task_dict.keys():
         task_obj = task_dict[task_name]
         if type(task_obj) == tuple:
             group, task_obj = task_obj
             if task_obj is None:
                 continue
-        lm.task_dict[task_name] = task_obj.dataset
+        lm.task_dict[task_name] = model_datasets[task_name] if model_datasets and task_name in model_datasets else task_obj.dataset
 
         config = task_obj._config
         if config["output_type"] == "generate_until" and gen_kwargs:
@@ -138,6 +156,10 @@ def simple_evaluate(
         show_task_to_terminal=show_task_to_terminal,
         log_samples=log_samples,
         cli_args=cli_args,
+        resume_dir=resume_dir,
+        resume_header={"model": model if isinstance(model, str) else type(model).__name__, "model_args": model_args},
+        log_samples_dir=log_samples_dir,
+        log_samples_format=log_samples_format,
     )
 
     if lm.rank == 0:
@@ -169,6 +191,10 @@ def evaluate(
     show_task_to_terminal: bool = False,
     log_samples: bool = True,
     cli_args=None,
+    resume_dir: str = None,
+    resume_header: dict = None,
+    log_samples_dir: str = None,
+    log_samples_format: str = "json",
 ):
     """Instantiate and evaluate a model on a list of tasks.
 
@@ -184,6 +210,14 @@ def evaluate(
         If True, write out an example document and model input for checking task integrity
     :param log_samples: bool
         If True, write out all model outputs and documents for per-sample measurement and post-hoc analysis
+    :param resume_dir: str, optional
+        Directory of the response journals, see `lmms_eval.api.journal`
+    :param resume_header: dict, optional
+        Model and model arguments of the run, hashed with each task's config and `limit` into the header of its journal
+    :param log_samples_dir: str, optional
+        Directory the per-rank score files, and the sample shards when streaming, are written to, see `lmms_eval.api.sample_log`
+    :param log_samples_format: str
+        "json" keeps the samples in memory, "jsonl" and "jsonl.zst" stream them to `log_samples_dir`
     :return
         Dictionary of results
     """
@@ -196,6 +230,11 @@ def evaluate(
     configs = collections.defaultdict(dict)
     # logs info about each document evaluated.
     samples = collections.defaultdict(list)
+    # per-task sample shards of this rank, when samples are streamed to disk instead of kept in `samples`
+    stream_samples = log_samples and log_samples_format != "json"
+    if stream_samples:
+        assert log_samples_dir is not None, f"log_samples_dir is required to write {log_samples_format} sample logs"
+    sample_writers = {}
     # tracks all Instances/requests a model must generate output on.
     requests = collections.defaultdict(list)
     # Aggregated task scores presented with groups
@@ -212,6 +251,10 @@ def evaluate(
     task_group_alias = collections.defaultdict(dict)
     # store num-fewshot value per task
     num_fewshot = collections.defaultdict(int)
+    # header of each task's response journal, when resuming
+    journal_fingerprints = {}
+    if resume_header is None:
+        resume_header = {"model": type(lm).__name__}
 
     # get lists of each type of request
     for task_name, task in task_dict.items():
@@ -251,7 +294,11 @@ def evaluate(
                 raise RuntimeError("Task has neither test_docs nor validation_docs")
             limit = int(len(task_docs) * limit) if limit < 1.0 else int(limit)
 
-        task.build_all_requests(limit=limit, rank=lm.rank, world_size=lm.world_size)
+        if resume_dir is not None:
+            journal_fingerprints[task_name] = journal_fingerprint(**resume_header, config=configs[task_name], limit=limit)
+
+        if not task.reuse_requests(limit=limit, rank=lm.rank, world_size=lm.world_size):
+            task.build_all_requests(limit=limit, rank=lm.rank, world_size=lm.world_size)
 
         eval_logger.debug(f"Task: {task_name}; number of requests on rank {lm.rank}: {len(task.instances)}")
 
@@ -278,21 +325,33 @@ def evaluate(
             numpad = max(gathered_item) - gathered_item[lm.rank]
             padding_requests[task.OUTPUT_TYPE] += numpad
 
+    journal = None
+    if resume_dir is not None:
+        journal = ResponseJournal(resume_dir, rank=lm.rank, world_size=lm.world_size, fingerprints=journal_fingerprints)
+
     ### Run LMM on inputs, get all outputs ###
     # execute each type of request
     for reqtype, reqs in requests.items():
         eval_logger.info("Running {} requests".format(reqtype))
         # create `K` copies of each request `req` based off `K = req.repeats`
-        cloned_reqs = []
-        for req in reqs:
-            cloned_reqs.extend([req] * req.repeats)
+        if all(req.repeats == 1 for req in reqs):
+            # nothing to repeat, a copy keeps the padding below out of `requests`
+            cloned_reqs = list(reqs)
+        else:
+            cloned_reqs = []
+            for req in reqs:
+                cloned_reqs.extend([req] * req.repeats)
 
         if (lm.world_size > 1) and (padding_requests[reqtype] > 0):
+            last_req = reqs[-1]
             for _ in range(padding_requests[reqtype]):
-                cloned_reqs.extend([req] * req.repeats)
+                cloned_reqs.extend([last_req] * last_req.repeats)
 
         # run requests through model
-        resps = getattr(lm, reqtype)(cloned_reqs)  # Choiszt run generate until
+        if journal is not None:
+            resps = run_requests_with_journal(lm, reqtype, cloned_reqs, journal)
+        else:
+            resps = getattr(lm, reqtype)(cloned_reqs)  # Choiszt run generate until
 
         # put responses from model into a list of length K for each request.
         for x, req in zip(resps, cloned_reqs):
@@ -322,75 +381,141 @@ def evaluate(
         # TODO: make it possible to use a different metric per filter
         # iterate over different filters used
         for key in task.instances[0].filtered_resps.keys():
-            # hack: remove image columns to speed avoid loading images and speed up postprocessing
-            # reason: doc_iterator will actually load image if it's in the doc.
-            docs = task.test_docs() if task.has_test_docs() else task.validation_docs()
-            if "d170" not in task_name and "dc100" not in task_name and "dc200" not in task_name and "llava_wilder" not in task_name and "livebench" not in task_name:
-                remove_cols = []
-                features = docs.features
-                # If it is an Image instance or a Sequence of Image instance. Remove it
-                for feature in features:
-                    if isinstance(features[feature], Image):
-                        remove_cols.append(feature)
-                    elif isinstance(features[feature], Sequence) and isinstance(features[feature].feature, Image):
-                        remove_cols.append(feature)
-                if remove_cols:
-                    docs = docs.remove_columns(remove_cols)
-
-            ####################### Processing with Full Docs Mode #######################
-            if task_name in ["videochatgpt_consistency"]:
-                full_docs = True
-            else:
-                full_docs = False
-
+            # iterate over a text-only view of the docs so postprocessing never decodes images,
+            # unless the task explicitly needs them in process_results
+            docs = task.task_docs if task.config.process_results_use_image else task.task_docs_no_image
             doc_iterator = itertools.islice(enumerate(docs), lm.rank, limit, lm.world_size)
             # Instead of converting the iterator to a list, use `itertools.tee` to create a parallel iterator for counting
             # doc_iterator, doc_iterator_for_counting = itertools.tee(doc_iterator)
             # Don't use above one, this would crash if doc_iterator_for_counting contains too many objects and very slow
-            doc_iterator_for_counting = itertools.islice(range(len(task.test_docs())), lm.rank, limit, lm.world_size) if task.has_test_docs() else itertools.islice(range(len(task.validation_docs())), lm.rank, limit, lm.world_size)
+            doc_iterator_for_counting = itertools.islice(range(len(docs)), lm.rank, limit, lm.world_size)
             total_docs = sum(1 for _ in doc_iterator_for_counting)
+            instances_by_doc_id = task.instances_by_doc_id
+            if callable(task.config.prefetch_results):
+                # score all docs of the task at once (concurrent judge prompts, batched local scorers), process_results then reads the scores back
+                prefetch_docs, prefetch_results = [], []
+                for doc_id, doc in itertools.islice(enumerate(docs), lm.rank, limit, lm.world_size):
+                    prefetch_docs.append(doc)
+                    prefetch_results.append([req.filtered_resps[key] for req in instances_by_doc_id.get(doc_id, [])])
+                task.prefetch_results(prefetch_docs, prefetch_results)
+
+            def doc_record(doc_id):
+                # instances of this document id, already sorted by idx
+                requests = instances_by_doc_id.get(doc_id, [])
+                return {
+                    "arguments": [tuple(a for a in req.args if isinstance(a, (int, str))) for req in requests],  # do not include image
+                    "resps": [req.resps for req in requests],
+                    "filtered_resps": [req.filtered_resps[key] for req in requests],
+                }
+
+            def log_example(doc_id, doc, record, metrics):
+                target = task.doc_to_target(doc)
+                example = {"doc_id": doc_id, "target": target, "doc": doc, **record}
+                example.update(metrics)
+                if log_samples_dir is not None:
+                    # the score files are written for every format, the samples only when streaming
+                    if task_name not in sample_writers:
+                        if stream_samples:
+                            sample_writers[task_name] = SampleLogWriter(log_samples_dir, task_name, rank=lm.rank, world_size=lm.world_size, format=log_samples_format)
+                        else:
+                            sample_writers[task_name] = ScoreLogWriter(log_samples_dir, task_name, rank=lm.rank, world_size=lm.world_size)
+                    sample_writers[task_name].write(example, scores=metrics)
+                if not stream_samples:
+                    samples[task_name].append(example)
+
+            def process_group(entries):
+                """Scores a complete group, `entries` are the (doc_id, doc record) of its docs."""
+                group_docs = [docs[doc_id] for doc_id, _ in entries]
+                group_samples = task.process_group_results(group_docs, [record["filtered_resps"] for _, record in entries])
+                # every doc is logged with the metrics of the sample it belongs to, docs of no sample without metrics
+                doc_metrics = [{} for _ in entries]
+                for positions, metrics in group_samples:
+                    for metric, value in metrics.items():
+                        vals[(task_name, key, metric)].append(value)
+                    for position in positions:
+                        doc_metrics[position] = metrics
+                if log_samples:
+                    for (doc_id, record), doc, metrics in zip(entries, group_docs, doc_metrics):
+                        log_example(doc_id, doc, record, metrics)
+
+            grouped = task.config.doc_group_key is not None
+            if grouped:
+                # size of every group among the evaluated docs of all ranks, a group is scored once all its docs are seen
+                group_sizes = collections.Counter(task.doc_group(doc) for doc in itertools.islice(docs, limit))
+                pending_groups = collections.defaultdict(list)
+
             pbar = tqdm(total=total_docs, desc=f"Postprocessing", disable=(lm.rank != 0))
             for doc_id, doc in doc_iterator:
-                # subset instances to only this document id ; sort by idx
-                requests = list(filter(lambda x: x.doc_id == doc_id, task.instances))
-                requests.sort(key=lambda x: x.idx)
-                if full_docs:
-                    metrics = task.process_results(doc, [req.filtered_resps[key] for req in requests], full_docs=docs)
-                else:
-                    metrics = task.process_results(doc, [req.filtered_resps[key] for req in requests])
+                if grouped:
+                    group = task.doc_group(doc)
+                    pending_groups[group].append((doc_id, doc_record(doc_id)))
+                    if len(pending_groups[group]) == group_sizes[group]:
+                        process_group(pending_groups.pop(group))
+                    pbar.update(1)
+                    continue
+                record = doc_record(doc_id)
+                metrics = task.process_results(doc, record["filtered_resps"])
                 if log_samples:
-                    target = task.doc_to_target(doc)
-                    example = {
-                        "doc_id": doc_id,
-                        "target": target,
-                        "doc": doc,
-                        "arguments": [tuple(a for a in req.args if isinstance(a, (int, str))) for req in requests],  # do not include image
-                        "resps": [req.resps for req in requests],
-                        "filtered_resps": [req.filtered_resps[key] for req in requests],
-                    }
-                    example.update(metrics)
-                    samples[task_name].append(example)
+                    log_example(doc_id, doc, record, metrics)
                 for metric, value in metrics.items():
                     vals[(task_name, key, metric)].append(value)
                 pbar.update(1)
 
             pbar.close()
 
+            if grouped and lm.world_size > 1:
+                # groups whose docs were sharded to several ranks are gathered, and each is completed by one rank
+                rank_groups = [None] * lm.world_size
+                torch.distributed.all_gather_object(rank_groups, dict(pending_groups))
+                pending_groups = collections.defaultdict(list)
+                for groups in rank_groups:
+                    for group, entries in groups.items():
+                        pending_groups[group].extend(entries)
+                for i, group in enumerate(sorted(pending_groups, key=str)):
+                    if i % lm.world_size == lm.rank:
+                        process_group(sorted(pending_groups[group], key=lambda entry: entry[0]))
+
+    # task name -> shard entries, only the small shard descriptions are gathered
+    sample_shards = {task_name: [writer.close()] for task_name, writer in sample_writers.items()}
+    write_shards = log_samples and log_samples_dir is not None
+
     if lm.world_size > 1:
         # if multigpu, then gather data across all ranks
         # first gather logged samples across all ranks
-        for task_name, task_samples in list(samples.items()):
+        if write_shards:
+            full_shards = [None] * lm.world_size
+            torch.distributed.all_gather_object(full_shards, sample_shards)
+            sample_shards = collections.defaultdict(list)
+            for rank_shards in full_shards:
+                for task_name, shards in rank_shards.items():
+                    sample_shards[task_name].extend(shards)
+        # a rank may have logged no sample of a task, every rank gathers the tasks any rank logged
+        rank_sample_tasks = [None] * lm.world_size
+        torch.distributed.all_gather_object(rank_sample_tasks, list(samples))
+        for task_name in dict.fromkeys(itertools.chain.from_iterable(rank_sample_tasks)):
             full_samples = [None] * lm.world_size
-            torch.distributed.all_gather_object(full_samples, task_samples)
+            torch.distributed.all_gather_object(full_samples, samples.get(task_name, []))
             samples[task_name] = list(itertools.chain.from_iterable(full_samples))
-        # then collect metrics across all ranks
+        # then collect metrics across all ranks. A rank may have no values for a metric (e.g. it got no
+        # complete group), so the ranks first agree on the metrics and the kind of their values, then all
+        # run the same gathers, with empty values where they have none.
+        value_kinds = {}
+        for vals_key, items in vals.items():
+            if items:
+                is_object = isinstance(items[0], (str, list, dict))
+                value_kinds[vals_key] = (is_object, len(items[0]) if type(items[0]) == tuple else 0, None if is_object else torch.tensor(items[:1]).dtype)
+        rank_value_kinds = [None] * lm.world_size
+        torch.distributed.all_gather_object(rank_value_kinds, value_kinds)
+        # same insertion order on every rank
+        all_value_kinds = {}
+        for kinds in rank_value_kinds:
+            for vals_key, kind in kinds.items():
+                all_value_kinds.setdefault(vals_key, kind)
         vals_torch = collections.defaultdict(list)
-        for (task_name, key, metric), items in vals.items():
-            numitem = 0
-            if type(items[0]) == tuple:
-                numitem = len(items[0])
+        for (task_name, key, metric), (is_object, numitem, dtype) in all_value_kinds.items():
+            items = vals.get((task_name, key, metric), [])
 
-            if isinstance(items[0], (str, list, dict)):
+            if is_object:
                 # handle the string case
                 gathered_items = [None] * lm.accelerator.num_processes
                 torch.distributed.all_gather_object(gathered_items, items)
@@ -400,7 +525,10 @@ def evaluate(
                 # distributed gather requires all ranks to have same dimensions
                 # so we pad out with float32 min value
                 pad_value = torch.finfo(torch.float32).min
-                metrics_tensor = torch.tensor(items, device=lm.device)
+                if items:
+                    metrics_tensor = torch.tensor(items, device=lm.device)
+                else:
+                    metrics_tensor = torch.empty((0, numitem) if numitem > 0 else (0,), dtype=dtype, device=lm.device)
 
                 original_dtype = metrics_tensor.dtype  # store original dtype
                 torch_device_tensor = lm.accelerator.pad_across_processes(metrics_tensor.to(torch.float32), pad_index=pad_value)
@@ -621,7 +749,9 @@ def evaluate(
             "versions": dict(sorted(versions.items())),
             "n-shot": dict(sorted(num_fewshot.items())),
         }
-        if log_samples:
+        if write_shards:
+            results_dict["sample_shards"] = dict(sample_shards)
+        if log_samples and not stream_samples:
             results_dict["samples"] = dict(samples)
 
         return results_dict
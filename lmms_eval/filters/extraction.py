@@ -1,8 +1,29 @@
+import functools
+import multiprocessing
+import os
 import re
 import sys
 import unicodedata
 from lmms_eval.api.filter import Filter
 
+# all unicode punctuation, removed by `ignore_punctuation` (https://stackoverflow.com/a/266162)
+PUNCTUATION_TABLE = dict.fromkeys(i for i in range(sys.maxunicode) if unicodedata.category(chr(i)).startswith("P"))
+
+# tasks with fewer responses are filtered in-process even when a pool is configured
+MIN_PARALLEL_RESPONSES = 10000
+
+
+@functools.lru_cache(maxsize=None)
+def _letter_fallback(num_choices):
+    """Step 2 pattern (a colon, optional whitespace, then one of the letters) of a question with `num_choices` choices, and its letter -> "(letter)" map."""
+    letters = [chr(ord("A") + i) for i in range(num_choices)]
+    return re.compile(rf":[\s]*({'|'.join(letters)})"), {letter: f"({letter})" for letter in letters}
+
+
+def _extract_chunk(args):
+    multi_choice_filter, chunk = args
+    return multi_choice_filter.extract(chunk)
+
 
 class WhitespaceFilter(Filter):
     """ """
@@ -76,6 +97,10 @@ class MultiChoiceRegexFilter(RegexFilter):
     letter answers. assumes each document has a "choices" field
     containing the list of answer choices and that the answer label symbols
     are of the form (A), (B), (C), ... or A, B, C.
+
+    The step 1 pattern is compiled once per distinct list of choices and the step 2
+    pattern once per number of choices, then all responses of the task are filtered
+    in one pass, split across `num_workers` processes for large tasks.
     """
 
     def __init__(
@@ -86,6 +111,7 @@ class MultiChoiceRegexFilter(RegexFilter):
         ignore_case=False,
         ignore_punctuation=False,
         regexes_to_ignore=None,
+        num_workers: int = 0,
     ) -> None:
         """
         regex_pattern: The basic regex pattern to use. If fails to match, we will use the customized match procedure
@@ -95,85 +121,90 @@ class MultiChoiceRegexFilter(RegexFilter):
         ignore_case: Ignores the case during step 1 matching
         ignore_punctuation: Remove the punctuation during step 1 matching
         regexes_to_ignore: Remove these regexes during step 1 matching
+        num_workers: Processes used for tasks with at least MIN_PARALLEL_RESPONSES responses, 0 filters in-process.
         """
         super().__init__(regex_pattern, group_select, fallback)
         self.ignore_case = ignore_case
         self.ignore_punctuation = ignore_punctuation
         self.regexes_to_ignore = regexes_to_ignore
+        self.num_workers = num_workers
+        self._ignore_regexes = [re.compile(s) for s in regexes_to_ignore] if regexes_to_ignore is not None else []
+        # tuple of choices -> (step 1 pattern, choice -> "(letter)" map), the same choices repeat across documents
+        self._choice_patterns = {}
 
-    def apply(self, resps, docs):
-        # here, we assume we have a list, in which each element is
-        # a list of model responses for some particular input/target pair.
-        # so we process each of these (same input/target response sets)
-        # independently (and keep them a list.)
-
-        def find_match(regex, resp, convert_dict={}):
-            match = regex.findall(resp)
-            if match:
-                match = match[self.group_select]
-                if isinstance(match, tuple):
-                    match = [m for m in match if m][0]
-                match = match.strip()
-                if match and match in convert_dict:
-                    match = convert_dict[match]
-            return match
-
-        punct_tbl = dict.fromkeys(i for i in range(sys.maxunicode) if unicodedata.category(chr(i)).startswith("P"))
-
-        def filter_ignores(st):
-            if self.regexes_to_ignore is not None:
-                for s in self.regexes_to_ignore:
-                    st = re.sub(s, "", st)
+    def find_match(self, regex, resp, convert_dict={}):
+        match = regex.findall(resp)
+        if match:
+            match = match[self.group_select]
+            if isinstance(match, tuple):
+                match = [m for m in match if m][0]
+            match = match.strip()
+            if match and match in convert_dict:
+                match = convert_dict[match]
+        return match
 
-            if self.ignore_case:
-                st = st.lower()
+    def filter_ignores(self, st):
+        for regex in self._ignore_regexes:
+            st = regex.sub("", st)
 
-            if self.ignore_punctuation:
-                # https://stackoverflow.com/a/266162
-                st = st.translate(punct_tbl)
-            return st
+        if self.ignore_case:
+            st = st.lower()
 
-        filtered_resps = []
+        if self.ignore_punctuation:
+            st = st.translate(PUNCTUATION_TABLE)
+        return st
 
-        for r, doc in zip(resps, docs):
+    def choice_patterns(self, choices):
+        if choices not in self._choice_patterns:
             fallback_regexes = []
             choice_to_alpha = {}
             next_alpha = "A"
-
-            without_paren_fallback_regexes = []
-            without_paren_to_target = {}
-
-            choices = doc["choices"]
             for c in choices:
-                m = filter_ignores(c.strip())
+                m = self.filter_ignores(c.strip())
                 fallback_regexes.append(f"{re.escape(m)}")
                 choice_to_alpha[m] = f"({next_alpha})"
-
-                without_paren_fallback_regexes.append(next_alpha)
-                without_paren_to_target[next_alpha] = f"({next_alpha})"
-
                 next_alpha = chr(ord(next_alpha) + 1)
-            fallback_regex = re.compile("|".join(fallback_regexes))
-            without_paren_fallback_regex = "|".join(without_paren_fallback_regexes)
-            without_paren_fallback_regex = re.compile(f":[\s]*({without_paren_fallback_regex})")
+            self._choice_patterns[choices] = (re.compile("|".join(fallback_regexes)), choice_to_alpha)
+        return self._choice_patterns[choices]
+
+    def extract(self, items):
+        """Filters `(responses, choices)` pairs, `choices` being a tuple."""
+        filtered_resps = []
+        for r, choices in items:
+            fallback_regex, choice_to_alpha = self.choice_patterns(choices)
+            without_paren_fallback_regex, without_paren_to_target = _letter_fallback(len(choices))
 
             filtered = []
             for resp in r:
-                match = find_match(self.regex, resp)
+                match = self.find_match(self.regex, resp)
                 if not match:
-                    match = find_match(fallback_regex, filter_ignores(resp), choice_to_alpha)
+                    match = self.find_match(fallback_regex, self.filter_ignores(resp), choice_to_alpha)
                     if not match:
-                        match = find_match(without_paren_fallback_regex, resp, without_paren_to_target)
+                        match = self.find_match(without_paren_fallback_regex, resp, without_paren_to_target)
                 if not match:
                     match = self.fallback
                 filtered.append(match)
             filtered_resps.append(filtered)
-
         return filtered_resps
 
+    def apply(self, resps, docs):
+        # here, we assume we have a list, in which each element is
+        # a list of model responses for some particular input/target pair.
+        # so we process each of these (same input/target response sets)
+        # independently (and keep them a list.)
+        items = [(r, tuple(doc["choices"])) for r, doc in zip(resps, docs)]
+        if self.num_workers <= 1 or len(items) < MIN_PARALLEL_RESPONSES:
+            return self.extract(items)
+
+        num_workers = min(self.num_workers, os.cpu_count() or 1)
+        chunk_size = -(-len(items) // (4 * num_workers))
+        chunks = [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+        with multiprocessing.Pool(num_workers) as pool:
+            return [filtered for chunk in pool.map(_extract_chunk, [(self, chunk) for chunk in chunks]) for filtered in chunk]
+
 
 class ExtendedRegexFilter(RegexFilter):
-    punct_tbl = dict.fromkeys(i for i in range(sys.maxunicode) if unicodedata.category(chr(i)).startswith("P"))
+    punct_tbl = PUNCTUATION_TABLE
 
     def __init__(
         self,
@@ -1,11 +1,15 @@
 import importlib
+import importlib.util
 import os
-import hf_transfer
 from loguru import logger
 import sys
+
+from lmms_eval.api.registry import register_lazy_model
+
 logger.remove()
 logger.add(sys.stdout, level="WARNING")
 
+# Key: module in lmms_eval.models, Value: model class. Modules are only imported when `get_model` resolves their model.
 AVAILABLE_MODELS = {
     "llava": "Llava",
     "qwen_vl": "Qwen_VL",
@@ -59,23 +63,32 @@ AVAILABLE_MODELS = {
     "MIO_batch":"MIO_batch"
 }
 
-for model_name, model_class in AVAILABLE_MODELS.items():
-    try:
-        exec(f"from .{model_name} import {model_class}")
-    except ImportError as e:
-        # logger.warning(f"Failed to import {model_class} from {model_name}: {e}")
-        pass
+# models registered under a name other than their module name
+MODEL_NAMES = {
+    "llava_vid": "llavavid",
+    "xcomposer2_4KHD": "xcomposer2_4khd",
+    "qwen_vl_api": "qwen-vl-api",
+    "MIO_sft": "MIO",
+}
+
+for model_name in AVAILABLE_MODELS:
+    register_lazy_model(MODEL_NAMES.get(model_name, model_name), f"lmms_eval.models.{model_name}")
 
 if os.environ.get("LMMS_EVAL_PLUGINS", None):
     # Allow specifying other packages to import models from
     for plugin in os.environ["LMMS_EVAL_PLUGINS"].split(","):
         m = importlib.import_module(f"{plugin}.models")
-        for model_name, model_class in getattr(m, "AVAILABLE_MODELS").items():
-            try:
-                exec(f"from {plugin}.models.{model_name} import {model_class}")
-            except ImportError:
-                pass
-
-import hf_transfer
+        if hasattr(m, "MODEL_NAMES"):
+            # the plugin declares the names its models register under, like MODEL_NAMES above
+            for model_name in getattr(m, "AVAILABLE_MODELS"):
+                register_lazy_model(getattr(m, "MODEL_NAMES").get(model_name, model_name), f"{plugin}.models.{model_name}")
+        else:
+            # the registered names are only known once the modules are imported
+            for model_name in getattr(m, "AVAILABLE_MODELS"):
+                try:
+                    importlib.import_module(f"{plugin}.models.{model_name}")
+                except ImportError:
+                    pass
 
-os.environ["HF_HUB_ENABLE_HF_TRANSFER"] = "1"
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ["HF_HUB_ENABLE_HF_TRANSFER"] = "1"
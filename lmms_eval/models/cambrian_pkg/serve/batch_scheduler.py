@@ -0,0 +1,313 @@
+"""
+Batched generation for the model worker (`model_worker.py --continuous-batching`).
+
+Requests are queued instead of waiting on the worker semaphore one at a time. A scheduler
+thread takes every queued request that can share a `model.generate` call (same sampling
+parameters and number of images) as soon as the running batch finishes, so a request never
+waits for more than one batch. Cambrian keeps the vision features of a `generate` call on
+the model for its decoding steps, so requests join between calls rather than mid-decode.
+
+Every sequence of a batch streams its own output: `BatchStreamer` detokenizes the new tokens
+incrementally and sends each request only the text added since its previous chunk, holding
+back a possible prefix of its stop string, and finishes a request as soon as it hits its
+stop string, EOS or its own `max_new_tokens`, capped by the context length left after its own prompt. Preprocessed image tensors are kept in an
+`ImageCache`, keyed by the base64 image, so repeated images skip decoding and preprocessing.
+"""
+import collections
+import hashlib
+import queue
+import threading
+import time
+
+import torch
+from transformers import StoppingCriteria
+from transformers.generation.streamers import BaseStreamer
+
+from ezcolorlog import root_logger as logger
+
+
+# ends the stream of a request in its queue
+_FINISHED = object()
+
+
+class ImageCache:
+    """LRU cache of preprocessed images: base64 image -> (image size, one tensor per vision tower)."""
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_b64, load_fn):
+        """Returns the cached entry of `image_b64`, computed with `load_fn(image_b64)` on a miss."""
+        key = hashlib.sha1(image_b64.encode()).hexdigest()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        entry = load_fn(image_b64)
+        with self._lock:
+            self.misses += 1
+            if self.capacity > 0:
+                self._entries[key] = entry
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        return entry
+
+
+class GenerationRequest:
+    """One queued request: its prompt ids, images, sampling parameters and the queue its chunks are streamed to."""
+
+    def __init__(self, input_ids, images, image_sizes, temperature, top_p, max_new_tokens, stop_str):
+        self.input_ids = input_ids
+        # one tensor per vision tower, with one row per image of the request
+        self.images = images
+        self.image_sizes = image_sizes
+        self.temperature = temperature
+        self.top_p = top_p
+        self.max_new_tokens = max_new_tokens
+        self.stop_str = stop_str
+        self.chunks = queue.Queue()
+        self.enqueue_time = time.time()
+
+    @property
+    def batch_key(self):
+        # requests of one generate call share their sampling parameters and number of images
+        do_sample = self.temperature > 0.001
+        return (do_sample, self.temperature if do_sample else None, self.top_p if do_sample else None, len(self.image_sizes or []))
+
+    def stream(self):
+        """Yields the text deltas of the request until it is finished, raises the error of its batch if it failed."""
+        while True:
+            chunk = self.chunks.get()
+            if chunk is _FINISHED:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+class _SequenceState:
+    def __init__(self, request, eos_token_id):
+        self.request = request
+        self.eos_token_id = eos_token_id
+        self.token_ids = []
+        # incremental detokenization: text is decoded from prefix_offset, read_offset marks what was already emitted
+        self.prefix_offset = 0
+        self.read_offset = 0
+        # decoded text not sent yet because it may be the start of the stop string
+        self.pending = ""
+        self.finished = False
+
+
+class BatchStreamer(BaseStreamer):
+    """Streamer of a batched `generate` call, sends every sequence its new text as soon as it is decoded."""
+
+    def __init__(self, tokenizer, requests):
+        self.tokenizer = tokenizer
+        self.sequences = [_SequenceState(r, tokenizer.eos_token_id) for r in requests]
+        self.generated_tokens = 0
+        self._prompt_skipped = False
+
+    def put(self, value):
+        if not self._prompt_skipped:
+            # the first call holds the prompt
+            self._prompt_skipped = True
+            return
+        if value.dim() == 2:
+            value = value[:, -1]
+        for seq, token_id in zip(self.sequences, value.tolist()):
+            if seq.finished:
+                continue
+            self.generated_tokens += 1
+            if token_id == seq.eos_token_id:
+                self._finish(seq)
+                continue
+            seq.token_ids.append(token_id)
+            self._emit(seq, self._decode_new_text(seq))
+            if not seq.finished and len(seq.token_ids) >= seq.request.max_new_tokens:
+                self._finish(seq)
+
+    def end(self):
+        for seq in self.sequences:
+            if not seq.finished:
+                self._finish(seq)
+
+    @property
+    def all_finished(self):
+        return all(seq.finished for seq in self.sequences)
+
+    def _decode_new_text(self, seq):
+        prefix_text = self.tokenizer.decode(seq.token_ids[seq.prefix_offset : seq.read_offset], skip_special_tokens=True)
+        new_text = self.tokenizer.decode(seq.token_ids[seq.prefix_offset :], skip_special_tokens=True)
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            # the new tokens form complete characters
+            seq.prefix_offset = seq.read_offset
+            seq.read_offset = len(seq.token_ids)
+            return new_text[len(prefix_text) :]
+        return ""
+
+    def _emit(self, seq, text):
+        stop_str = seq.request.stop_str
+        if not stop_str:
+            if text:
+                seq.request.chunks.put(text)
+            return
+        seq.pending += text
+        index = seq.pending.find(stop_str)
+        if index >= 0:
+            if index > 0:
+                seq.request.chunks.put(seq.pending[:index])
+            seq.pending = ""
+            self._finish(seq)
+            return
+        # keep the longest end of the text that could still become the stop string
+        hold = 0
+        for n in range(min(len(stop_str) - 1, len(seq.pending)), 0, -1):
+            if stop_str.startswith(seq.pending[-n:]):
+                hold = n
+                break
+        if len(seq.pending) > hold:
+            seq.request.chunks.put(seq.pending[: len(seq.pending) - hold])
+            seq.pending = seq.pending[len(seq.pending) - hold :]
+
+    def _finish(self, seq):
+        if seq.pending:
+            seq.request.chunks.put(seq.pending)
+            seq.pending = ""
+        seq.finished = True
+        seq.request.chunks.put(_FINISHED)
+
+
+class _AllSequencesFinished(StoppingCriteria):
+    def __init__(self, streamer):
+        self.streamer = streamer
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.streamer.all_finished
+
+
+class BatchScheduler:
+    """Runs queued `GenerationRequest`s in batched `generate` calls on a background thread."""
+
+    def __init__(self, model, tokenizer, max_batch_size=8, max_context_length=2048, num_image_tokens=576, throughput_window=60.0):
+        self.model = model
+        self.tokenizer = tokenizer
+        # prepare_inputs_labels_for_multimodal drops the padding of the prompts and pads their
+        # embeddings again, on the right by default: the shorter prompts of a batch would then
+        # generate after zero embeddings. A batch of one has no padding, so either side is fine.
+        model.config.tokenizer_padding_side = "left"
+        self.max_batch_size = max_batch_size
+        self.max_context_length = max_context_length
+        self.num_image_tokens = num_image_tokens
+        self.throughput_window = throughput_window
+        self._waiting = collections.deque()
+        self._cond = threading.Condition()
+        self._running = 0
+        # (finish time, number of requests, generated tokens) of recent batches
+        self._finished_batches = collections.deque()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, request):
+        return self.submit_many([request])[0]
+
+    def submit_many(self, requests):
+        """Queues `requests` at once, so that compatible ones are sure to share a batch."""
+        with self._cond:
+            self._waiting.extend(requests)
+            self._cond.notify()
+        return requests
+
+    @property
+    def queue_length(self):
+        """Requests waiting for a batch plus requests of the running batch."""
+        with self._cond:
+            return len(self._waiting) + self._running
+
+    def throughput(self):
+        """Requests and generated tokens per second over the last `throughput_window` seconds."""
+        now = time.time()
+        with self._cond:
+            while self._finished_batches and self._finished_batches[0][0] < now - self.throughput_window:
+                self._finished_batches.popleft()
+            num_requests = sum(b[1] for b in self._finished_batches)
+            num_tokens = sum(b[2] for b in self._finished_batches)
+        return num_requests / self.throughput_window, num_tokens / self.throughput_window
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._waiting:
+                self._cond.wait()
+            # the oldest request decides the batch, the compatible requests behind it join it in order
+            key = self._waiting[0].batch_key
+            batch, rest = [], collections.deque()
+            while self._waiting:
+                request = self._waiting.popleft()
+                if len(batch) < self.max_batch_size and request.batch_key == key:
+                    batch.append(request)
+                else:
+                    rest.append(request)
+            self._waiting = rest
+            self._running = len(batch)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                generated_tokens = self._generate(batch)
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} requests failed: {e}")
+                for request in batch:
+                    request.chunks.put(e)
+                generated_tokens = 0
+            with self._cond:
+                self._running = 0
+                self._finished_batches.append((time.time(), len(batch), generated_tokens))
+
+    @torch.inference_mode()
+    def _generate(self, batch):
+        tokenizer, model = self.tokenizer, self.model
+        pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        max_len = max(r.input_ids.shape[-1] for r in batch)
+        # left padding, so that every sequence generates from the same position
+        input_ids = torch.full((len(batch), max_len), pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), max_len), dtype=torch.bool)
+        for i, r in enumerate(batch):
+            input_ids[i, max_len - r.input_ids.shape[-1] :] = r.input_ids
+            attention_mask[i, max_len - r.input_ids.shape[-1] :] = True
+
+        image_args = {}
+        if batch[0].images is not None:
+            num_towers = len(batch[0].images)
+            image_args["images"] = [torch.cat([r.images[t] for r in batch], dim=0) for t in range(num_towers)]
+            image_args["image_sizes"] = [size for r in batch for size in r.image_sizes]
+        num_image_tokens = self.num_image_tokens if batch[0].images is not None else 0
+        for r in batch:
+            # every request is capped by its own prompt, not by the longest one of the batch;
+            # the streamer finishes it there, and the call runs as long as the longest cap
+            r.max_new_tokens = max(1, min(r.max_new_tokens, self.max_context_length - r.input_ids.shape[-1] - num_image_tokens))
+        max_new_tokens = max(r.max_new_tokens for r in batch)
+
+        streamer = BatchStreamer(tokenizer, batch)
+        first = batch[0]
+        do_sample = first.temperature > 0.001
+        model.generate(
+            inputs=input_ids.to(model.device),
+            attention_mask=attention_mask.to(model.device),
+            do_sample=do_sample,
+            temperature=first.temperature,
+            top_p=first.top_p,
+            max_new_tokens=max_new_tokens,
+            streamer=streamer,
+            stopping_criteria=[_AllSequencesFinished(streamer)],
+            pad_token_id=pad_token_id,
+            use_cache=True,
+            **image_args,
+        )
+        streamer.end()
+        return streamer.generated_tokens
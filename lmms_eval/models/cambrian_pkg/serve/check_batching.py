@@ -0,0 +1,86 @@
+"""
+Checks that batched generation (`model_worker.py --continuous-batching`) gives every request
+the output it gets alone.
+
+Every prompt is first generated alone, through a `BatchScheduler` with `max_batch_size=1`,
+then all the prompts are queued together to a scheduler with `--max-batch-size`. Decoding is
+greedy, so the texts must match. The questions have different lengths, so the shorter prompts
+of a batch are padded, and with `--image-file` every prompt also carries the image.
+
+    python -m cambrian.serve.check_batching --model-path nyu-visionx/cambrian-8b --image-file view.jpg
+"""
+import argparse
+import sys
+
+from PIL import Image
+
+from cambrian.constants import IMAGE_TOKEN_INDEX, DEFAULT_IMAGE_TOKEN, DEFAULT_IM_START_TOKEN, DEFAULT_IM_END_TOKEN
+from cambrian.conversation import conv_templates
+from cambrian.model.builder import load_pretrained_model
+from cambrian.mm_utils import process_images, tokenizer_image_token, get_model_name_from_path
+from cambrian.serve.batch_scheduler import BatchScheduler, GenerationRequest
+from cambrian.utils import disable_torch_init
+
+QUESTIONS = [
+    "Describe this.",
+    "What is the main object, and what color is it?",
+    "List three details someone could easily miss at first glance, and explain why each of them matters.",
+    "Hi!",
+    "Write one sentence about it.",
+]
+
+
+def build_requests(args, tokenizer, model, image_processor):
+    images, image_sizes = None, None
+    if args.image_file is not None:
+        image = Image.open(args.image_file).convert("RGB")
+        images = process_images([image], image_processor, model.config)
+        image_sizes = [image.size]
+
+    requests = []
+    for question in QUESTIONS:
+        if images is not None:
+            image_token = DEFAULT_IMAGE_TOKEN
+            if getattr(model.config, "mm_use_im_start_end", False):
+                image_token = DEFAULT_IM_START_TOKEN + image_token + DEFAULT_IM_END_TOKEN
+            question = image_token + "\n" + question
+        conv = conv_templates[args.conv_mode].copy()
+        conv.append_message(conv.roles[0], question)
+        conv.append_message(conv.roles[1], None)
+        input_ids = tokenizer_image_token(conv.get_prompt(), tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt")
+        requests.append(GenerationRequest(input_ids, images, image_sizes, 0.0, 1.0, args.max_new_tokens, None))
+    return requests
+
+
+def main(args):
+    disable_torch_init()
+    model_name = get_model_name_from_path(args.model_path)
+    tokenizer, model, image_processor, context_len = load_pretrained_model(args.model_path, args.model_base, model_name, device=args.device)
+    max_context_length = getattr(model.config, "max_position_embeddings", 2048)
+
+    single = BatchScheduler(model, tokenizer, max_batch_size=1, max_context_length=max_context_length)
+    alone = ["".join(single.submit(request).stream()) for request in build_requests(args, tokenizer, model, image_processor)]
+
+    batched = BatchScheduler(model, tokenizer, max_batch_size=args.max_batch_size, max_context_length=max_context_length)
+    together = ["".join(request.stream()) for request in batched.submit_many(build_requests(args, tokenizer, model, image_processor))]
+
+    mismatches = 0
+    for question, text_alone, text_batched in zip(QUESTIONS, alone, together):
+        if text_alone != text_batched:
+            mismatches += 1
+            print(f"MISMATCH {question!r}\n  alone:   {text_alone!r}\n  batched: {text_batched!r}")
+    print(f"{len(QUESTIONS) - mismatches}/{len(QUESTIONS)} requests generate the same text in a batch of {args.max_batch_size}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-path", type=str, required=True)
+    parser.add_argument("--model-base", type=str, default=None)
+    parser.add_argument("--image-file", type=str, default=None)
+    parser.add_argument("--conv-mode", type=str, default="llama_3")
+    parser.add_argument("--device", type=str, default="cuda")
+    parser.add_argument("--max-batch-size", type=int, default=len(QUESTIONS))
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+    sys.exit(1 if main(args) else 0)
@@ -20,6 +20,7 @@ import uvicorn
 from ezcolorlog import root_logger as logger
 
 from cambrian.constants import CONTROLLER_HEART_BEAT_EXPIRATION
+from cambrian.serve.dispatch import Dispatcher
 from cambrian.utils import server_error_msg
 # logger = build_logger("controller", "controller.log")
 
@@ -27,6 +28,7 @@ from cambrian.utils import server_error_msg
 class DispatchMethod(Enum):
     LOTTERY = auto()
     SHORTEST_QUEUE = auto()
+    POWER_OF_TWO = auto()
 
     @classmethod
     def from_str(cls, name):
@@ -34,6 +36,8 @@ class DispatchMethod(Enum):
             return cls.LOTTERY
         elif name == "shortest_queue":
             return cls.SHORTEST_QUEUE
+        elif name == "power_of_two":
+            return cls.POWER_OF_TWO
         else:
             raise ValueError(f"Invalid dispatch method")
 
@@ -41,7 +45,7 @@ class DispatchMethod(Enum):
 @dataclasses.dataclass
 class WorkerInfo:
     model_names: List[str]
-    speed: int
+    speed: float
     queue_length: int
     check_heart_beat: bool
     last_heart_beat: str
@@ -54,15 +58,22 @@ def heart_beat_controller(controller):
 
 
 class Controller:
-    def __init__(self, dispatch_method: str):
+    def __init__(self, dispatch_method: str, connect_timeout: float = 5, read_timeout: float = 120,
+                 max_attempts: int = 2):
         logger.info("Init controller")
 
         # Dict[str -> WorkerInfo]
         self.worker_info = {}
         self.dispatch_method = DispatchMethod.from_str(dispatch_method)
+        # in-flight requests, latency and failures of the workers, and pooled connections to them
+        self.dispatcher = Dispatcher()
+        self.connect_timeout = connect_timeout
+        # time allowed between two streamed chunks, the first one waits for the worker's queue
+        self.read_timeout = read_timeout
+        self.max_attempts = max_attempts
 
         self.heart_beat_thread = threading.Thread(
-            target=heart_beat_controller, args=(self,))
+            target=heart_beat_controller, args=(self,), daemon=True)
         self.heart_beat_thread.start()
 
         logger.info("Init controller")
@@ -101,6 +112,7 @@ class Controller:
 
     def remove_worker(self, worker_name: str):
         del self.worker_info[worker_name]
+        self.dispatcher.remove(worker_name)
 
     def refresh_all_workers(self):
         old_info = dict(self.worker_info)
@@ -118,69 +130,58 @@ class Controller:
 
         return list(model_names)
 
-    def get_worker_address(self, model_name: str):
+    def get_worker_address(self, model_name: str, exclude=(), track: bool = True):
+        """Picks a worker serving `model_name`, skipping `exclude` and workers that failed recently.
+
+        With `track`, the worker counts the request as queued until its next heart beat,
+        for clients that stream from the worker directly.
+        """
+        workers = {w_name: (w_info.queue_length, w_info.speed) for w_name, w_info in self.worker_info.items()
+                   if model_name in w_info.model_names and w_name not in exclude}
+        if not workers:
+            return ""
+        healthy = [w_name for w_name in workers if self.dispatcher.is_healthy(w_name)]
+
         if self.dispatch_method == DispatchMethod.LOTTERY:
-            worker_names = []
-            worker_speeds = []
-            for w_name, w_info in self.worker_info.items():
-                if model_name in w_info.model_names:
-                    worker_names.append(w_name)
-                    worker_speeds.append(w_info.speed)
-            worker_speeds = np.array(worker_speeds, dtype=np.float32)
+            worker_names = healthy or list(workers)
+            worker_speeds = np.array([workers[w_name][1] for w_name in worker_names], dtype=np.float32)
             norm = np.sum(worker_speeds)
             if norm < 1e-4:
                 return ""
-            worker_speeds = worker_speeds / norm
-            if True:  # Directly return address
-                pt = np.random.choice(np.arange(len(worker_names)),
-                                      p=worker_speeds)
-                worker_name = worker_names[pt]
-                return worker_name
-
-            # Check status before returning
-            while True:
-                pt = np.random.choice(np.arange(len(worker_names)),
-                                      p=worker_speeds)
-                worker_name = worker_names[pt]
-
-                if self.get_worker_status(worker_name):
-                    break
-                else:
-                    self.remove_worker(worker_name)
-                    worker_speeds[pt] = 0
-                    norm = np.sum(worker_speeds)
-                    if norm < 1e-4:
-                        return ""
-                    worker_speeds = worker_speeds / norm
-                    continue
-            return worker_name
+            pt = np.random.choice(np.arange(len(worker_names)), p=worker_speeds / norm)
+            w_name = worker_names[pt]
 
         elif self.dispatch_method == DispatchMethod.SHORTEST_QUEUE:
-            worker_names = []
-            worker_qlen = []
-            for w_name, w_info in self.worker_info.items():
-                if model_name in w_info.model_names:
-                    worker_names.append(w_name)
-                    worker_qlen.append(w_info.queue_length / w_info.speed)
-            if len(worker_names) == 0:
-                return ""
-            min_index = np.argmin(worker_qlen)
-            w_name = worker_names[min_index]
-            self.worker_info[w_name].queue_length += 1
+            worker_names = healthy or list(workers)
+            worker_waits = [self.dispatcher.expected_wait(w_name, *workers[w_name]) for w_name in worker_names]
+            w_name = worker_names[int(np.argmin(worker_waits))]
             logger.info(
-                f"names: {worker_names}, queue_lens: {worker_qlen}, ret: {w_name}")
-            return w_name
+                f"names: {worker_names}, expected waits: {worker_waits}, ret: {w_name}")
+
+        elif self.dispatch_method == DispatchMethod.POWER_OF_TWO:
+            w_name = self.dispatcher.choose(workers)
+
         else:
             raise ValueError(
                 f"Invalid dispatch method: {self.dispatch_method}")
 
-    def receive_heart_beat(self, worker_name: str, queue_length: int):
+        if track:
+            self.dispatcher.on_dispatch(w_name)
+        return w_name
+
+    def receive_heart_beat(self, worker_name: str, queue_length: int, speed: float = None, completions=()):
         if worker_name not in self.worker_info:
             logger.info(f"Receive unknown heart beat. {worker_name}")
             return False
 
         self.worker_info[worker_name].queue_length = queue_length
+        if speed is not None:
+            self.worker_info[worker_name].speed = speed
         self.worker_info[worker_name].last_heart_beat = time.time()
+        # the reported queue now includes the requests dispatched before the heart beat
+        self.dispatcher.on_heart_beat(worker_name)
+        # the requests the worker served to clients that streamed from it directly
+        self.dispatcher.on_report(worker_name, completions)
         logger.info(f"Receive heart beat. {worker_name}")
         return True
 
@@ -195,28 +196,56 @@ class Controller:
             self.remove_worker(worker_name)
 
     def worker_api_generate_stream(self, params):
-        worker_addr = self.get_worker_address(params["model"])
-        if not worker_addr:
+        tried = []
+        for _ in range(self.max_attempts):
+            worker_addr = self.get_worker_address(params["model"], exclude=tried, track=False)
+            if not worker_addr:
+                break
+            tried.append(worker_addr)
+
+            start_time = self.dispatcher.on_start(worker_addr)
+            streamed = False
+            try:
+                # the worker leaves proxied requests out of its heart beat reports, they are measured here
+                response = self.dispatcher.session.post(worker_addr + "/worker_generate_stream",
+                                                        json={**params, "proxied": True}, stream=True,
+                                                        timeout=(self.connect_timeout, self.read_timeout))
+                response.raise_for_status()
+                for chunk in response.iter_lines(decode_unicode=False, delimiter=b"\0"):
+                    if chunk:
+                        streamed = True
+                        yield chunk + b"\0"
+            except GeneratorExit:
+                # the client went away
+                self.dispatcher.on_cancel(worker_addr)
+                raise
+            except requests.exceptions.RequestException as e:
+                self.dispatcher.on_finish(worker_addr, start_time, ok=False)
+                logger.info(f"worker failed: {worker_addr}, {e}")
+                if streamed:
+                    # part of the answer was sent, it cannot be retried on another worker
+                    ret = {
+                        "text": server_error_msg,
+                        "error_code": 3,
+                    }
+                    yield json.dumps(ret).encode() + b"\0"
+                    return
+                continue
+            self.dispatcher.on_finish(worker_addr, start_time)
+            return
+
+        if not tried:
             logger.info(f"no worker: {params['model']}")
             ret = {
                 "text": server_error_msg,
                 "error_code": 2,
             }
-            yield json.dumps(ret).encode() + b"\0"
-
-        try:
-            response = requests.post(worker_addr + "/worker_generate_stream",
-                                     json=params, stream=True, timeout=5)
-            for chunk in response.iter_lines(decode_unicode=False, delimiter=b"\0"):
-                if chunk:
-                    yield chunk + b"\0"
-        except requests.exceptions.RequestException as e:
-            logger.info(f"worker timeout: {worker_addr}")
+        else:
             ret = {
                 "text": server_error_msg,
                 "error_code": 3,
             }
-            yield json.dumps(ret).encode() + b"\0"
+        yield json.dumps(ret).encode() + b"\0"
 
     # Let the controller act as a worker to achieve hierarchical
     # management. This can be used to connect isolated sub networks.
@@ -273,7 +302,7 @@ async def get_worker_address(request: Request):
 async def receive_heart_beat(request: Request):
     data = await request.json()
     exist = controller.receive_heart_beat(
-        data["worker_name"], data["queue_length"])
+        data["worker_name"], data["queue_length"], data.get("speed", None), data.get("completions", ()))
     return {"exist": exist}
 
 
@@ -289,14 +318,21 @@ async def worker_api_get_status(request: Request):
     return controller.worker_api_get_status()
 
 
+@app.post("/dispatch_stats")
+async def dispatch_stats():
+    return controller.dispatcher.stats()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", type=str, default="localhost")
     parser.add_argument("--port", type=int, default=21001)
     parser.add_argument("--dispatch-method", type=str, choices=[
-        "lottery", "shortest_queue"], default="shortest_queue")
+        "lottery", "shortest_queue", "power_of_two"], default="power_of_two")
+    parser.add_argument("--connect-timeout", type=float, default=5)
+    parser.add_argument("--read-timeout", type=float, default=120)
     args = parser.parse_args()
     logger.info(f"args: {args}")
 
-    controller = Controller(args.dispatch_method)
+    controller = Controller(args.dispatch_method, args.connect_timeout, args.read_timeout)
     uvicorn.run(app, host=args.host, port=args.port, log_level="info")
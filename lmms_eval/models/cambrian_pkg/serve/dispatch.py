@@ -0,0 +1,179 @@
+"""
+Load tracking and worker selection for the controller.
+
+The controller only learned about worker load from heartbeats every few seconds, and about
+worker failures not at all. `Dispatcher` keeps, for every worker:
+- the requests it is streaming through the controller (`in_flight`), decremented when the
+  stream ends,
+- the addresses handed out by `/get_worker_address` since the last heartbeat, since the
+  clients then talk to the worker directly,
+- an EWMA of the latency and of the throughput of the completed requests: the controller
+  measures the streams it proxies, and the workers report the requests they served to
+  clients that streamed from them directly with their next heartbeat,
+- consecutive failures: a worker with `max_failures` of them is skipped for `cooldown`
+  seconds, then tried again.
+
+The expected wait on a worker is `(queued requests + 1) * latency`, where the latency is the
+measured EWMA, or `1 / speed` before anything completed. `POWER_OF_TWO` samples two healthy
+workers and takes the one with the shorter wait, which stays close to the best choice
+without sending every request to the same momentarily idle worker.
+"""
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class WorkerLoad:
+    def __init__(self):
+        self.in_flight = 0
+        self.dispatched_since_heart_beat = 0
+        self.latency = None
+        self.throughput = None
+        self.last_completion = None
+        self.failures = 0
+        self.unhealthy_until = 0.0
+
+    def as_dict(self):
+        return {
+            "in_flight": self.in_flight,
+            "dispatched_since_heart_beat": self.dispatched_since_heart_beat,
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "throughput": round(self.throughput, 3) if self.throughput is not None else None,
+            "failures": self.failures,
+        }
+
+
+class CompletionLog:
+    """Kept by a worker: the requests it served to clients that streamed from it directly, until its next heart beat."""
+
+    def __init__(self):
+        self.completions = []
+        self.lock = threading.Lock()
+
+    def add(self, params, start_time, ok=True):
+        # the controller measures the streams it proxies itself
+        if params.get("proxied", False):
+            return
+        now = time.time()
+        with self.lock:
+            self.completions.append((now, now - start_time, ok))
+
+    def drain(self):
+        """Returns the `completions` field of a heart beat, oldest first, and forgets them."""
+        now = time.time()
+        with self.lock:
+            completions, self.completions = self.completions, []
+        return [{"latency": latency, "age": now - end_time, "ok": ok} for end_time, latency, ok in completions]
+
+
+class Dispatcher:
+    def __init__(self, alpha=0.2, max_failures=3, cooldown=30.0, pool_maxsize=64, seed=None):
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.loads = {}
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        # keep-alive connections to the workers, shared by all streams
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _load(self, worker_name):
+        if worker_name not in self.loads:
+            self.loads[worker_name] = WorkerLoad()
+        return self.loads[worker_name]
+
+    def remove(self, worker_name):
+        with self.lock:
+            self.loads.pop(worker_name, None)
+
+    def is_healthy(self, worker_name):
+        with self.lock:
+            return self._load(worker_name).unhealthy_until <= time.time()
+
+    def expected_wait(self, worker_name, queue_length, speed):
+        """Expected seconds until a new request on the worker completes."""
+        with self.lock:
+            return self._expected_wait(worker_name, queue_length, speed)
+
+    def _expected_wait(self, worker_name, queue_length, speed):
+        load = self._load(worker_name)
+        queued = max(queue_length + load.dispatched_since_heart_beat, load.in_flight)
+        latency = load.latency if load.latency is not None else 1.0 / max(speed, 1e-4)
+        return (queued + 1) * latency
+
+    def choose(self, workers):
+        """Picks a worker from `workers`, {name: (queue_length, speed)}, by power of two choices among the healthy ones."""
+        now = time.time()
+        with self.lock:
+            healthy = [name for name in workers if self._load(name).unhealthy_until <= now]
+            # when every worker failed recently, trying one beats failing the request outright
+            candidates = healthy or list(workers)
+            if not candidates:
+                return ""
+            sampled = self.rng.sample(candidates, min(2, len(candidates)))
+            return min(sampled, key=lambda name: self._expected_wait(name, *workers[name]))
+
+    def on_dispatch(self, worker_name):
+        """Counts an address handed out to a client, until the next heart beat of the worker reports it."""
+        with self.lock:
+            self._load(worker_name).dispatched_since_heart_beat += 1
+
+    def on_heart_beat(self, worker_name):
+        with self.lock:
+            self._load(worker_name).dispatched_since_heart_beat = 0
+
+    def on_start(self, worker_name):
+        with self.lock:
+            self._load(worker_name).in_flight += 1
+        return time.time()
+
+    def on_finish(self, worker_name, start_time, ok=True):
+        """Ends a request started with `on_start`, updating the latency and throughput EWMAs or the failure count."""
+        now = time.time()
+        with self.lock:
+            load = self._load(worker_name)
+            load.in_flight = max(0, load.in_flight - 1)
+            self._record(load, now, now - start_time, ok)
+
+    def on_report(self, worker_name, completions):
+        """Records the requests a worker served to clients that streamed from it directly.
+
+        `completions` come with its heart beat, oldest first: `{"latency", "age", "ok"}`, where
+        `age` is the seconds since the request ended, as the worker and controller clocks differ.
+        """
+        now = time.time()
+        with self.lock:
+            load = self._load(worker_name)
+            for completion in completions:
+                self._record(load, now - completion["age"], completion["latency"], completion["ok"])
+
+    def _record(self, load, end_time, latency, ok):
+        if not ok:
+            load.failures += 1
+            if load.failures >= self.max_failures:
+                load.unhealthy_until = end_time + self.cooldown
+            return
+        load.failures = 0
+        load.unhealthy_until = 0.0
+        load.latency = latency if load.latency is None else (1 - self.alpha) * load.latency + self.alpha * latency
+        if load.last_completion is not None and end_time > load.last_completion:
+            rate = 1.0 / (end_time - load.last_completion)
+            load.throughput = rate if load.throughput is None else (1 - self.alpha) * load.throughput + self.alpha * rate
+        # reported completions may end before the last proxied one
+        load.last_completion = end_time if load.last_completion is None else max(load.last_completion, end_time)
+
+    def on_cancel(self, worker_name):
+        """Ends a request started with `on_start` that was abandoned by its client."""
+        with self.lock:
+            load = self._load(worker_name)
+            load.in_flight = max(0, load.in_flight - 1)
+
+    def stats(self):
+        with self.lock:
+            return {name: load.as_dict() for name, load in self.loads.items()}
@@ -227,11 +227,16 @@ def http_bot(state, model_selector, temperature, top_p, max_new_tokens, request:
         # Stream output
         response = requests.post(worker_addr + "/worker_generate_stream",
             headers=headers, json=pload, stream=True, timeout=10)
+        output = ""
         for chunk in response.iter_lines(decode_unicode=False, delimiter=b"\0"):
             if chunk:
                 data = json.loads(chunk.decode())
                 if data["error_code"] == 0:
-                    output = data["text"][len(prompt):].strip()
+                    if "delta" in data:
+                        # workers with continuous batching only send the new text
+                        output = (output + data["delta"]).lstrip()
+                    else:
+                        output = data["text"][len(prompt):].strip()
                     state.messages[-1][-1] = output + "▌"
                     yield (state, state.to_gradio_chatbot()) + (disable_btn,) * 5
                 else:
@@ -0,0 +1,133 @@
+"""
+Load test of the controller dispatch methods against fake local workers.
+
+Every fake worker is an HTTP server streaming `/worker_generate_stream` chunks like
+`model_worker.py`, serving one request at a time with its own time per token. One worker
+is slow and one is flaky: it drops a fraction of its connections. The workers send
+heart beats to an in-process `Controller`, and concurrent clients stream through
+`Controller.worker_api_generate_stream`. For every dispatch method the test reports the
+mean and p95 latency, the throughput and the failed requests.
+
+    python -m cambrian.serve.load_test --num-requests 400 --concurrency 16
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cambrian.serve.controller import Controller
+
+MODEL_NAME = "fake-model"
+
+
+class FakeWorker:
+    def __init__(self, seconds_per_token, failure_rate=0.0, seed=0):
+        self.seconds_per_token = seconds_per_token
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # one request runs at a time, like `--limit-model-concurrency 1`
+        self.model_lock = threading.Lock()
+        self.queue_length = 0
+        worker = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                params = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                worker.handle(self, params)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.address = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def speed(self):
+        return 1.0 / self.seconds_per_token
+
+    def handle(self, handler, params):
+        if self.rng.random() < self.failure_rate:
+            handler.close_connection = True
+            handler.connection.close()
+            return
+        with self.lock:
+            self.queue_length += 1
+        handler.send_response(200)
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        try:
+            with self.model_lock:
+                for i in range(params["max_new_tokens"]):
+                    time.sleep(self.seconds_per_token)
+                    data = json.dumps({"delta": "x", "error_code": 0}).encode() + b"\0"
+                    handler.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            handler.wfile.write(b"0\r\n\r\n")
+        finally:
+            with self.lock:
+                self.queue_length -= 1
+
+
+def heart_beats(controller, workers, interval, stop):
+    while not stop.is_set():
+        for worker in workers:
+            controller.receive_heart_beat(worker.address, worker.queue_length, worker.speed)
+        stop.wait(interval)
+
+
+def run(dispatch_method, args):
+    workers = [FakeWorker(args.seconds_per_token * factor, seed=i) for i, factor in enumerate([1, 1, 1, 3])]
+    workers.append(FakeWorker(args.seconds_per_token, failure_rate=args.failure_rate, seed=len(workers)))
+
+    controller = Controller(dispatch_method)
+    for worker in workers:
+        controller.register_worker(worker.address, False,
+                                   {"model_names": [MODEL_NAME], "speed": worker.speed, "queue_length": 0})
+    stop = threading.Event()
+    threading.Thread(target=heart_beats, args=(controller, workers, args.heart_beat_interval, stop), daemon=True).start()
+
+    def request(_):
+        start = time.time()
+        params = {"model": MODEL_NAME, "prompt": "", "max_new_tokens": args.max_new_tokens}
+        ok = False
+        for chunk in controller.worker_api_generate_stream(params):
+            ok = json.loads(chunk[:-1])["error_code"] == 0
+        return time.time() - start, ok
+
+    start = time.time()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(request, range(args.num_requests)))
+    elapsed = time.time() - start
+    stop.set()
+    for worker in workers:
+        worker.server.shutdown()
+
+    latencies = sorted(latency for latency, ok in results if ok)
+    failed = sum(not ok for _, ok in results)
+    mean = sum(latencies) / max(len(latencies), 1)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else float("nan")
+    return mean, p95, len(results) / elapsed, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dispatch-methods", type=str, default="lottery,shortest_queue,power_of_two")
+    parser.add_argument("--num-requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--max-new-tokens", type=int, default=8)
+    parser.add_argument("--seconds-per-token", type=float, default=0.005)
+    parser.add_argument("--failure-rate", type=float, default=0.2)
+    parser.add_argument("--heart-beat-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"{'dispatch':>16} {'mean (s)':>9} {'p95 (s)':>9} {'req/s':>8} {'failed':>7}")
+    for dispatch_method in args.dispatch_methods.split(","):
+        mean, p95, throughput, failed = run(dispatch_method, args)
+        print(f"{dispatch_method:>16} {mean:>9.3f} {p95:>9.3f} {throughput:>8.1f} {failed:>7}")
@@ -21,6 +21,8 @@ from cambrian.utils import (server_error_msg,
 from cambrian.model.builder import load_pretrained_model
 from cambrian.mm_utils import process_images, load_image_from_base64, tokenizer_image_token, KeywordsStoppingCriteria
 from cambrian.constants import IMAGE_TOKEN_INDEX, DEFAULT_IMAGE_TOKEN, DEFAULT_IM_START_TOKEN, DEFAULT_IM_END_TOKEN
+from cambrian.serve.batch_scheduler import BatchScheduler, GenerationRequest, ImageCache
+from cambrian.serve.dispatch import CompletionLog
 from transformers import TextIteratorStreamer
 from threading import Thread
 
@@ -47,7 +49,8 @@ class ModelWorker:
     def __init__(self, controller_addr, worker_addr,
                  worker_id, no_register,
                  model_path, model_base, model_name,
-                 load_8bit, load_4bit, device):
+                 load_8bit, load_4bit, device,
+                 continuous_batching=False, max_batch_size=8, image_cache_size=64):
         self.controller_addr = controller_addr
         self.worker_addr = worker_addr
         self.worker_id = worker_id
@@ -68,6 +71,18 @@ class ModelWorker:
             model_path, model_base, self.model_name, load_8bit, load_4bit, device=self.device)
         self.is_multimodal = 'cambrian' in self.model_name.lower()
 
+        # with continuous batching, requests are queued to one scheduler instead of the semaphore
+        self.scheduler = None
+        self.image_cache = None
+        if continuous_batching:
+            self.scheduler = BatchScheduler(
+                self.model, self.tokenizer, max_batch_size=max_batch_size,
+                max_context_length=getattr(self.model.config, 'max_position_embeddings', 2048))
+            self.image_cache = ImageCache(image_cache_size)
+
+        # reported with the heart beats, for clients that stream from the worker directly
+        self.completion_log = CompletionLog()
+
         if not no_register:
             self.register_to_controller()
             self.heart_beat_thread = threading.Thread(
@@ -93,11 +108,14 @@ class ModelWorker:
 
         url = self.controller_addr + "/receive_heart_beat"
 
+        completions = self.completion_log.drain()
         while True:
             try:
                 ret = requests.post(url, json={
                     "worker_name": self.worker_addr,
-                    "queue_length": self.get_queue_length()}, timeout=5)
+                    "queue_length": self.get_queue_length(),
+                    "speed": self.get_speed(),
+                    "completions": completions}, timeout=5)
                 exist = ret.json()["exist"]
                 break
             except requests.exceptions.RequestException as e:
@@ -108,16 +126,26 @@ class ModelWorker:
             self.register_to_controller()
 
     def get_queue_length(self):
+        if self.scheduler is not None:
+            return self.scheduler.queue_length
         if model_semaphore is None:
             return 0
         else:
             return args.limit_model_concurrency - model_semaphore._value + (len(
                 model_semaphore._waiters) if model_semaphore._waiters is not None else 0)
 
+    def get_speed(self):
+        """Requests completed per second over the last minute with continuous batching, 1 otherwise."""
+        if self.scheduler is None:
+            return 1
+        requests_per_second, _ = self.scheduler.throughput()
+        # a worker that finished nothing recently is not slower than one that never reported
+        return requests_per_second if requests_per_second > 0 else 1
+
     def get_status(self):
         return {
             "model_names": [self.model_name],
-            "speed": 1,
+            "speed": self.get_speed(),
             "queue_length": self.get_queue_length(),
         }
 
@@ -195,11 +223,60 @@ class ModelWorker:
                     generated_text = generated_text[:-len(stop_str)]
             yield json.dumps({"text": generated_text, "error_code": 0}).encode() + b"\0"
 
+    def load_image(self, image_b64):
+        """Decodes and preprocesses one image: (image size, one tensor per vision tower on the device)."""
+        image = load_image_from_base64(image_b64)
+        return image.size, process_images([image], self.image_processor, self.model.config)
+
+    def generate_stream_batched(self, params):
+        """Same parameters as `generate_stream`, queued to the batch scheduler; streams `{"delta": new text}` chunks."""
+        tokenizer, model = self.tokenizer, self.model
+
+        prompt = params["prompt"]
+        images = params.get("images", None)
+        num_image_tokens = 0
+        image_tensors = None
+        image_sizes = None
+        if images is not None and len(images) > 0 and self.is_multimodal:
+            if len(images) != prompt.count(DEFAULT_IMAGE_TOKEN):
+                raise ValueError("Number of images does not match number of <image> tokens in prompt")
+
+            loaded = [self.image_cache.get(image, self.load_image) for image in images]
+            image_sizes = [size for size, _ in loaded]
+            image_tensors = [torch.cat(per_tower, dim=0) for per_tower in zip(*[tensors for _, tensors in loaded])]
+
+            replace_token = DEFAULT_IMAGE_TOKEN
+            if getattr(self.model.config, 'mm_use_im_start_end', False):
+                replace_token = DEFAULT_IM_START_TOKEN + replace_token + DEFAULT_IM_END_TOKEN
+            prompt = prompt.replace(DEFAULT_IMAGE_TOKEN, replace_token)
+            num_image_tokens = 576
+
+        temperature = float(params.get("temperature", 1.0))
+        top_p = float(params.get("top_p", 1.0))
+        max_context_length = getattr(model.config, 'max_position_embeddings', 2048)
+        max_new_tokens = min(int(params.get("max_new_tokens", 256)), 1024)
+        input_ids = tokenizer_image_token(prompt, tokenizer, IMAGE_TOKEN_INDEX, return_tensors='pt')
+
+        max_new_tokens = min(max_new_tokens, max_context_length - input_ids.shape[-1] - num_image_tokens)
+
+        if max_new_tokens < 1:
+            yield json.dumps({"delta": "Exceeds max token length. Please start a new conversation, thanks.", "error_code": 0}).encode() + b"\0"
+            return
+
+        request = self.scheduler.submit(GenerationRequest(
+            input_ids, image_tensors, image_sizes, temperature, top_p, max_new_tokens, params.get("stop", None)))
+        for delta in request.stream():
+            yield json.dumps({"delta": delta, "error_code": 0}).encode() + b"\0"
+
     def generate_stream_gate(self, params):
+        start_time = time.time()
+        ok = True
         try:
-            for x in self.generate_stream(params):
+            generate_stream = self.generate_stream if self.scheduler is None else self.generate_stream_batched
+            for x in generate_stream(params):
                 yield x
         except ValueError as e:
+            ok = False
             print("Caught ValueError:", e)
             ret = {
                 "text": server_error_msg,
@@ -207,6 +284,7 @@ class ModelWorker:
             }
             yield json.dumps(ret).encode() + b"\0"
         except torch.cuda.CudaError as e:
+            ok = False
             print("Caught torch.cuda.CudaError:", e)
             ret = {
                 "text": server_error_msg,
@@ -214,12 +292,15 @@ class ModelWorker:
             }
             yield json.dumps(ret).encode() + b"\0"
         except Exception as e:
+            ok = False
             print("Caught Unknown Error", e)
             ret = {
                 "text": server_error_msg,
                 "error_code": 1,
             }
             yield json.dumps(ret).encode() + b"\0"
+        # not reached when the client closed the stream early
+        self.completion_log.add(params, start_time, ok)
 
 
 app = FastAPI()
@@ -237,6 +318,10 @@ async def generate_stream(request: Request):
     global_counter += 1
     params = await request.json()
 
+    if worker.scheduler is not None:
+        # the scheduler queues and batches the requests itself
+        return StreamingResponse(worker.generate_stream_gate(params))
+
     if model_semaphore is None:
         model_semaphore = asyncio.Semaphore(args.limit_model_concurrency)
     await model_semaphore.acquire()
@@ -270,6 +355,9 @@ if __name__ == "__main__":
     parser.add_argument("--no-register", action="store_true")
     parser.add_argument("--load-8bit", action="store_true")
     parser.add_argument("--load-4bit", action="store_true")
+    parser.add_argument("--continuous-batching", action="store_true", help="Batch concurrent requests into shared generate calls and stream text deltas.")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--image-cache-size", type=int, default=64, help="Preprocessed images kept on the device with --continuous-batching.")
     args = parser.parse_args()
     logger.info(f"args: {args}")
 
@@ -285,5 +373,8 @@ if __name__ == "__main__":
                          args.model_name,
                          args.load_8bit,
                          args.load_4bit,
-                         args.device)
+                         args.device,
+                         args.continuous_batching,
+                         args.max_batch_size,
+                         args.image_cache_size)
     uvicorn.run(app, host=args.host, port=args.port, log_level="info")
@@ -17,6 +17,7 @@ import uvicorn
 from functools import partial
 
 from cambrian.constants import WORKER_HEART_BEAT_INTERVAL
+from cambrian.serve.dispatch import CompletionLog
 from cambrian.utils import (build_logger, server_error_msg,
     pretty_print_semaphore)
 from cambrian.mm_utils import process_images, load_image_from_base64, tokenizer_image_token, expand2square
@@ -76,6 +77,9 @@ class ModelWorker:
 
         logger.info(f"Loading the SGLANG model {self.model_name} on worker {worker_id} ...")
 
+        # reported with the heart beats, for clients that stream from the worker directly
+        self.completion_log = CompletionLog()
+
         if not no_register:
             self.register_to_controller()
             self.heart_beat_thread = threading.Thread(
@@ -101,11 +105,13 @@ class ModelWorker:
 
         url = self.controller_addr + "/receive_heart_beat"
 
+        completions = self.completion_log.drain()
         while True:
             try:
                 ret = requests.post(url, json={
                     "worker_name": self.worker_addr,
-                    "queue_length": self.get_queue_length()}, timeout=5)
+                    "queue_length": self.get_queue_length(),
+                    "completions": completions}, timeout=5)
                 exist = ret.json()["exist"]
                 break
             except requests.exceptions.RequestException as e:
@@ -170,10 +176,13 @@ class ModelWorker:
             yield json.dumps({"text": generated_text, "error_code": 0}).encode() + b"\0"
 
     async def generate_stream_gate(self, params):
+        start_time = time.time()
+        ok = True
         try:
             async for x in self.generate_stream(params):
                 yield x
         except ValueError as e:
+            ok = False
             print("Caught ValueError:", e)
             ret = {
                 "text": server_error_msg,
@@ -181,12 +190,15 @@ class ModelWorker:
             }
             yield json.dumps(ret).encode() + b"\0"
         except Exception as e:
+            ok = False
             print("Caught Unknown Error", e)
             ret = {
                 "text": server_error_msg,
                 "error_code": 1,
             }
             yield json.dumps(ret).encode() + b"\0"
+        # not reached when the client closed the stream early
+        self.completion_log.add(params, start_time, ok)
 
 
 app = FastAPI()
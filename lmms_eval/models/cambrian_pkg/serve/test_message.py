@@ -41,10 +41,14 @@ def main():
             json=pload, stream=True)
 
     print(prompt.replace(conv.sep, "\n"), end="")
+    output = ""
     for chunk in response.iter_lines(chunk_size=8192, decode_unicode=False, delimiter=b"\0"):
         if chunk:
             data = json.loads(chunk.decode("utf-8"))
-            output = data["text"].split(conv.sep)[-1]
+            if "delta" in data:
+                output += data["delta"]
+            else:
+                output = data["text"].split(conv.sep)[-1]
             print(output, end="\r")
     print("")
 
@@ -5,11 +5,11 @@ import base64
 import json
 from typing import List, Tuple, Union
 from tqdm import tqdm
-import time
 
 from lmms_eval.api.instance import Instance
 from lmms_eval.api.model import lmms
 from lmms_eval.api.registry import register_model
+from lmms_eval.api.request_engine import RequestEngine
 
 from accelerate import Accelerator, DistributedType
 
@@ -42,6 +42,9 @@ class Claude(lmms):
         modality: str = "image",
         continual_mode: bool = False,
         response_persistent_folder: str = None,
+        max_frames_for_video: int = 10,
+        max_in_flight: int = 8,
+        requests_per_second: float = None,
         **kwargs,
     ) -> None:
         super().__init__()
@@ -49,6 +52,8 @@ class Claude(lmms):
         self.image_token = image_token
         self.system_prompt = system_prompt
         self.modality = modality
+        self.max_frames_for_video = max_frames_for_video
+        self.request_engine = RequestEngine(max_in_flight=max_in_flight, requests_per_second=requests_per_second, max_delay=NUM_SECONDS_TO_SLEEP)
 
         self.continual_mode = continual_mode
         if self.continual_mode and response_persistent_folder is None:
@@ -144,12 +149,8 @@ class Claude(lmms):
 
         return base64_frames
 
-    def generate_until(self, requests) -> List[str]:
-        client = anthropic.Anthropic()
-
-        res = []
-        pbar = tqdm(total=len(requests), disable=(self.rank != 0), desc="Model Responding")
-
+    def build_messages(self, request: Instance) -> dict:
+        contexts, gen_kwargs, doc_to_visual, doc_id, task, split = request.args
         empty_image_block = {
             "type": "image",
             "source": {
@@ -158,96 +159,94 @@ class Claude(lmms):
             },
         }
         empty_text_block = {"type": "text"}
-        empty_messages = [
-            {
-                "role": "user",
-                "content": [],
-            }
-        ]
-
-        for contexts, gen_kwargs, doc_to_visual, doc_id, task, split in [reg.args for reg in requests]:
-            ###################### CONTINUAL MODE ######################
-            if self.continual_mode is True and self.cache_mode == "resume":
-                doc_uuid = f"{task}___{split}___{doc_id}"
-                if doc_uuid in self.response_cache:
-                    response_text = self.response_cache[doc_uuid]
-                    if response_text:
-                        res.append(response_text)
-                        pbar.update(1)
-                        continue
-
-            visuals = [doc_to_visual(self.task_dict[task][split][doc_id])]
-            visuals = self.flatten(visuals)
-            imgs = []
-            for visual in visuals:
-                if isinstance(visual, str) and os.path.exists(visual):  # Assuming visual is a path to a video
-                    visual = self.encode_video(visual)
-                    for img in visual:
-                        imgs.append(img)
-                else:
-                    visual = self.shrink_image_to_file_size(visual)
-                    img = self.encode_image(visual)
-                    imgs.append(img)
-
-            messages = deepcopy(empty_messages)
 
-            if self.image_token not in contexts:
-                for img in imgs:
-                    image_block = deepcopy(empty_image_block)
-                    image_block["source"]["data"] = img
-                    messages[0]["content"].append(image_block)
-                text_block = deepcopy(empty_text_block)
-                text_block["text"] = contexts
-                messages[0]["content"].append(text_block)
+        visuals = [doc_to_visual(self.task_dict[task][split][doc_id])]
+        visuals = self.flatten(visuals)
+        imgs = []
+        for visual in visuals:
+            if isinstance(visual, str) and os.path.exists(visual):  # Assuming visual is a path to a video
+                visual = self.encode_video(visual)
+                for img in visual:
+                    imgs.append(img)
             else:
-                contexts = contexts.split(self.image_token)
-                for idx, img in enumerate(imgs):
-                    text_block = deepcopy(empty_text_block)
-                    image_block = deepcopy(empty_image_block)
-                    text_block["text"] = contexts
-                    messages[0]["content"].append(text_block)
-                    image_block["source"]["data"] = img
-                    messages[0]["content"].append(image_block)
-
-                # If n image tokens are in the contexts
-                # contexts will be splitted into n+1 chunks
-                # Manually add it into the messages
+                visual = self.shrink_image_to_file_size(visual)
+                img = self.encode_image(visual)
+                imgs.append(img)
+
+        messages = [{"role": "user", "content": []}]
+
+        if self.image_token not in contexts:
+            for img in imgs:
+                image_block = deepcopy(empty_image_block)
+                image_block["source"]["data"] = img
+                messages[0]["content"].append(image_block)
+            text_block = deepcopy(empty_text_block)
+            text_block["text"] = contexts
+            messages[0]["content"].append(text_block)
+        else:
+            contexts = contexts.split(self.image_token)
+            for idx, img in enumerate(imgs):
                 text_block = deepcopy(empty_text_block)
-                text_block["text"] = contexts
-                messages["content"].append(text_block)
-
-            if "max_new_tokens" not in gen_kwargs:
-                gen_kwargs["max_new_tokens"] = 1024
-            if "temperature" not in gen_kwargs:
-                gen_kwargs["temperature"] = 0
-            if "top_p" not in gen_kwargs:
-                gen_kwargs["top_p"] = None
-            if "num_beams" not in gen_kwargs:
-                gen_kwargs["num_beams"] = 1
-
-            for attempt in range(5):
-                try:
-                    message = client.messages.create(model=self.model_version, max_tokens=gen_kwargs["max_new_tokens"], system=self.system_prompt, temperature=gen_kwargs["temperature"], top_p=gen_kwargs["top_p"], messages=messages)
-                except Exception as e:
-                    eval_logger.info(f"Attempt {attempt + 1} failed with error: {str(e)}")
-                    if attempt < 5 - 1:  # If we have retries left, sleep and then continue to next attempt
-                        time.sleep(NUM_SECONDS_TO_SLEEP)
-                    else:  # If this was the last attempt, log and return empty
-                        eval_logger.error(f"All 5 attempts failed. Last error message: {str(e)}")
-                        res.append("")
-                        pbar.update(1)
-                        continue
-
-            res.append(message.content[0].text)
-            pbar.update(1)
+                image_block = deepcopy(empty_image_block)
+                text_block["text"] = contexts[idx]
+                messages[0]["content"].append(text_block)
+                image_block["source"]["data"] = img
+                messages[0]["content"].append(image_block)
+
+            # If n image tokens are in the contexts
+            # contexts will be splitted into n+1 chunks
+            # Manually add it into the messages
+            text_block = deepcopy(empty_text_block)
+            text_block["text"] = contexts[-1]
+            messages[0]["content"].append(text_block)
+
+        if "max_new_tokens" not in gen_kwargs:
+            gen_kwargs["max_new_tokens"] = 1024
+        if "temperature" not in gen_kwargs:
+            gen_kwargs["temperature"] = 0
+        if "top_p" not in gen_kwargs:
+            gen_kwargs["top_p"] = None
+        if "num_beams" not in gen_kwargs:
+            gen_kwargs["num_beams"] = 1
+
+        return {"messages": messages, "gen_kwargs": gen_kwargs}
+
+    def generate_until(self, requests) -> List[str]:
+        client = anthropic.Anthropic()
+
+        res = [None] * len(requests)
+        pbar = tqdm(total=len(requests), disable=(self.rank != 0), desc="Model Responding")
 
+        def get_uuid(request):
+            _, _, _, doc_id, task, split = request.args
+            return f"{task}___{split}___{doc_id}"
+
+        ###################### CONTINUAL MODE ######################
+        pending = []
+        for idx, request in enumerate(requests):
+            if self.continual_mode is True and self.cache_mode == "resume":
+                response_text = self.response_cache.get(get_uuid(request))
+                if response_text:
+                    res[idx] = response_text
+                    pbar.update(1)
+                    continue
+            pending.append(idx)
+
+        def send(prepared):
+            gen_kwargs = prepared["gen_kwargs"]
+            message = client.messages.create(model=self.model_version, max_tokens=gen_kwargs["max_new_tokens"], system=self.system_prompt, temperature=gen_kwargs["temperature"], top_p=gen_kwargs["top_p"], messages=prepared["messages"])
+            return message.content[0].text
+
+        def on_result(pending_idx, response_text):
+            request = requests[pending[pending_idx]]
+            res[pending[pending_idx]] = response_text
             ###################### CONTINUAL MODE ######################
             if self.continual_mode is True:  # Cache the response
-                doc_uuid = f"{task}___{split}___{doc_id}"
-                self.response_cache[doc_uuid] = response_text
+                self.response_cache[get_uuid(request)] = response_text
                 with open(self.response_persistent_file, "w") as f:
                     json.dump(self.response_cache, f)
 
+        self.request_engine.run(send, [requests[idx] for idx in pending], prepare=self.build_messages, on_result=on_result, pbar=pbar)
         pbar.close()
 
         return res
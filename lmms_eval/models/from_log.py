@@ -8,6 +8,7 @@ from tqdm import tqdm
 from lmms_eval.api.registry import register_model
 from lmms_eval.api.model import lmms
 from lmms_eval.api.instance import Instance
+from lmms_eval.api.sample_log import INDEX_SUFFIX, iter_samples, read_sample_index
 from accelerate import Accelerator, DistributedType
 
 from loguru import logger as eval_logger
@@ -52,8 +53,15 @@ class FromLog(lmms):
                         try:
                             log_file = os.path.join(root, file)
 
-                            with open(log_file, "r") as f:
-                                log_data = json.load(f)
+                            if file.endswith(INDEX_SUFFIX):
+                                # streamed logs, the header is in the index and the samples are read shard by shard
+                                log_data = read_sample_index(log_file)
+                                if log_data["format"] == "json":
+                                    # indexes the score files of a {task}.json log, which is read on its own
+                                    continue
+                            else:
+                                with open(log_file, "r") as f:
+                                    log_data = json.load(f)
 
                             # check if model is matched
                             _model_args = log_data["args"]
@@ -62,7 +70,7 @@ class FromLog(lmms):
 
                             # load logs
                             logs = {}
-                            for data in log_data["logs"]:
+                            for data in iter_samples(log_file) if file.endswith(INDEX_SUFFIX) else log_data["logs"]:
                                 id = data["doc_id"]
                                 response = data["resps"][0]
                                 logs[id] = response
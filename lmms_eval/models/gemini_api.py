@@ -10,6 +10,7 @@ from tqdm import tqdm
 from lmms_eval.api.registry import register_model
 from lmms_eval.api.model import lmms
 from lmms_eval.api.instance import Instance
+from lmms_eval.api.request_engine import RequestEngine
 from accelerate import Accelerator, DistributedType
 
 from loguru import logger as eval_logger
@@ -36,12 +37,15 @@ class GeminiAPI(lmms):
         timeout: int = 120,
         continual_mode: bool = False,
         response_persistent_folder: str = None,  # We will cache the Gemini API response in this path and use it for future requests
+        max_in_flight: int = 8,
+        requests_per_second: float = None,
         **kwargs,
     ) -> None:
         super().__init__()
         self.model_version = model_version
         self.timeout = timeout
         self.model = genai.GenerativeModel(model_version)
+        self.request_engine = RequestEngine(max_in_flight=max_in_flight, requests_per_second=requests_per_second, max_delay=NUM_SECONDS_TO_SLEEP)
         self.continual_mode = continual_mode
         if self.continual_mode and response_persistent_folder is None:
             raise ValueError("Continual mode requires a persistent path for the response. We will cache the Gemini API response in this path and use it for future requests. Please provide a valid path.")
@@ -107,76 +111,69 @@ class GeminiAPI(lmms):
                     eval_logger.error(f"Error converting video: {str(e)}")
         return images
 
+    def build_message(self, request: Instance) -> dict:
+        contexts, gen_kwargs, doc_to_visual, doc_id, task, split = request.args
+        if "max_new_tokens" not in gen_kwargs:
+            gen_kwargs["max_new_tokens"] = 1024
+        if "temperature" not in gen_kwargs:
+            gen_kwargs["temperature"] = 0
+
+        config = genai.GenerationConfig(
+            max_output_tokens=gen_kwargs["max_new_tokens"],
+            temperature=gen_kwargs["temperature"],
+        )
+
+        visuals = [doc_to_visual(self.task_dict[task][split][doc_id])]
+        visuals = self.flatten(visuals)
+        visuals = self.convert_video(visuals)
+
+        return {"message": [contexts] + visuals, "config": config}
+
+    def send_message(self, prepared: dict) -> str:
+        response = self.model.generate_content(
+            prepared["message"],
+            generation_config=prepared["config"],
+            safety_settings={
+                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+            },
+        )
+        try:
+            return response.text
+        except ValueError as e:
+            # The prompt or the answer was blocked, retrying will not help
+            eval_logger.info(f"Failed to read the response: {str(e)}. Prompt feed_back: {response.prompt_feedback}")
+            return ""
+
     def generate_until(self, requests) -> List[str]:
-        res = []
+        res = [None] * len(requests)
         pbar = tqdm(total=len(requests), disable=(self.rank != 0), desc="Model Responding")
 
         def get_uuid(task, split, doc_id):
             return f"{task}___{split}___{doc_id}"
 
-        for contexts, gen_kwargs, doc_to_visual, doc_id, task, split in [reg.args for reg in requests]:
+        pending = []
+        for idx, request in enumerate(requests):
+            _, _, _, doc_id, task, split = request.args
             if self.continual_mode is True and self.cache_mode == "resume":
-                doc_uuid = get_uuid(task, split, doc_id)
-                if doc_uuid in self.response_cache:
-                    content = self.response_cache[doc_uuid]
-                    if content:
-                        res.append(content)
-                        pbar.update(1)
-                        continue
-
-            if "max_new_tokens" not in gen_kwargs:
-                gen_kwargs["max_new_tokens"] = 1024
-            if "temperature" not in gen_kwargs:
-                gen_kwargs["temperature"] = 0
-
-            config = genai.GenerationConfig(
-                max_output_tokens=gen_kwargs["max_new_tokens"],
-                temperature=gen_kwargs["temperature"],
-            )
-
-            visuals = [doc_to_visual(self.task_dict[task][split][doc_id])]
-            visuals = self.flatten(visuals)
-            visuals = self.convert_video(visuals)
-
-            message = [contexts] + visuals
-
-            for attempt in range(5):
-                try:
-                    content = self.model.generate_content(
-                        message,
-                        generation_config=config,
-                        safety_settings={
-                            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                        },
-                    )
-                    content = content.text
-                    break
-                except Exception as e:
-                    eval_logger.info(f"Attempt {attempt + 1} failed with error: {str(e)}")
-                    if isinstance(e, ValueError):
-                        try:
-                            eval_logger.info(f"Prompt feed_back: {content.prompt_feedback}")
-                            content = ""
-                            break
-                        except Exception:
-                            pass
-                    if attempt < 5 - 1:  # If we have retries left, sleep and then continue to next attempt
-                        time.sleep(NUM_SECONDS_TO_SLEEP)
-                    else:  # If this was the last attempt, log and return empty
-                        eval_logger.error(f"All 5 attempts failed. Last error message: {str(e)}")
-                        content = ""
-            res.append(content)
-            pbar.update(1)
-
+                content = self.response_cache.get(get_uuid(task, split, doc_id))
+                if content:
+                    res[idx] = content
+                    pbar.update(1)
+                    continue
+            pending.append(idx)
+
+        def on_result(pending_idx, content):
+            res[pending[pending_idx]] = content
             if self.continual_mode is True:  # Cache the response
-                doc_uuid = get_uuid(task, split, doc_id)
-                self.response_cache[doc_uuid] = content
+                _, _, _, doc_id, task, split = requests[pending[pending_idx]].args
+                self.response_cache[get_uuid(task, split, doc_id)] = content
                 with open(self.response_persistent_file, "w") as f:
                     json.dump(self.response_cache, f)
 
+        self.request_engine.run(self.send_message, [requests[idx] for idx in pending], prepare=self.build_message, on_result=on_result, pbar=pbar)
         pbar.close()
         return res
 
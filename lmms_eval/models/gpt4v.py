@@ -1,27 +1,22 @@
 from io import BytesIO
 from copy import deepcopy
-import numpy as np
 import os
 import base64
 from typing import List, Tuple
 from tqdm import tqdm
 import requests as url_requests
-import time
 
 
 from lmms_eval.api.instance import Instance
 from lmms_eval.api.model import lmms
 from lmms_eval.api.registry import register_model
+from lmms_eval.api.request_engine import RequestEngine
+from lmms_eval.models.model_utils.video_frames import load_video_frames
 from lmms_eval import utils
 
 from accelerate import Accelerator, DistributedType, InitProcessGroupKwargs
 from accelerate.state import AcceleratorState
 
-try:
-    from decord import VideoReader, cpu
-except ImportError:
-    pass
-
 from PIL import Image
 
 API_TYPE = os.getenv("API_TYPE", "openai")
@@ -52,6 +47,8 @@ class GPT4V(lmms):
         modality: str = "video",
         max_frames_for_video: int = 10,
         timeout: int = 120,
+        max_in_flight: int = 8,
+        requests_per_second: float = None,
         **kwargs,
     ) -> None:
         super().__init__()
@@ -63,6 +60,7 @@ class GPT4V(lmms):
         self.max_frames_for_video = max_frames_for_video
         self.image_token = "<image>"
         self.timeout = timeout
+        self.request_engine = RequestEngine(max_in_flight=max_in_flight, requests_per_second=requests_per_second, max_delay=NUM_SECONDS_TO_SLEEP)
 
         accelerator = Accelerator()
         # assert self.batch_size_per_gpu == 1, "Llava currently does not support batched generation. See https://github.com/haotian-liu/LLaVA/issues/754. HF Llava also has this issue."
@@ -90,11 +88,7 @@ class GPT4V(lmms):
 
     # Function to encode the video
     def encode_video(self, video_path, for_get_frames_num):
-        vr = VideoReader(video_path, ctx=cpu(0))
-        total_frame_num = len(vr)
-        uniform_sampled_frames = np.linspace(0, total_frame_num - 1, for_get_frames_num, dtype=int)
-        frame_idx = uniform_sampled_frames.tolist()
-        frames = vr.get_batch(frame_idx).asnumpy()
+        frames = load_video_frames(video_path, for_get_frames_num)
 
         base64_frames = []
         for frame in frames:
@@ -114,75 +108,62 @@ class GPT4V(lmms):
                 new_list.append(j)
         return new_list
 
+    def build_payload(self, request: Instance) -> dict:
+        contexts, gen_kwargs, doc_to_visual, doc_id, task, split = request.args
+        visuals = [doc_to_visual(self.task_dict[task][split][doc_id])]
+        visuals = self.flatten(visuals)
+        imgs = []  # multiple images or frames for video
+        for visual in visuals:
+            if self.modality == "image":
+                img = self.encode_image(visual)
+                imgs.append(img)
+            elif self.modality == "video":
+                frames = self.encode_video(visual, self.max_frames_for_video)
+                imgs.extend(frames)
+
+        payload = {"model": self.model_version, "messages": []}
+        response_json = {"role": "user", "content": []}
+        # When there is no image token in the context, append the image to the text
+        if self.image_token not in contexts:
+            payload["messages"].append(deepcopy(response_json))
+            payload["messages"][0]["content"].append({"type": "text", "text": contexts})
+            for img in imgs:
+                payload["messages"][0]["content"].append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img}"}})
+        else:
+            contexts = contexts.split(self.image_token)
+            for idx, img in enumerate(imgs):
+                payload["messages"].append(deepcopy(response_json))
+                payload["messages"][idx]["content"].append({"type": "text", "text": contexts[idx]})
+                payload["messages"][idx]["content"].append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img}"}})
+
+            # If n image tokens are in the contexts
+            # contexts will be splitted into n+1 chunks
+            # Manually add it into the payload
+            payload["messages"].append(deepcopy(response_json))
+            payload["messages"][-1]["content"].append({"type": "text", "text": contexts[-1]})
+
+        if "max_new_tokens" not in gen_kwargs:
+            gen_kwargs["max_new_tokens"] = 1024
+        if "temperature" not in gen_kwargs:
+            gen_kwargs["temperature"] = 0
+        if "top_p" not in gen_kwargs:
+            gen_kwargs["top_p"] = None
+        if "num_beams" not in gen_kwargs:
+            gen_kwargs["num_beams"] = 1
+
+        payload["max_tokens"] = gen_kwargs["max_new_tokens"]
+        payload["temperature"] = gen_kwargs["temperature"]
+        return payload
+
+    def send_payload(self, payload: dict) -> str:
+        response = url_requests.post(API_URL, headers=headers, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        response_data = response.json()
+        return response_data["choices"][0]["message"]["content"].strip()
+
     def generate_until(self, requests) -> List[str]:
-        res = []
         pbar = tqdm(total=len(requests), disable=(self.rank != 0), desc="Model Responding")
-
-        for contexts, gen_kwargs, doc_to_visual, doc_id, task, split in [reg.args for reg in requests]:
-            # encode, pad, and truncate contexts for this batch
-            # visuals = [doc_to_visual(self.task_dict[task][split][doc_id])]
-            visuals = [doc_to_visual(self.task_dict[task][split][0])]
-            visuals = self.flatten(visuals)
-            imgs = []  # multiple images or frames for video
-            for visual in visuals:
-                if self.modality == "image":
-                    img = self.encode_image(visual)
-                    imgs.append(img)
-                elif self.modality == "video":
-                    frames = self.encode_video(visual, self.max_frames_for_video)
-                    imgs.extend(frames)
-
-            payload = {"model": self.model_version, "messages": []}
-            response_json = {"role": "user", "content": []}
-            # When there is no image token in the context, append the image to the text
-            if self.image_token not in contexts:
-                payload["messages"].append(deepcopy(response_json))
-                payload["messages"][0]["content"].append({"type": "text", "text": contexts})
-                for img in imgs:
-                    payload["messages"][0]["content"].append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img}"}})
-            else:
-                contexts = contexts.split(self.image_token)
-                for idx, img in enumerate(imgs):
-                    payload["messages"].append(deepcopy(response_json))
-                    payload["messages"][idx]["content"].append({"type": "text", "text": contexts[idx]})
-                    payload["messages"][idx]["content"].append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img}"}})
-
-                # If n image tokens are in the contexts
-                # contexts will be splitted into n+1 chunks
-                # Manually add it into the payload
-                payload["messages"].append(deepcopy(response_json))
-                payload["messages"][-1]["content"].append({"type": "text", "text": contexts[-1]})
-
-            if "max_new_tokens" not in gen_kwargs:
-                gen_kwargs["max_new_tokens"] = 1024
-            if "temperature" not in gen_kwargs:
-                gen_kwargs["temperature"] = 0
-            if "top_p" not in gen_kwargs:
-                gen_kwargs["top_p"] = None
-            if "num_beams" not in gen_kwargs:
-                gen_kwargs["num_beams"] = 1
-
-            payload["max_tokens"] = gen_kwargs["max_new_tokens"]
-            payload["temperature"] = gen_kwargs["temperature"]
-
-            for attempt in range(5):
-                try:
-                    response = url_requests.post(API_URL, headers=headers, json=payload, timeout=self.timeout)
-                    response_data = response.json()
-
-                    content = response_data["choices"][0]["message"]["content"].strip()
-                    break  # If successful, break out of the loop
-
-                except Exception as e:
-                    eval_logger.info(f"Attempt {attempt + 1} failed with error: {str(e)}")
-                    if attempt < 5 - 1:  # If we have retries left, sleep and then continue to next attempt
-                        time.sleep(NUM_SECONDS_TO_SLEEP)
-                    else:  # If this was the last attempt, log and return empty
-                        eval_logger.error(f"All 5 attempts failed. Last error message: {str(e)}")
-                        eval_logger.error(f"Response: {response}")
-                        content = ""
-            res.append(content)
-            pbar.update(1)
+        res = self.request_engine.run(self.send_payload, requests, prepare=self.build_payload, pbar=pbar)
         pbar.close()
         return res
 
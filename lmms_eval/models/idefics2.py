@@ -53,11 +53,13 @@ class Idefics2(lmms):
         device_map: str = "",
         use_cache: bool = True,
         do_image_splitting: bool = False,
+        prefetch_depth: int = 2,  # number of batches whose images are decoded ahead of generation
         **kwargs,
     ) -> None:
         super().__init__()
         # Do not use kwargs for now
         assert kwargs == {}, f"Unexpected kwargs: {kwargs}"
+        self.prefetch_depth = int(prefetch_depth)
 
         accelerator = Accelerator()
         if accelerator.num_processes > 1 and device_map == "":
@@ -190,9 +192,13 @@ class Idefics2(lmms):
         chunks = re_ords.get_batched(n=self.batch_size, batch_fn=None)
         num_iters = len(requests) // self.batch_size if len(requests) % self.batch_size == 0 else len(requests) // self.batch_size + 1
         pbar = tqdm(total=num_iters, disable=(self.rank != 0), desc="Model Responding")
-        for chunk in chunks:
+
+        def _load_visuals(chunk):
+            _, _, doc_to_visuals, doc_id, tasks, splits = zip(*chunk)
+            return [doc_to_visual(self.task_dict[task][split][ids]) for ids, task, split, doc_to_visual in zip(doc_id, tasks, splits, doc_to_visuals)]
+
+        for chunk, visuals in self.prefetch_visuals(chunks, _load_visuals):
             contexts, all_gen_kwargs, doc_to_visuals, doc_id, tasks, splits = zip(*chunk)
-            visuals = [doc_to_visual(self.task_dict[task][split][ids]) for ids, task, split, doc_to_visual in zip(doc_id, tasks, splits, doc_to_visuals)]
             # we assume all gen kwargs in the batch are the same
             # this is safe to assume because the `grouper` object ensures it.
             gen_kwargs = all_gen_kwargs[0]
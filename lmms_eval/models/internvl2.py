@@ -155,9 +155,11 @@ class InternVL2(lmms):
         device: str = "cuda:0",
         device_map: str = "cuda:0",
         batch_size: str = "1",
+        prefetch_depth: int = 2,  # number of requests whose visuals are preprocessed ahead of generation
         **kwargs,
     ):
         super().__init__()
+        self.prefetch_depth = int(prefetch_depth)
 
         self.path = pretrained
         self.model = AutoModel.from_pretrained(self.path, torch_dtype=torch.bfloat16, low_cpu_mem_usage=True, trust_remote_code=True).eval().cuda()
@@ -226,7 +228,18 @@ class InternVL2(lmms):
         res = []
         pbar = tqdm(total=len(requests), disable=(self.rank != 0), desc="Model Responding")
 
-        for contexts, gen_kwargs, doc_to_visual, doc_id, task, split in [reg.args for reg in requests]:
+        def _load_visuals(args):
+            # decode and tile the images (or sample the video frames) on the CPU, ahead of generation
+            _, _, doc_to_visual, doc_id, task, split = args
+            visuals = [doc_to_visual(self.task_dict[task][split][doc_id])]
+            visuals = self.flatten(visuals)
+            if self.modality == "image":
+                return [load_image(visual) for visual in visuals]
+            elif self.modality == "video":
+                assert len(visuals) == 1, f"Only one video is supported, but got {len(visuals)} videos."
+                return load_video(visuals[0], num_segments=8, max_num=1)
+
+        for (contexts, gen_kwargs, doc_to_visual, doc_id, task, split), loaded in self.prefetch_visuals([reg.args for reg in requests], _load_visuals):
             if "until" in gen_kwargs:
                 gen_kwargs.pop("until")
 
@@ -234,10 +247,8 @@ class InternVL2(lmms):
                 if k not in gen_kwargs:
                     gen_kwargs[k] = v
 
-            visuals = [doc_to_visual(self.task_dict[task][split][doc_id])]
-            visuals = self.flatten(visuals)
             if self.modality == "image":
-                visuals = [load_image(visual).to(torch.bfloat16).cuda() for visual in visuals]
+                visuals = [visual.to(torch.bfloat16).cuda() for visual in loaded]
                 pixel_values = torch.cat(visuals, dim=0)
                 num_patches_list = [visual.size(0) for visual in visuals]
                 if visuals:
@@ -247,9 +258,7 @@ class InternVL2(lmms):
                 response, history = self.model.chat(self.tokenizer, pixel_values, contexts, gen_kwargs, num_patches_list=num_patches_list, history=None, return_history=True)
 
             elif self.modality == "video":
-                assert len(visuals) == 1, f"Only one video is supported, but got {len(visuals)} videos."
-                video_path = visuals[0]
-                pixel_values, num_patches_list = load_video(video_path, num_segments=8, max_num=1)
+                pixel_values, num_patches_list = loaded
                 pixel_values = pixel_values.to(torch.bfloat16).cuda()
                 video_prefix = "".join([f"Frame{i+1}: <image>\n" for i in range(len(num_patches_list))])
                 question = video_prefix + contexts
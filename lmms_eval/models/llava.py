@@ -3,14 +3,17 @@ import torch
 torch.backends.cuda.matmul.allow_tf32 = True
 
 
+import collections
 import copy
 from tqdm import tqdm
 from datetime import timedelta
 
 from lmms_eval import utils
+from lmms_eval.api.batching import AdaptiveBatcher
 from lmms_eval.api.instance import Instance
 from lmms_eval.api.model import lmms
 from lmms_eval.api.registry import register_model
+from lmms_eval.models.model_utils.prefix_cache import score_continuation, score_continuations_with_shared_prefix
 from lmms_eval.utils import stop_sequences_criteria
 
 from accelerate import Accelerator, DistributedType, InitProcessGroupKwargs
@@ -60,6 +63,9 @@ class Llava(lmms):
         use_cache=True,
         truncate_context=False,  # whether to truncate the context in generation, set it False for LLaVA-1.6
         customized_config=None,  # ends in json
+        prefetch_depth: int = 2,  # number of batches whose images are decoded and preprocessed ahead of generation
+        adaptive_batch: bool = False,  # size generation batches by estimated cost, `batch_size` is then the largest batch
+        token_budget: Optional[int] = None,  # initial padded token budget of an adaptive batch, learned from peak memory when None
         **kwargs,
     ) -> None:
         super().__init__()
@@ -104,6 +110,9 @@ class Llava(lmms):
         self.conv_template = conv_template
         self.use_cache = use_cache
         self.truncate_context = truncate_context
+        self.prefetch_depth = int(prefetch_depth)
+        self.adaptive_batch = adaptive_batch
+        self.token_budget = int(token_budget) if token_budget is not None else None
         # assert self.batch_size_per_gpu == 1, "Llava currently does not support batched generation. See https://github.com/haotian-liu/LLaVA/issues/754. HF Llava also has this issue."
         if accelerator.num_processes > 1:
             assert accelerator.distributed_type in [DistributedType.FSDP, DistributedType.MULTI_GPU, DistributedType.DEEPSPEED], "Unsupported distributed type provided. Only DDP and FSDP are supported."
@@ -202,71 +211,101 @@ class Llava(lmms):
         except:
             return self.tokenizer.decode([tokens])
 
+    def _loglikelihood_images(self, visuals):
+        image_sizes = [[visual.size[0], visual.size[1]] for visual in visuals]
+        if visuals:
+            image = process_images(visuals, self._image_processor, self._config)
+            if type(image) is list:
+                image = [_image.to(dtype=torch.float16, device=self.device) for _image in image]
+            else:
+                image = image.to(dtype=torch.float16, device=self.device)
+        else:
+            image = None
+        return image, image_sizes
+
+    def _loglikelihood_input_ids(self, contexts, continuation, visuals, image):
+        """Returns the tokenized prompt without and with the continuation."""
+        prompts_input = contexts[0] if isinstance(contexts, list) else contexts
+
+        if image is not None and len(image) != 0 and DEFAULT_IMAGE_TOKEN not in prompts_input:
+            """
+            Three senarios:
+            1. No image, and there for, no image token should be added.
+            2. image token is already specified in the context, so we don't need to add it.
+            3. image token is not specified in the context and there is image inputs, so we need to add it. In this case, we add the image token at the beginning of the context and add a new line.
+            """
+            image_tokens = [DEFAULT_IMAGE_TOKEN] * len(visuals)
+            image_tokens = " ".join(image_tokens)
+            prompts_input = image_tokens + "\n" + (contexts[0] if isinstance(contexts, list) else contexts)
+
+        # This is much safer for llama3, as we now have some object type in it
+        if "llama_3" in self.conv_template:
+            conv = copy.deepcopy(conv_templates[self.conv_template])
+        else:
+            conv = conv_templates[self.conv_template].copy()
+        conv.append_message(conv.roles[0], prompts_input)
+        conv.append_message(conv.roles[1], None)
+        prompt = conv.get_prompt()
+        contxt_id = tokenizer_image_token(prompt, self.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to(self.device)
+        # Add the answer of the second role
+        conv.messages[1][1] = continuation
+
+        prompt = conv.get_prompt()
+        input_ids = tokenizer_image_token(prompt, self.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to(self.device)
+        return contxt_id, input_ids
+
+    def _loglikelihood_one(self, contexts, continuation, visuals, image, image_sizes):
+        contxt_id, input_ids = self._loglikelihood_input_ids(contexts, continuation, visuals, image)
+        # Context part no need to calculate for loss
+        return score_continuation(self.model, input_ids, contxt_id.shape[1], {"images": image, "image_sizes": image_sizes, "use_cache": True})
+
     def loglikelihood(self, requests: List[Instance]) -> List[Tuple[float, bool]]:
-        # TODO
-        res = []
+        res = [None] * len(requests)
         pbar = tqdm(total=len(requests), disable=(self.rank != 0), desc="Model Responding")
 
-        for contexts, doc_to_target, doc_to_visual, doc_id, task, split in [reg.args for reg in requests]:
-            # encode, pad, and truncate contexts for this batch
-            if type(doc_to_target) == str:
-                continuation = doc_to_target
-            else:
-                continuation = doc_to_target(self.task_dict[task][split][doc_id])
+        # multiple_choice creates one request per choice with the same context and image,
+        # group them so that the image and the prompt are encoded once per document
+        groups = collections.defaultdict(list)
+        for idx, (contexts, doc_to_target, doc_to_visual, doc_id, task, split) in enumerate([reg.args for reg in requests]):
+            groups[(task, split, doc_id, tuple(contexts) if isinstance(contexts, list) else contexts)].append(idx)
+
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        for indices in groups.values():
+            contexts, _, doc_to_visual, doc_id, task, split = requests[indices[0]].args
+            continuations = []
+            for idx in indices:
+                doc_to_target = requests[idx].args[1]
+                if type(doc_to_target) == str:
+                    continuations.append(doc_to_target)
+                else:
+                    continuations.append(doc_to_target(self.task_dict[task][split][doc_id]))
             visuals = [doc_to_visual(self.task_dict[task][split][doc_id])]
             visuals = self.flatten(visuals)
-            image_sizes = [[visual.size[0], visual.size[1]] for visual in visuals]
-            if visuals:
-                image = process_images(visuals, self._image_processor, self._config)
-                if type(image) is list:
-                    image = [_image.to(dtype=torch.float16, device=self.device) for _image in image]
-                else:
-                    image = image.to(dtype=torch.float16, device=self.device)
-            else:
-                image = None
-
-            prompts_input = contexts[0] if isinstance(contexts, list) else contexts
-
-            if image is not None and len(image) != 0 and DEFAULT_IMAGE_TOKEN not in prompts_input:
-                """
-                Three senarios:
-                1. No image, and there for, no image token should be added.
-                2. image token is already specified in the context, so we don't need to add it.
-                3. image token is not specified in the context and there is image inputs, so we need to add it. In this case, we add the image token at the beginning of the context and add a new line.
-                """
-                image_tokens = [DEFAULT_IMAGE_TOKEN] * len(visuals)
-                image_tokens = " ".join(image_tokens)
-                prompts_input = image_tokens + "\n" + (contexts[0] if isinstance(contexts, list) else contexts)
-
-            # This is much safer for llama3, as we now have some object type in it
-            if "llama_3" in self.conv_template:
-                conv = copy.deepcopy(conv_templates[self.conv_template])
-            else:
-                conv = conv_templates[self.conv_template].copy()
-            conv.append_message(conv.roles[0], prompts_input)
-            conv.append_message(conv.roles[1], None)
-            prompt = conv.get_prompt()
-            pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
-            contxt_id = tokenizer_image_token(prompt, self.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to(self.device)
-            # Add the answer of the second role
-            conv.messages[1][1] = continuation
-
-            prompt = conv.get_prompt()
-            input_ids = tokenizer_image_token(prompt, self.tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt").unsqueeze(0).to(self.device)
-            labels = input_ids.clone()
-            # Context part no need to calculate for loss
-            labels[0, : contxt_id.shape[1]] = -100
-            with torch.inference_mode():
-                outputs = self.model(input_ids=input_ids, labels=labels, images=image, use_cache=True, image_sizes=image_sizes)
-            loss = outputs["loss"]
-            # loss = torch.exp(loss)
-            logits = outputs["logits"]
-            greedy_tokens = logits.argmax(dim=-1)
-            cont_toks = input_ids[:, contxt_id.shape[1] :]  # [1, seq]
-            greedy_tokens = greedy_tokens[:, contxt_id.shape[1] : input_ids.shape[1]]  # [1, seq]
-            max_equal = (greedy_tokens == cont_toks).all()
-            res.append((float(loss.item()), bool(max_equal)))
-            pbar.update(1)
+
+            image, image_sizes = self._loglikelihood_images(visuals)
+
+            if len(indices) > 1:
+                inputs = [self._loglikelihood_input_ids(contexts, continuation, visuals, image) for continuation in continuations]
+                contxt_id = inputs[0][0]
+                prefix_len = contxt_id.shape[1]
+                # the cached prefix is only valid if every prompt+continuation tokenizes to the context tokens followed by the continuation
+                if all(torch.equal(input_ids[0, :prefix_len], contxt_id[0]) and input_ids.shape[1] > prefix_len for _, input_ids in inputs):
+                    scores = score_continuations_with_shared_prefix(
+                        self.model,
+                        contxt_id,
+                        [input_ids[0, prefix_len:] for _, input_ids in inputs],
+                        prefix_kwargs={"images": image, "image_sizes": image_sizes},
+                        batch_size=len(indices),
+                        pad_token_id=pad_token_id,
+                    )
+                    for idx, score in zip(indices, scores):
+                        res[idx] = score
+                    pbar.update(len(indices))
+                    continue
+
+            for idx, continuation in zip(indices, continuations):
+                res[idx] = self._loglikelihood_one(contexts, continuation, visuals, image, image_sizes)
+                pbar.update(1)
         pbar.close()
         return res
 
@@ -290,19 +329,49 @@ class Llava(lmms):
             toks = self.tok_encode(x[0])
             return -len(toks), x[0]
 
+        text_costs = {}
+
+        def _text_cost(x):
+            # prompt tokens plus tokens to generate, both lengthen the padded batch and its kv cache
+            key = (x[0], x[1].get("max_new_tokens", 1024))
+            if key not in text_costs:
+                text_costs[key] = len(self.tok_encode(x[0])) + key[1]
+            return text_costs[key]
+
         # we group requests by their generation_kwargs,
         # so that we don't try to execute e.g. greedy sampling and temp=0.8 sampling
         # in the same batch.
-        re_ords = utils.Collator([reg.args for reg in requests], _collate, grouping=True)
-        chunks = re_ords.get_batched(n=self.batch_size, batch_fn=None)
-        num_iters = len(requests) // self.batch_size if len(requests) % self.batch_size == 0 else len(requests) // self.batch_size + 1
-        pbar = tqdm(total=num_iters, disable=(self.rank != 0), desc="Model Responding")
-        for chunk in chunks:
+        if self.adaptive_batch:
+            # most expensive first, so that the first request of a batch is the one it is padded to
+            re_ords = utils.Collator([reg.args for reg in requests], lambda x: (-_text_cost(x), x[0]), grouping=True)
+            batcher = AdaptiveBatcher(max_batch_size=self.batch_size, token_budget=self.token_budget)
+            chunks = re_ords.get_batched_adaptive(batcher, _text_cost)
+            pbar = tqdm(total=len(requests), disable=(self.rank != 0), desc="Model Responding")
+        else:
+            re_ords = utils.Collator([reg.args for reg in requests], _collate, grouping=True)
+            chunks = re_ords.get_batched(n=self.batch_size, batch_fn=None)
+            num_iters = len(requests) // self.batch_size if len(requests) % self.batch_size == 0 else len(requests) // self.batch_size + 1
+            pbar = tqdm(total=num_iters, disable=(self.rank != 0), desc="Model Responding")
+
+        # the image aspect ratio has to be known before the images of the following batches are preprocessed in the background
+        for reg in requests:
+            gen_kwargs = reg.args[1]
+            if "image_aspect_ratio" in gen_kwargs.keys() and "image_aspect_ratio" not in self._config.__dict__:
+                # here we should pop it out of gen_kwargs so that it doesn't get passed to the model for next step of generation
+                self._config.image_aspect_ratio = gen_kwargs.pop("image_aspect_ratio")
+                eval_logger.info(f"Setting image aspect ratio: {self._config.image_aspect_ratio}")
+
+        def _load_visuals(chunk):
+            _, _, doc_to_visual, doc_id, task, split = zip(*chunk)
+            batched_visuals = [doc_to_visual[0](self.task_dict[task[0]][split[0]][ids]) for ids in doc_id]  # [B, N]
+            flattened_visuals = self.flatten(batched_visuals)  # [B*N]
+            image_tensor = process_images(flattened_visuals, self._image_processor, self._config) if flattened_visuals else None
+            return batched_visuals, flattened_visuals, image_tensor
+
+        def _generate(chunk, batched_visuals, flattened_visuals, image_tensor):
             contexts, all_gen_kwargs, doc_to_visual, doc_id, task, split = zip(*chunk)
             task = task[0]
             split = split[0]
-            batched_visuals = [doc_to_visual[0](self.task_dict[task][split][ids]) for ids in doc_id]  # [B, N]
-            flattened_visuals = self.flatten(batched_visuals)  # [B*N]
             # we assume all gen kwargs in the batch are the same
             # this is safe to assume because the `grouper` object ensures it.
             gen_kwargs = all_gen_kwargs[0]
@@ -318,19 +387,12 @@ class Llava(lmms):
                 elif not isinstance(until, list):
                     raise ValueError(f"Expected `gen_kwargs['until']` to be of type Union[str,list] but got {type(until)}")
 
-            if "image_aspect_ratio" in gen_kwargs.keys() and "image_aspect_ratio" not in self._config.__dict__:
-                # here we should pop it out of gen_kwargs so that it doesn't get passed to the model for next step of generation
-                self._config.image_aspect_ratio = gen_kwargs.pop("image_aspect_ratio")
-                eval_logger.info(f"Setting image aspect ratio: {self._config.image_aspect_ratio}")
             # encode, pad, and truncate contexts for this batch
-            if flattened_visuals:
-                image_tensor = process_images(flattened_visuals, self._image_processor, self._config)
+            if image_tensor is not None:
                 if type(image_tensor) is list:
                     image_tensor = [_image.to(dtype=torch.float16, device=self.device) for _image in image_tensor]
                 else:
                     image_tensor = image_tensor.to(dtype=torch.float16, device=self.device)
-            else:
-                image_tensor = None
 
             # prompts_input = contexts[0]
 
@@ -410,11 +472,83 @@ class Llava(lmms):
             #             # ignore '' separator,
             #             # for seq2seq case where self.tok_decode(self.eot_token_id) = ''
             #             text_outputs = text_outputs.split(term)[0]
+            return text_outputs
+
+        for chunk, loaded in self.prefetch_visuals(chunks, _load_visuals):
+            if self.adaptive_batch:
+                text_outputs = self._generate_adaptive(batcher, chunk, loaded, _text_cost, _load_visuals, _generate)
+            else:
+                text_outputs = _generate(chunk, *loaded)
+            context, gen_kwargs = chunk[-1][0], chunk[-1][1]
             res.extend(text_outputs)
             self.cache_hook.add_partial("generate_until", (context, gen_kwargs), text_outputs)
-            pbar.update(1)
+            pbar.update(len(chunk) if self.adaptive_batch else 1)
             # reorder this group of results back to original unsorted form
         res = re_ords.get_original(res)
 
         pbar.close()
+        if self.adaptive_batch:
+            eval_logger.info(f"Llava adaptive batching: {batcher.stats.as_dict()}")
         return res
+
+    def _visual_tokens(self, batched_visuals, image_tensor) -> List[int]:
+        """Number of image tokens of every request of a loaded batch, counting the anyres tiles of each image."""
+        if image_tensor is None:
+            return [0] * len(batched_visuals)
+        if type(image_tensor) is list:
+            tiles = [t.shape[0] if t.ndim == 4 else 1 for t in image_tensor]
+        else:
+            tiles = [image_tensor.shape[1] if image_tensor.ndim == 5 else 1] * image_tensor.shape[0]
+        vision_tower = self.model.get_vision_tower() if hasattr(self.model, "get_vision_tower") else None
+        tokens_per_tile = getattr(vision_tower, "num_patches", 576)
+        visual_tokens, start = [], 0
+        for visual in batched_visuals:
+            num_images = len(visual) if isinstance(visual, list) else 1
+            visual_tokens.append(sum(tiles[start : start + num_images]) * tokens_per_tile)
+            start += num_images
+        return visual_tokens
+
+    def _generate_adaptive(self, batcher, chunk, loaded, text_cost_fn, load_fn, generate_fn) -> List[str]:
+        """Generates `chunk` in parts whose actual cost, visual tokens included, fits the batcher's current budget.
+
+        `chunk` was sized up to `prefetch_depth` batches earlier, when its visuals started loading, so it is split again here.
+        """
+        visual_tokens = self._visual_tokens(loaded[0], loaded[2])
+        batcher.observe_visuals(len(chunk), sum(visual_tokens))
+        costs = [text_cost_fn(x) + v for x, v in zip(chunk, visual_tokens)]
+        parts = batcher.split(costs)
+        if len(parts) == 1:
+            return self._generate_with_oom_retry(batcher, chunk, loaded, costs, load_fn, generate_fn)
+        text_outputs = []
+        for part in parts:
+            text_outputs.extend(self._generate_with_oom_retry(batcher, chunk[part], load_fn(chunk[part]), costs[part], load_fn, generate_fn))
+        return text_outputs
+
+    def _generate_with_oom_retry(self, batcher, chunk, loaded, costs, load_fn, generate_fn) -> List[str]:
+        """Generates `chunk`, reporting its peak memory to the batcher, and halves it when it runs out of memory."""
+        batch_cost = batcher.batch_cost(costs)
+        on_cuda = self.device.type == "cuda"
+        if on_cuda:
+            base_memory = torch.cuda.memory_allocated(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+        out_of_memory = False
+        try:
+            text_outputs = generate_fn(chunk, *loaded)
+        except torch.cuda.OutOfMemoryError:
+            if len(chunk) == 1:
+                raise
+            # the traceback keeps the activations of the failed batch alive until the except block is left
+            out_of_memory = True
+        if not out_of_memory:
+            if on_cuda:
+                batcher.observe_memory(batch_cost, torch.cuda.max_memory_allocated(self.device), base_memory, torch.cuda.get_device_properties(self.device).total_memory)
+            return text_outputs
+
+        loaded = None
+        torch.cuda.empty_cache()
+        batcher.on_oom(batch_cost)
+        eval_logger.warning(f"Out of memory on a batch of {len(chunk)} requests, retrying in halves with a token budget of {batcher.token_budget}")
+        half = len(chunk) // 2
+        return self._generate_with_oom_retry(batcher, chunk[:half], load_fn(chunk[:half]), costs[:half], load_fn, generate_fn) + self._generate_with_oom_retry(
+            batcher, chunk[half:], load_fn(chunk[half:]), costs[half:], load_fn, generate_fn
+        )
@@ -52,11 +52,13 @@ class LlavaHf(lmms):
         device_map: str = "",
         chat_template: Optional[str] = None,
         use_cache: bool = True,
+        prefetch_depth: int = 2,  # number of batches whose images are decoded ahead of generation
         **kwargs,
     ) -> None:
         super().__init__()
         # Do not use kwargs for now
         assert kwargs == {}, f"Unexpected kwargs: {kwargs}"
+        self.prefetch_depth = int(prefetch_depth)
 
         accelerator = Accelerator()
         if accelerator.num_processes > 1 and device_map == "":
@@ -254,12 +256,15 @@ class LlavaHf(lmms):
         chunks = re_ords.get_batched(n=self.batch_size, batch_fn=None)
         num_iters = len(requests) // self.batch_size if len(requests) % self.batch_size == 0 else len(requests) // self.batch_size + 1
         pbar = tqdm(total=num_iters, disable=(self.rank != 0), desc="Model Responding")
-        for chunk in chunks:
+
+        def _load_visuals(chunk):
+            _, _, doc_to_visual, doc_id, task, split = zip(*chunk)
+            return self.flatten([doc_to_visual[0](self.task_dict[task[0]][split[0]][ids]) for ids in doc_id])
+
+        for chunk, visuals in self.prefetch_visuals(chunks, _load_visuals):
             contexts, all_gen_kwargs, doc_to_visual, doc_id, task, split = zip(*chunk)
             task = task[0]
             split = split[0]
-            visuals = [doc_to_visual[0](self.task_dict[task][split][ids]) for ids in doc_id]
-            visuals = self.flatten(visuals)
             # we assume all gen kwargs in the batch are the same
             # this is safe to assume because the `grouper` object ensures it.
             gen_kwargs = all_gen_kwargs[0]
@@ -3,8 +3,6 @@ from accelerate.state import AcceleratorState
 from typing import List, Optional, Union, Tuple
 import torch
 from tqdm import tqdm
-from decord import VideoReader, cpu
-import numpy as np
 import math
 from datetime import timedelta
 from transformers import AutoConfig
@@ -14,6 +12,7 @@ from lmms_eval.api.instance import Instance
 from lmms_eval.api.model import lmms
 from lmms_eval.api.registry import register_model
 from lmms_eval.models.model_utils.load_video import read_video_pyav
+from lmms_eval.models.model_utils.video_frames import load_video_frames
 
 from loguru import logger as eval_logger
 
@@ -243,14 +242,7 @@ class LlavaVid(lmms):
         return encoding
 
     def load_video(self, video_path, max_frames_num):
-        vr = VideoReader(video_path, ctx=cpu(0))
-        total_frame_num = len(vr)
-        # fps = round(vr.get_avg_fps())
-        # frame_idx = [i for i in range(0, len(vr), fps)]
-        uniform_sampled_frames = np.linspace(0, total_frame_num - 1, max_frames_num, dtype=int)
-        frame_idx = uniform_sampled_frames.tolist()
-        spare_frames = vr.get_batch(frame_idx).asnumpy()
-        return spare_frames  # (frames, height, width, channels)
+        return load_video_frames(video_path, max_frames_num)  # (frames, height, width, channels)
 
     def tok_decode(self, tokens):
         return self.tokenizer.decode(tokens)
@@ -9,8 +9,6 @@ torch.backends.cuda.matmul.allow_tf32 = True
 
 from tqdm import tqdm
 from datetime import timedelta
-from decord import VideoReader, cpu
-import numpy as np
 
 import copy
 import PIL
@@ -28,6 +26,7 @@ from lmms_eval.api.instance import Instance
 from lmms_eval.api.model import lmms
 from lmms_eval.api.registry import register_model
 from lmms_eval.models.model_utils.load_video import read_video_pyav
+from lmms_eval.models.model_utils.video_frames import load_video_frames
 
 try:
     from longva.model.builder import load_pretrained_model
@@ -306,15 +305,9 @@ class LongVA(lmms):
         return new_list
 
     def load_video(self, video_path, max_frames_num):
-        if type(video_path) == str:
-            vr = VideoReader(video_path, ctx=cpu(0))
-        else:
-            vr = VideoReader(video_path[0], ctx=cpu(0))
-        total_frame_num = len(vr)
-        uniform_sampled_frames = np.linspace(0, total_frame_num - 1, max_frames_num, dtype=int)
-        frame_idx = uniform_sampled_frames.tolist()
-        spare_frames = vr.get_batch(frame_idx).asnumpy()
-        return spare_frames  # (frames, height, width, channels)
+        if type(video_path) != str:
+            video_path = video_path[0]
+        return load_video_frames(video_path, max_frames_num)  # (frames, height, width, channels)
 
     def generate_until(self, requests: List[Instance]) -> List[str]:
         res = []
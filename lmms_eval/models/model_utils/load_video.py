@@ -1,55 +1,6 @@
-import av
-from av.codec.context import CodecContext
-import numpy as np
-
-
-# This one is faster
-def record_video_length_stream(container, indices):
-    frames = []
-    start_index = indices[0]
-    end_index = indices[-1]
-    for i, frame in enumerate(container.decode(video=0)):
-        if i > end_index:
-            break
-        if i >= start_index and i in indices:
-            frames.append(frame)
-    return frames
-
-
-# This one works for all types of video
-def record_video_length_packet(container):
-    frames = []
-    # https://github.com/PyAV-Org/PyAV/issues/1269
-    # https://www.cnblogs.com/beyond-tester/p/17641872.html
-    # context = CodecContext.create("libvpx-vp9", "r")
-    for packet in container.demux(video=0):
-        for frame in packet.decode():
-            frames.append(frame)
-    return frames
+from lmms_eval.models.model_utils.video_frames import load_video_frames
 
 
 def read_video_pyav(video_path, num_frm=8):
-    
-    if "webm" not in video_path and "mkv" not in video_path:
-        # For mp4, we try loading with stream first
-        try:
-            container = av.open(video_path)
-            total_frames = container.streams.video[0].frames
-            sampled_frm = min(total_frames, num_frm)
-            indices = np.linspace(0, total_frames - 1, sampled_frm, dtype=int)
-            frames = record_video_length_stream(container, indices)
-        except:
-            container = av.open(video_path)
-            frames = record_video_length_packet(container)
-            total_frames = len(frames)
-            sampled_frm = min(total_frames, num_frm)
-            indices = np.linspace(0, total_frames - 1, sampled_frm, dtype=int)
-            frames = [frames[i] for i in indices]
-    else:
-        container = av.open(video_path)
-        frames = record_video_length_packet(container)
-        total_frames = len(frames)
-        sampled_frm = min(total_frames, num_frm)
-        indices = np.linspace(0, total_frames - 1, sampled_frm, dtype=int)
-        frames = [frames[i] for i in indices]
-    return np.stack([x.to_ndarray(format="rgb24") for x in frames])
+    # decoding goes through the shared frame cache, which only decodes the sampled frames
+    return load_video_frames(video_path, num_frm, policy="uniform_capped", decoder="pyav")
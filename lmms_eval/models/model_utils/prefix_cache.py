@@ -0,0 +1,81 @@
+import copy
+from typing import List, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+
+def _expand_cache(past_key_values, batch_size: int):
+    """Returns a copy of a batch-1 `past_key_values` repeated `batch_size` times, the original is left untouched."""
+    if hasattr(past_key_values, "batch_repeat_interleave"):
+        # `Cache` objects are updated in place by the next forward, so every batch needs its own copy
+        past_key_values = copy.deepcopy(past_key_values)
+        past_key_values.batch_repeat_interleave(batch_size)
+        return past_key_values
+    # legacy tuple format, expanding is a view and the forward concatenates into new tensors
+    return tuple(tuple(t.expand(batch_size, *t.shape[1:]) for t in layer) for layer in past_key_values)
+
+
+@torch.inference_mode()
+def score_continuation(model, input_ids: torch.Tensor, prefix_len: int, model_kwargs: Optional[dict] = None) -> Tuple[float, bool]:
+    """Scores `input_ids[:, prefix_len:]` given the tokens before it with one full forward pass.
+
+    This is the path of the requests that cannot share a prefix, it returns the same
+    `(mean negative log-likelihood, is_greedy)` as `score_continuations_with_shared_prefix`.
+    Vision tokens make the logits longer than `input_ids`, but they are all in the prefix, so the
+    continuation is located from the end of the sequence.
+    """
+    labels = input_ids.clone()
+    labels[:, :prefix_len] = -100
+    outputs = model(input_ids=input_ids, labels=labels, **(model_kwargs or {}))
+    continuation = input_ids[:, prefix_len:]
+    # the logits at a position predict the token after it
+    greedy_tokens = outputs.logits[:, -continuation.shape[1] - 1 : -1].argmax(dim=-1)
+    return float(outputs.loss.item()), bool((greedy_tokens == continuation).all())
+
+
+@torch.inference_mode()
+def score_continuations_with_shared_prefix(
+    model,
+    prefix_ids: torch.Tensor,
+    continuation_ids: List[torch.Tensor],
+    prefix_kwargs: Optional[dict] = None,
+    batch_size: int = 8,
+    pad_token_id: int = 0,
+) -> List[Tuple[float, bool]]:
+    """Scores several continuations of the same prefix, encoding the prefix only once.
+
+    The prefix (prompt tokens plus, for multimodal models, the vision tokens produced from
+    `prefix_kwargs` such as `images`) is run through `model` once with `use_cache=True`. The
+    continuations are then scored in right-padded batches of `batch_size` from the cached
+    `past_key_values`.
+
+    :param prefix_ids: [1, P] token ids shared by all continuations.
+    :param continuation_ids: list of 1-D token id tensors, one per continuation.
+    :return: one `(mean negative log-likelihood, is_greedy)` pair per continuation, which is
+        what `score_continuation` returns for `prefix + continuation`.
+    """
+    prefix_kwargs = prefix_kwargs or {}
+    outputs = model(input_ids=prefix_ids, use_cache=True, **prefix_kwargs)
+    # the logits at the last prefix position predict the first continuation token
+    last_logits = outputs.logits[:, -1:, :]
+    past_key_values = outputs.past_key_values
+
+    res = []
+    for start in range(0, len(continuation_ids), batch_size):
+        batch = continuation_ids[start : start + batch_size]
+        lengths = torch.tensor([len(c) for c in batch], device=prefix_ids.device)
+        padded = torch.full((len(batch), int(lengths.max())), pad_token_id, dtype=prefix_ids.dtype, device=prefix_ids.device)
+        for i, cont in enumerate(batch):
+            padded[i, : len(cont)] = cont.to(prefix_ids.device)
+
+        # right padding only appends positions after the real tokens, so causal attention keeps their logits exact
+        batch_outputs = model(input_ids=padded, past_key_values=_expand_cache(past_key_values, len(batch)), use_cache=False)
+        logits = torch.cat([last_logits.expand(len(batch), -1, -1), batch_outputs.logits[:, :-1, :]], dim=1).float()
+
+        log_probs = F.log_softmax(logits, dim=-1).gather(-1, padded.unsqueeze(-1)).squeeze(-1)
+        mask = torch.arange(padded.shape[1], device=padded.device).unsqueeze(0) < lengths.unsqueeze(1)
+        nll = -(log_probs * mask).sum(dim=1) / lengths
+        is_greedy = ((logits.argmax(dim=-1) == padded) | ~mask).all(dim=1)
+        res.extend((float(n), bool(g)) for n, g in zip(nll.tolist(), is_greedy.tolist()))
+    return res
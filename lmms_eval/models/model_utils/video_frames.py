@@ -0,0 +1,198 @@
+"""Shared video frame extraction with an optional on-disk cache of the sampled frames.
+
+Video models used to decode the same file again for every model evaluated on a
+benchmark. `load_video_frames` samples the frames of a video with a named policy and
+decodes only those frames (decord and PyAV both seek to the keyframe before a target
+frame instead of decoding the whole stream). When the cache is enabled, the frames are
+stored as a uint8 `.npy` array of shape (frames, height, width, 3), keyed by the video
+path, its mtime and size, the number of frames, the sampling policy and the decoder,
+so a sweep over several models decodes each video once and later runs memory-map
+the cached frames. Entries are full-resolution RGB, a 64-frame 1080p video takes
+about 400MB, so the cache is off by default and capped in size.
+
+Environment variables:
+    LMMS_EVAL_VIDEO_CACHE: cache directory, the cache is disabled when it is unset or empty.
+    LMMS_EVAL_VIDEO_CACHE_MB: size cap of the cache in MB, defaults to 20480. The least
+        recently used entries are deleted when a new entry would exceed it.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from loguru import logger as eval_logger
+
+VIDEO_FRAME_CACHE_DIR = os.getenv("LMMS_EVAL_VIDEO_CACHE", "")
+VIDEO_FRAME_CACHE_MB = int(os.getenv("LMMS_EVAL_VIDEO_CACHE_MB", 20480))
+
+# bytes of `.npy` entries in each cache directory, counted once per process and updated on writes.
+# Other ranks writing to the same directory are only seen at the next eviction scan.
+_cache_bytes: Dict[str, int] = {}
+
+
+def uniform_indices(total_frames: int, fps: float, num_frames: int) -> List[int]:
+    # exactly `num_frames` indices, short videos repeat frames
+    return np.linspace(0, total_frames - 1, num_frames, dtype=int).tolist()
+
+
+def uniform_capped_indices(total_frames: int, fps: float, num_frames: int) -> List[int]:
+    # at most one index per frame of the video
+    return np.linspace(0, total_frames - 1, min(total_frames, num_frames), dtype=int).tolist()
+
+
+def duration_stride_indices(total_frames: int, fps: float, num_frames: int, duration: float) -> List[int]:
+    # at most one frame per second of `duration`, starting at the first frame
+    num_frames = min(num_frames, int(duration))
+    stride = int(int(duration * fps) / num_frames)
+    return [stride * i for i in range(num_frames)]
+
+
+SAMPLING_POLICIES: Dict[str, Callable[..., List[int]]] = {
+    "uniform": uniform_indices,
+    "uniform_capped": uniform_capped_indices,
+    "duration_stride": duration_stride_indices,
+}
+
+
+def _decode_decord(video_path: str, sample: Callable[[int, float], List[int]]) -> np.ndarray:
+    from decord import VideoReader, cpu
+
+    vr = VideoReader(video_path, ctx=cpu(0), num_threads=1)
+    # get_batch seeks to the keyframe before each index, it never decodes the whole stream
+    return vr.get_batch(sample(len(vr), vr.get_avg_fps())).asnumpy()
+
+
+def _decode_pyav(video_path: str, sample: Callable[[int, float], List[int]]) -> np.ndarray:
+    import av
+
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        fps = float(stream.average_rate or 0)
+        if stream.frames <= 0 or not fps or stream.time_base is None:
+            # the container does not know its length (e.g. webm/mkv), the only option is to decode everything
+            frames = [frame for packet in container.demux(video=0) for frame in packet.decode()]
+            return np.stack([frames[i].to_ndarray(format="rgb24") for i in sample(len(frames), fps)])
+
+        indices = sample(stream.frames, fps)
+        start = stream.start_time or 0
+        seconds_per_pts = float(stream.time_base)
+        decoded, position, frame_iter, last = {}, None, None, None
+        for target in sorted(set(indices)):
+            # within a second of the current position it is cheaper to keep decoding than to seek back to a keyframe
+            if frame_iter is None or position is None or target - position > fps:
+                container.seek(int(start + target / fps / seconds_per_pts), stream=stream, backward=True, any_frame=False)
+                frame_iter = container.decode(stream)
+            for frame in frame_iter:
+                last = frame
+                if frame.pts is None:
+                    continue
+                position = round((frame.pts - start) * seconds_per_pts * fps)
+                if position >= target:
+                    break
+            # past the end of the stream, use the last decoded frame
+            decoded[target] = last.to_ndarray(format="rgb24")
+        return np.stack([decoded[i] for i in indices])
+
+
+def _decode_decord_or_pyav(video_path: str, sample: Callable[[int, float], List[int]]) -> np.ndarray:
+    try:
+        return _decode_decord(video_path, sample)
+    except Exception as e:
+        eval_logger.debug(f"decord could not read {video_path}, decoding it with PyAV: {e}")
+        return _decode_pyav(video_path, sample)
+
+
+DECODERS: Dict[str, Callable[[str, Callable[[int, float], List[int]]], np.ndarray]] = {
+    "decord": _decode_decord_or_pyav,
+    "pyav": _decode_pyav,
+}
+
+
+def _cache_key(video_path: str, num_frames: int, policy: str, policy_kwargs: dict, decoder: str) -> str:
+    stat = os.stat(video_path)
+    key = [os.path.abspath(video_path), stat.st_mtime_ns, stat.st_size, num_frames, policy, policy_kwargs, decoder]
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _cache_entries(cache_dir: str) -> List[os.DirEntry]:
+    entries = []
+    for sub in os.scandir(cache_dir):
+        if sub.is_dir():
+            entries.extend(e for e in os.scandir(sub.path) if e.name.endswith(".npy"))
+    return entries
+
+
+def _make_room(cache_dir: str, nbytes: int, max_bytes: int) -> bool:
+    """Deletes the least recently used entries until `nbytes` more fit under `max_bytes`, returns False if they never can."""
+    if nbytes > max_bytes:
+        return False
+    if cache_dir not in _cache_bytes:
+        _cache_bytes[cache_dir] = sum(e.stat().st_size for e in _cache_entries(cache_dir))
+    if _cache_bytes[cache_dir] + nbytes <= max_bytes:
+        return True
+    # hits refresh the mtime of their entry, so the oldest mtime is the least recently used
+    entries = sorted(((e.stat().st_mtime_ns, e.stat().st_size, e.path) for e in _cache_entries(cache_dir)))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total + nbytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # another rank evicted it first
+        total -= size
+    _cache_bytes[cache_dir] = total
+    return True
+
+
+def load_video_frames(
+    video_path: str,
+    num_frames: int,
+    policy: str = "uniform",
+    decoder: str = "decord",
+    cache_dir: str = VIDEO_FRAME_CACHE_DIR,
+    max_cache_mb: int = VIDEO_FRAME_CACHE_MB,
+    **policy_kwargs,
+) -> np.ndarray:
+    """Returns the frames of `video_path` selected by `policy` as a writable uint8 array (frames, height, width, channels).
+
+    :param policy: key of `SAMPLING_POLICIES`, extra arguments of the policy (e.g. `duration`) are passed as keyword arguments.
+    :param decoder: key of `DECODERS`, "decord" falls back to PyAV for the videos decord cannot read.
+    :param cache_dir: directory of the frame cache, an empty string disables it. Cached frames are memory-mapped
+        copy-on-write, so they can be modified like decoded frames without changing the cache.
+    :param max_cache_mb: size cap of the cache directory.
+    """
+    sampling = SAMPLING_POLICIES[policy]
+    decode = DECODERS[decoder]
+
+    def sample(total_frames, fps):
+        return sampling(total_frames, fps, num_frames, **policy_kwargs)
+
+    path = None
+    if cache_dir:
+        key = _cache_key(video_path, num_frames, policy, policy_kwargs, decoder)
+        path = os.path.join(cache_dir, key[:2], f"{key}.npy")
+        if os.path.exists(path):
+            try:
+                frames = np.asarray(np.load(path, mmap_mode="c"))
+                os.utime(path)
+                return frames
+            except (OSError, ValueError) as e:
+                eval_logger.warning(f"Ignoring unreadable video frame cache entry {path}: {e}")
+
+    frames = np.ascontiguousarray(decode(video_path, sample), dtype=np.uint8)
+
+    if path is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not _make_room(cache_dir, frames.nbytes, max_cache_mb * 1024 * 1024):
+            return frames
+        # write then rename, so that concurrent ranks never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, frames)
+        os.replace(tmp_path, path)
+        _cache_bytes[cache_dir] += os.path.getsize(path)
+    return frames
@@ -35,11 +35,13 @@ class Qwen2_VL_chat(lmms):
         batch_size: Optional[Union[int, str]] = 1,
         trust_remote_code: Optional[bool] = True,
         use_cache=True,
+        prefetch_depth: int = 2,  # number of batches whose images are decoded and saved ahead of generation
         **kwargs,
     ) -> None:
         super().__init__()
         # Do not use kwargs for now
         assert kwargs == {}, f"Unexpected kwargs: {kwargs}"
+        self.prefetch_depth = int(prefetch_depth)
 
         accelerator = Accelerator()
         if accelerator.num_processes > 1:
@@ -152,12 +154,10 @@ class Qwen2_VL_chat(lmms):
         # in the same batch.
         re_ords = utils.Collator([reg.args for reg in requests], _collate, grouping=True)
         chunks = re_ords.get_batched(n=self.batch_size, batch_fn=None)
-        for chunk in chunks:
-            contexts, all_gen_kwargs, doc_to_visual, doc_id, task, split = zip(*chunk)
-            task = task[0]
-            split = split[0]
-            visuals = [doc_to_visual[0](self.task_dict[task][split][ids]) for ids in doc_id]
-            visuals = self.flatten(visuals)
+
+        def _load_visuals(chunk):
+            _, _, doc_to_visual, doc_id, task, split = zip(*chunk)
+            visuals = self.flatten([doc_to_visual[0](self.task_dict[task[0]][split[0]][ids]) for ids in doc_id])
             visual_paths = []
             # save images to /tmp, name generated by hash function
             # qwen accept image path. Have to do it here....
@@ -165,6 +165,12 @@ class Qwen2_VL_chat(lmms):
                 name = uuid.uuid4().hex.upper()[0:6]
                 visual.save(f"/tmp/{name}.png")
                 visual_paths.append(f"/tmp/{name}.png")
+            return visual_paths
+
+        for chunk, visual_paths in self.prefetch_visuals(chunks, _load_visuals):
+            contexts, all_gen_kwargs, doc_to_visual, doc_id, task, split = zip(*chunk)
+            task = task[0]
+            split = split[0]
 
             # we assume all gen kwargs in the batch are the same
             # this is safe to assume because the `grouper` object ensures it.
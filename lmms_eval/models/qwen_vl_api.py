@@ -5,12 +5,12 @@ import base64
 from typing import List, Tuple, Union
 from tqdm import tqdm
 import requests as url_requests
-import time
 
 
 from lmms_eval.api.instance import Instance
 from lmms_eval.api.model import lmms
 from lmms_eval.api.registry import register_model
+from lmms_eval.api.request_engine import RequestEngine
 from lmms_eval import utils
 
 from PIL import Image
@@ -41,6 +41,9 @@ class Qwen_VL_API(lmms):
         image_token: str = "<image>",  # Use to separate interleaved image and text
         system_prompt: str = "",  # Whether you want some special system prompt here
         tmp_folder: str = "./tmp",  # Due to qwen's api restriction,
+        max_in_flight: int = 8,
+        requests_per_second: float = None,
+        max_retries: int = 10,
         **kwargs,
     ) -> None:
         super().__init__()
@@ -49,6 +52,7 @@ class Qwen_VL_API(lmms):
         self.image_token = image_token
         self.system_prompt = system_prompt
         self.tmp_folder = tmp_folder
+        self.request_engine = RequestEngine(max_in_flight=max_in_flight, requests_per_second=requests_per_second, max_retries=max_retries, max_delay=NUM_SECONDS_TO_SLEEP)
         clear_proxies()
 
     @property
@@ -59,76 +63,58 @@ class Qwen_VL_API(lmms):
     def world_size(self):
         return self._world_size
 
+    def build_messages(self, request: Instance) -> dict:
+        contexts, gen_kwargs, doc_to_visual, doc_id, task, split = request.args
+        visuals = [doc_to_visual(self.task_dict[task][split][doc_id])]
+        visuals = self.flatten(visuals)
+        imgs = []
+
+        for idx, visual in enumerate(visuals):
+            # requests are sent concurrently, so the file name has to be unique per document
+            img_path = os.path.join(self.tmp_folder, f"tmp_{task}_{split}_{doc_id}_{idx}_{self.rank}_{self.world_size}.jpg")
+            visual.save(img_path)
+            imgs.append(img_path)
+
+        messages = [{"role": "user", "content": []}]
+
+        if self.image_token not in contexts:
+            for img in imgs:
+                messages[0]["content"].append({"image": img})
+            messages[0]["content"].append({"text": contexts})
+        else:
+            contexts = contexts.split(self.image_token)
+
+            for idx, img in enumerate(imgs):
+                messages[0]["content"].append({"text": contexts[idx]})
+                messages[0]["content"].append({"image": img})
+            messages[0]["content"].append({"text": contexts[-1]})
+
+        if "max_new_tokens" not in gen_kwargs or gen_kwargs["max_new_tokens"] > 1500:
+            gen_kwargs["max_new_tokens"] = 1024
+        if "temperature" not in gen_kwargs:
+            gen_kwargs["temperature"] = 0
+        if "top_p" not in gen_kwargs:
+            gen_kwargs["top_p"] = None
+        if "num_beams" not in gen_kwargs:
+            gen_kwargs["num_beams"] = 1
+
+        return {"messages": messages, "max_new_tokens": gen_kwargs["max_new_tokens"]}
+
+    def send_messages(self, prepared: dict) -> str:
+        response_data = dashscope.MultiModalConversation.call(model=self.model_version, messages=prepared["messages"], api_key=API_KEY, max_length=prepared["max_new_tokens"])
+        try:
+            return response_data["output"]["choices"][0]["message"]["content"][0]["text"].strip()
+        except Exception as e:
+            # dashscope reports throttling and server errors in the response instead of raising
+            raise RuntimeError(f"Error {e} happens when parsing response: {response_data}")
+
     def generate_until(self, requests) -> List[str]:
         clear_proxies()
-        if "http_proxy" in os.environ:
-            del os.environ['http_proxy']
-        if "https_proxy" in os.environ:
-            del os.environ['https_proxy']
-        print("HTTP and HTTPS proxy settings have been unset.")
-        res = []
+        eval_logger.info("HTTP and HTTPS proxy settings have been unset.")
         pbar = tqdm(total=len(requests), disable=(self.rank != 0), desc="Model Responding")
         os.makedirs(self.tmp_folder, exist_ok=True)
 
-        for contexts, gen_kwargs, doc_to_visual, doc_id, task, split in [reg.args for reg in requests]:
-            # encode, pad, and truncate contexts for this batch
-            visuals = [doc_to_visual(self.task_dict[task][split][doc_id])]
-            visuals = self.flatten(visuals)
-            imgs = []
-
-            for idx, visual in enumerate(visuals):
-                visual.save(os.path.join(self.tmp_folder, f"tmp_{idx}_{self.rank}_{self.world_size}.jpg"))
-                imgs.append(os.path.join(self.tmp_folder, f"tmp_{idx}_{self.rank}_{self.world_size}.jpg"))
-
-            messages = [{"role": "user", "content": []}]
-
-            if self.image_token not in contexts:
-                for img in imgs:
-                    messages[0]["content"].append({"image": img})
-                messages[0]["content"].append({"text": contexts})
-            else:
-                contexts = contexts.split(self.image_token)
-
-                for idx, img in enumerate(imgs):
-                    messages[0]["content"].append({"text": contexts[idx]})
-                    messages[0]["content"].append({"image": img})
-                messages[0]["content"].append({"text": contexts[-1]})
-
-            if "max_new_tokens" not in gen_kwargs or gen_kwargs["max_new_tokens"] > 1500:
-                gen_kwargs["max_new_tokens"] = 1024
-            if "temperature" not in gen_kwargs:
-                gen_kwargs["temperature"] = 0
-            if "top_p" not in gen_kwargs:
-                gen_kwargs["top_p"] = None
-            if "num_beams" not in gen_kwargs:
-                gen_kwargs["num_beams"] = 1
-
-            for attempt in range(10):
-                try:
-                    # print(gen_kwargs["max_new_tokens"])
-                    # print(API_KEY)
-                    # print(messages)
-                    print(self.model_version)
-                    response_data = dashscope.MultiModalConversation.call(model=self.model_version, messages=messages, api_key=API_KEY, max_length=gen_kwargs["max_new_tokens"])
-                    print(response_data)
-                    break
-                except Exception as e:
-                    eval_logger.info(f"Attempt {attempt + 1} failed with error: {str(e)}")
-                    if attempt < 10 - 1:  # If we have retries left, sleep and then continue to next attempt
-                        time.sleep(NUM_SECONDS_TO_SLEEP)
-                    else:  # If this was the last attempt, log and return empty
-                        eval_logger.error(f"All 5 attempts failed. Last error message: {str(e)}")
-                        res.append("")
-                        pbar.update(1)
-                        continue
-            try:
-                res.append(response_data["output"]["choices"][0]["message"]["content"][0]["text"].strip())
-            except Exception as e:
-                eval_logger.error(f"Error {e} happens when parsing input.")
-                eval_logger.error(f"{response_data}")
-                res.append("")
-            pbar.update(1)
-
+        res = self.request_engine.run(self.send_messages, requests, prepare=self.build_messages, pbar=pbar)
         pbar.close()
 
         return res
@@ -0,0 +1,174 @@
+"""Sweep mode: evaluate several models on the same tasks in one process.
+
+`lmms-eval --sweep models.yaml --tasks ...` reads a YAML list of models,
+
+    - model: llava
+      model_args: pretrained=liuhaotian/llava-v1.5-7b
+      log_samples_suffix: llava1.5_7b
+    - model: internvl2
+      model_args: pretrained=OpenGVLab/InternVL2-8B
+      gen_kwargs: max_new_tokens=64
+
+and runs them one after another (or, with `--sweep_devices`, in one process per device,
+each running the models of its device one after another). Everything that does not depend
+on the model is done once per process and kept resident in a `SweepSession`: task
+registration, dataset downloads, the task objects with their built instances, and the
+dataset rows the models read, including their decoded images, up to
+`LMMS_EVAL_SWEEP_CACHE_MB` (4096 by default). A task is only rebuilt for a model whose
+`model_specific_*_kwargs` or `gen_kwargs` select a different prompt or generation config
+than an already built one.
+"""
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import yaml
+
+from lmms_eval.tasks import get_task_dict
+
+from loguru import logger as eval_logger
+
+
+SWEEP_CACHE_MB = float(os.getenv("LMMS_EVAL_SWEEP_CACHE_MB", 4096))
+
+
+def row_nbytes(value) -> int:
+    """Approximate memory of a dataset row: decoded images and arrays count their pixels, containers their items."""
+    if isinstance(value, dict):
+        return sum(row_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(row_nbytes(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, "size") and hasattr(value, "getbands"):
+        # PIL image
+        width, height = value.size
+        return width * height * len(value.getbands())
+    return sys.getsizeof(value)
+
+
+class RowBudget:
+    """Bytes of dataset rows a `SweepSession` may keep resident, shared by all its splits."""
+
+    def __init__(self, max_bytes: float) -> None:
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.full = False
+
+    def take(self, nbytes: int) -> bool:
+        if self.used + nbytes > self.max_bytes:
+            if not self.full:
+                self.full = True
+                eval_logger.info(f"Sweep: {self.used / 2**20:.0f} MB of dataset rows are resident, further rows are read from the datasets (LMMS_EVAL_SWEEP_CACHE_MB)")
+            return False
+        self.used += nbytes
+        return True
+
+
+class ResidentSplit:
+    """Dataset split that keeps the rows it returned while the budget allows, so their images are decoded once for all models.
+
+    Rows are not evicted: every model reads the splits in the same order, so an LRU would drop each
+    row before the next model reads it, while keeping the first rows makes them hits for every model.
+    """
+
+    def __init__(self, split, budget: RowBudget) -> None:
+        self.split = split
+        self.budget = budget
+        self._rows = {}
+
+    def __getitem__(self, key):
+        if not isinstance(key, int):
+            return self.split[key]
+        if key in self._rows:
+            return self._rows[key]
+        row = self.split[key]
+        if not self.budget.full and self.budget.take(row_nbytes(row)):
+            self._rows[key] = row
+        return row
+
+    def __len__(self) -> int:
+        return len(self.split)
+
+    def __getattr__(self, name):
+        if name == "split":
+            raise AttributeError(name)
+        return getattr(self.split, name)
+
+
+class ResidentDataset:
+    """`DatasetDict` view handed to the models in sweep mode, see `ResidentSplit`."""
+
+    def __init__(self, dataset, budget: RowBudget) -> None:
+        self.dataset = dataset
+        self.budget = budget
+        self._splits = {}
+
+    def __getitem__(self, split):
+        if split not in self._splits:
+            self._splits[split] = ResidentSplit(self.dataset[split], self.budget)
+        return self._splits[split]
+
+    def __getattr__(self, name):
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+
+class SweepSession:
+    """Tasks, instances and dataset rows shared by the models of a sweep."""
+
+    def __init__(self, max_resident_mb: float = SWEEP_CACHE_MB) -> None:
+        self.tasks_initialized = False
+        self._base = None
+        self._claimed = set()
+        # (task name, model-specific signature, gen_kwargs) -> task
+        self._tasks = {}
+        # id(task.dataset) -> ResidentDataset
+        self._datasets = {}
+        self.budget = RowBudget(max_resident_mb * 2**20)
+
+    def task_dict(self, task_names: List[str], model_name: str, gen_kwargs: Optional[str] = None) -> Dict[str, Any]:
+        """Returns the task dict for `model_name`, reusing the tasks of earlier models wherever the prompts agree."""
+        if self._base is None:
+            self._base = get_task_dict(task_names, model_name=model_name)
+        task_dict = {}
+        for task_name, entry in self._base.items():
+            group, task = entry if isinstance(entry, tuple) else (None, entry)
+            if task is not None:
+                key = (task_name, task.model_specific_signature(model_name), gen_kwargs)
+                if key not in self._tasks:
+                    if task_name not in self._claimed and task.model_specific_signature(task.model_name) == key[1]:
+                        # the task loaded for the first model is used as is by the first model with the same prompts
+                        self._claimed.add(task_name)
+                        self._tasks[key] = task
+                    else:
+                        eval_logger.info(f"Sweep: building {task_name} for {model_name}")
+                        self._tasks[key] = task.for_model(model_name)
+                task = self._tasks[key]
+            task_dict[task_name] = (group, task) if isinstance(entry, tuple) else task
+        return task_dict
+
+    def model_datasets(self, task_dict: Dict[str, Any]) -> Dict[str, ResidentDataset]:
+        datasets = {}
+        for task_name, entry in task_dict.items():
+            task = entry[1] if isinstance(entry, tuple) else entry
+            if task is None:
+                continue
+            if id(task.dataset) not in self._datasets:
+                self._datasets[id(task.dataset)] = ResidentDataset(task.dataset, self.budget)
+            datasets[task_name] = self._datasets[id(task.dataset)]
+        return datasets
+
+
+def load_sweep_config(path: str) -> List[Dict[str, Any]]:
+    """Reads the list of models of a sweep, every entry needs at least `model`."""
+    with open(path, "r") as f:
+        models = yaml.safe_load(f)
+    if isinstance(models, dict):
+        models = models.get("models", [models])
+    for entry in models:
+        if "model" not in entry:
+            raise ValueError(f"Every sweep entry needs a `model`, got {entry}")
+    return models
@@ -7,24 +7,31 @@ from lmms_eval import utils
 from lmms_eval.api.task import TaskConfig, Task, ConfigurableTask
 from lmms_eval.api.registry import (
     register_task,
+    register_lazy_task,
     register_group,
     TASK_REGISTRY,
+    LAZY_TASK_REGISTRY,
     GROUP_REGISTRY,
     ALL_TASKS,
 )
+from lmms_eval.api.task_manifest import TaskManifest
 
 from loguru import logger
 
 eval_logger = logger
 
 
-def register_configurable_task(config: Dict[str, str]) -> int:
-    SubClass = type(
+def configurable_task_class(config: Dict[str, str]) -> type:
+    return type(
         config["task"] + "ConfigurableTask",
         (ConfigurableTask,),
         {"CONFIG": TaskConfig(**config)},
     )
 
+
+def register_configurable_task(config: Dict[str, str]) -> int:
+    SubClass = configurable_task_class(config)
+
     if "task" in config:
         task_name = "{}".format(config["task"])
         register_task(task_name)(SubClass)
@@ -48,7 +55,7 @@ def register_configurable_group(config: Dict[str, str]) -> int:
     task_list = config["task"]
     task_names = utils.pattern_match(task_list, ALL_TASKS)
     for task in task_names:
-        if (task in TASK_REGISTRY) or (task in GROUP_REGISTRY):
+        if (task in TASK_REGISTRY) or (task in LAZY_TASK_REGISTRY) or (task in GROUP_REGISTRY):
             if group in GROUP_REGISTRY:
                 GROUP_REGISTRY[group].append(task)
             else:
@@ -101,10 +108,31 @@ def include_task_folder(task_dir: str, register_task: bool = True) -> None:
     return 0
 
 
+def register_manifest_task(task_name: str, yaml_path: str, groups: List[str]) -> None:
+    register_lazy_task(task_name, yaml_path)
+    for group in groups:
+        if group == task_name:
+            raise ValueError("task and group name cannot be the same")
+        if group in GROUP_REGISTRY:
+            GROUP_REGISTRY[group].append(task_name)
+        else:
+            GROUP_REGISTRY[group] = [task_name]
+            ALL_TASKS.add(group)
+
+
 def include_path(task_dir):
-    include_task_folder(task_dir)
+    # tasks are registered from the cached manifest of the folder, their yaml is only loaded once selected
+    entries = TaskManifest(task_dir).entries()
+    for yaml_path, entry in entries:
+        if "task" in entry:
+            try:
+                register_manifest_task(entry["task"], yaml_path, entry["groups"])
+            except Exception as error:
+                eval_logger.debug(f"Failed to register {yaml_path}. Config will not be added to registry\n" f"Error: {error}")
     # Register Benchmarks after all tasks have been added
-    include_task_folder(task_dir, register_task=False)
+    for yaml_path, entry in entries:
+        if "group" in entry:
+            register_configurable_group({"group": entry["group"], "task": entry["tasks"]})
     return 0
 
 
@@ -117,12 +145,14 @@ def initialize_tasks(verbosity="INFO"):
 
 
 def get_task(task_name, model_name):
-    try:
-        return TASK_REGISTRY[task_name](model_name=model_name)  # TODO choiszt the return result need to check " 'mmeConfigurableTask' object has no attribute '_instances'. Did you mean: 'instances'?"
-    except KeyError:
+    if task_name not in TASK_REGISTRY and task_name in LAZY_TASK_REGISTRY:
+        # the yaml of the task, and the modules of its functions, are loaded the first time it is built
+        register_task(task_name)(configurable_task_class(utils.load_yaml_config(LAZY_TASK_REGISTRY[task_name])))
+    if task_name not in TASK_REGISTRY:
         eval_logger.info("Available tasks:")
-        eval_logger.info(list(TASK_REGISTRY) + list(GROUP_REGISTRY))
+        eval_logger.info(sorted(ALL_TASKS))
         raise KeyError(f"Missing task {task_name}")
+    return TASK_REGISTRY[task_name](model_name=model_name)  # TODO choiszt the return result need to check " 'mmeConfigurableTask' object has no attribute '_instances'. Did you mean: 'instances'?"
 
 
 def get_task_name_from_object(task_object):
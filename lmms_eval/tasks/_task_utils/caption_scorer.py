@@ -0,0 +1,101 @@
+"""Caption metrics shared by the captioning tasks (coco_cap, nocaps, textcaps, flickr30k, refcoco, vatex).
+
+These tasks list one aggregation per metric (`coco_bleu4`, ..., `coco_cider`), and each
+of them used to rebuild the COCO index, run the Java PTB tokenizer over all references
+and predictions, and construct a fresh `Bleu(4)` to read a single n-gram order.
+`caption_score` groups and tokenizes the captions of a task once, in a single tokenizer
+call, and memoizes the tokenized captions together with the result of every scorer, keyed
+by a hash of the captions. The aggregations of a task all receive the same results, so
+the first one pays for the tokenization, BLEU-1..4 come from one `Bleu(4)` run, and every
+other scorer runs at most once.
+"""
+import collections
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+from pycocoevalcap.eval import Bleu, Cider, Meteor, Rouge, Spice
+from pycocoevalcap.tokenizer.ptbtokenizer import PTBTokenizer
+
+from loguru import logger as eval_logger
+
+# metric -> (scorer name, index of the metric in the scorer output, or None for a single score)
+CAPTION_METRICS = {
+    "Bleu_1": ("Bleu", 0),
+    "Bleu_2": ("Bleu", 1),
+    "Bleu_3": ("Bleu", 2),
+    "Bleu_4": ("Bleu", 3),
+    "METEOR": ("METEOR", None),
+    "ROUGE_L": ("ROUGE_L", None),
+    "CIDEr": ("CIDEr", None),
+    "SPICE": ("SPICE", None),
+}
+
+# number of distinct result sets kept, a few tasks can be aggregated one after another
+CACHE_SIZE = 4
+
+
+def _make_scorer(name: str):
+    # METEOR and SPICE start a Java process, so only the scorers that are asked for are built
+    return {"Bleu": lambda: Bleu(4), "METEOR": Meteor, "ROUGE_L": Rouge, "CIDEr": Cider, "SPICE": Spice}[name]()
+
+
+class CaptionScorer:
+    """Tokenized references and predictions of one set of results, with the scores computed so far."""
+
+    def __init__(self, gts: Dict[Any, List[str]], res: Dict[Any, List[str]]) -> None:
+        eval_logger.info("tokenization...")
+        # one tokenizer subprocess for both sides, it tokenizes every line independently
+        captions = {("gts", k): [{"caption": c} for c in v] for k, v in gts.items()}
+        captions.update({("res", k): [{"caption": c} for c in v] for k, v in res.items()})
+        tokenized = PTBTokenizer().tokenize(captions)
+        self.gts = {k: tokenized[("gts", k)] for k in gts}
+        self.res = {k: tokenized[("res", k)] for k in res}
+        self._scores = {}
+        self._lock = threading.Lock()
+
+    def score(self, metric: str) -> float:
+        scorer_name, position = CAPTION_METRICS[metric]
+        with self._lock:
+            if scorer_name not in self._scores:
+                eval_logger.info(f"Computing {scorer_name} scores...")
+                self._scores[scorer_name] = _make_scorer(scorer_name).compute_score(self.gts, self.res)[0]
+            score = self._scores[scorer_name]
+        return score[position] if position is not None else score
+
+
+_scorers = collections.OrderedDict()
+_scorers_lock = threading.Lock()
+
+
+def group_captions(results: List[Dict[str, Any]], id_key: Optional[str] = "image_id"):
+    """Groups the references (`answer`) and predictions (`pred`) of `results` by `result[id_key]`, like the COCO index does.
+
+    With `id_key=None` every result is its own group.
+    """
+    gts, res = {}, {}
+    for idx, result in enumerate(results):
+        key = idx if id_key is None else result[id_key]
+        gts.setdefault(key, []).extend(result["answer"])
+        res.setdefault(key, []).append(result["pred"])
+    return gts, res
+
+
+def get_caption_scorer(gts: Dict[Any, List[str]], res: Dict[Any, List[str]]) -> CaptionScorer:
+    key = hashlib.sha256(json.dumps([list(gts.items()), list(res.items())], ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+    with _scorers_lock:
+        if key in _scorers:
+            _scorers.move_to_end(key)
+            return _scorers[key]
+    scorer = CaptionScorer(gts, res)
+    with _scorers_lock:
+        _scorers[key] = scorer
+        while len(_scorers) > CACHE_SIZE:
+            _scorers.popitem(last=False)
+    return scorer
+
+
+def caption_score(results: List[Dict[str, Any]], metric: str, id_key: Optional[str] = "image_id") -> float:
+    """Returns `metric` (a key of `CAPTION_METRICS`) of `results`, each `{"answer": [references], "pred": prediction, id_key: ...}`."""
+    return get_caption_scorer(*group_captions(results, id_key)).score(metric)
@@ -0,0 +1,160 @@
+"""Concurrent, disk-cached GPT judge shared by the GPT-evaluated tasks (mmvet, llava_in_the_wild, mathvista).
+
+Judge-scored tasks used to call the judge synchronously from `process_results`, one
+document at a time. A task can now declare a `prefetch_results` function in its yaml;
+the evaluator calls it once with all docs and responses before postprocessing, and
+it sends every judge prompt through `GPTJudge.query_all`. The responses are stored
+in an on-disk cache keyed by the hash of the request payload, so the `GPTJudge.query`
+calls made later from `process_results` are cache hits and judge wall time scales
+with `LMMS_EVAL_JUDGE_CONCURRENCY` rather than with the number of samples.
+
+Environment variables:
+    LMMS_EVAL_JUDGE_CACHE: cache directory, defaults to ~/.cache/lmms_eval/gpt_judge.
+    LMMS_EVAL_JUDGE_CONCURRENCY: maximum judge requests in flight, defaults to 16.
+    LMMS_EVAL_JUDGE_RPS: optional requests-per-second limit.
+"""
+import functools
+import hashlib
+import json
+import os
+import tempfile
+from typing import List, Optional
+
+import requests
+
+from loguru import logger as eval_logger
+
+from lmms_eval.api.request_engine import PermanentRequestError, RequestEngine
+
+JUDGE_CACHE_DIR = os.getenv("LMMS_EVAL_JUDGE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "lmms_eval", "gpt_judge"))
+JUDGE_CONCURRENCY = int(os.getenv("LMMS_EVAL_JUDGE_CONCURRENCY", 16))
+JUDGE_RPS = float(os.getenv("LMMS_EVAL_JUDGE_RPS", 0)) or None
+
+# client errors that a retry can fix: request timeout, conflict and rate limit
+RETRYABLE_CLIENT_ERRORS = (408, 409, 429)
+# error message of a prompt longer than the context of the judge model
+PROMPT_TOO_LONG = "Please reduce the length of the messages"
+MAX_PROMPT_TRIMS = 5
+
+
+def trim_prompt(payload: dict) -> dict:
+    """Copy of `payload` whose last message keeps only the last 90% of its text."""
+    messages = list(payload["messages"])
+    content = messages[-1]["content"]
+    if not isinstance(content, str):
+        raise PermanentRequestError("Judge prompt is too long and is not plain text, it cannot be trimmed")
+    messages[-1] = dict(messages[-1], content=content[len(content) - int(len(content) * 0.9) :])
+    return dict(payload, messages=messages)
+
+
+class GPTJudge:
+    """Sends chat-completion payloads to `api_url`, caching each response JSON on disk by payload hash.
+
+    Only responses whose first choice has non-empty content are cached; failed requests
+    return `None` and are retried on the next run.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        headers: dict,
+        cache_dir: str = JUDGE_CACHE_DIR,
+        max_in_flight: int = JUDGE_CONCURRENCY,
+        requests_per_second: Optional[float] = JUDGE_RPS,
+        max_retries: int = 5,
+        timeout: int = 60,
+    ) -> None:
+        self.api_url = api_url
+        self.headers = headers
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.engine = RequestEngine(max_in_flight=max_in_flight, requests_per_second=requests_per_second, max_retries=max_retries, fallback=None)
+
+    @staticmethod
+    def payload_key(payload: dict) -> str:
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _cache_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _load(self, payload: dict) -> Optional[dict]:
+        path = self._cache_path(self.payload_key(payload))
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            eval_logger.warning(f"Ignoring unreadable judge cache entry {path}: {e}")
+            return None
+
+    def _store(self, payload: dict, response_data: Optional[dict]) -> None:
+        if response_data is None:
+            return
+        path = self._cache_path(self.payload_key(payload))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so that concurrent ranks never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(response_data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _post(self, payload: dict, trim_long_prompts: bool = False) -> dict:
+        for _ in range(MAX_PROMPT_TRIMS + 1):
+            response = requests.post(self.api_url, headers=self.headers, json=payload, timeout=self.timeout)
+            if trim_long_prompts and response.status_code == 400 and PROMPT_TOO_LONG in response.text:
+                eval_logger.error("!!Reduce prompt size")
+                # keep the tail of the prompt, where the response to judge is
+                payload = trim_prompt(payload)
+                continue
+            if 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_CLIENT_ERRORS:
+                # the same request would be rejected again
+                raise PermanentRequestError(f"{response.status_code} {response.reason}: {response.text[:500]}")
+            response.raise_for_status()
+            response_data = response.json()
+            if not response_data["choices"][0]["message"]["content"].strip():
+                raise ValueError("Judge returned an empty response")
+            return response_data
+        raise PermanentRequestError(f"Judge prompt is still too long after {MAX_PROMPT_TRIMS} trims")
+
+    def query_all(self, payloads: List[dict], pbar=None, trim_long_prompts: bool = False) -> List[Optional[dict]]:
+        """Returns the response JSON of every payload, in order. Uncached payloads are sent concurrently.
+
+        With `trim_long_prompts`, a prompt rejected for exceeding the context of the judge model is
+        sent again with the start of its last message cut, up to `MAX_PROMPT_TRIMS` times. The
+        response is cached under the original payload.
+        """
+        responses = [self._load(payload) for payload in payloads]
+        # identical prompts are only sent once
+        pending = {}
+        for idx, response_data in enumerate(responses):
+            if response_data is None:
+                pending.setdefault(self.payload_key(payloads[idx]), []).append(idx)
+            elif pbar is not None:
+                pbar.update(1)
+        pending = list(pending.values())
+
+        def on_result(pending_idx, response_data):
+            indices = pending[pending_idx]
+            self._store(payloads[indices[0]], response_data)
+            for idx in indices:
+                responses[idx] = response_data
+            if pbar is not None:
+                pbar.update(len(indices))
+
+        self.engine.run(functools.partial(self._post, trim_long_prompts=trim_long_prompts), [payloads[indices[0]] for indices in pending], on_result=on_result)
+        return responses
+
+    def query(self, payload: dict, trim_long_prompts: bool = False) -> Optional[dict]:
+        return self.query_all([payload], trim_long_prompts=trim_long_prompts)[0]
+
+
+_judges = {}
+
+
+def get_judge(api_url: str, headers: dict) -> GPTJudge:
+    """Returns the judge shared by every task that talks to `api_url` with `headers`."""
+    key = (api_url, json.dumps(headers, sort_keys=True))
+    if key not in _judges:
+        _judges[key] = GPTJudge(api_url, headers)
+    return _judges[key]
@@ -0,0 +1,240 @@
+"""Sandboxed, memoized answer-equivalence checks for the math tasks (olympiadbench, mathverse).
+
+Symbolic checks (`parse_latex`, `simplify`) used to run inline in `process_results` without a
+time limit, so one pathological expression could stall an evaluation for minutes.
+`MathEquivalenceChecker` runs a task's judge function in worker processes instead: each check
+gets `timeout` seconds, after which its worker is killed and restarted and the check counts as
+not equal. Workers can also be given an address-space limit, and a crash only costs the check
+that caused it. Results are memoized on the normalized `(prediction, gold, *args)`, so repeated
+answers are checked once, and `check_many` spreads a whole task's checks over the workers,
+typically from the task's `prefetch_results` hook. `math_checker` is the checker shared by the
+tasks, it judges with the official OlympiadBench judge (`judge_answer`).
+
+`numerically_different` and `numerically_not_proportional` evaluate sympy expressions at a few
+random points. They only ever reject: when they return True the expressions cannot be proven
+equal by simplification, so judges call them before `simplify`.
+
+Environment variables:
+    LMMS_EVAL_MATH_PROCESSES: worker processes, defaults to the number of CPUs (at most 8).
+    LMMS_EVAL_MATH_TIMEOUT: seconds allowed per check, defaults to 10.
+    LMMS_EVAL_MATH_MEMORY_MB: optional address-space limit of each worker.
+"""
+import collections
+import multiprocessing
+import os
+import random
+import time
+from multiprocessing.connection import wait
+from typing import Callable, Hashable, List, Optional, Sequence, Tuple
+
+from loguru import logger as eval_logger
+
+MATH_PROCESSES = int(os.getenv("LMMS_EVAL_MATH_PROCESSES", 0)) or min(8, os.cpu_count() or 1)
+MATH_TIMEOUT = float(os.getenv("LMMS_EVAL_MATH_TIMEOUT", 10))
+MATH_MEMORY_MB = int(os.getenv("LMMS_EVAL_MATH_MEMORY_MB", 0)) or None
+
+
+def _numeric_samples(expressions, samples: int, seed: int):
+    """Yields the values of `expressions` at `samples` random points of their free symbols, None where one does not evaluate to a finite real."""
+    symbols = sorted(set().union(*(expr.free_symbols for expr in expressions)), key=str)
+    rnd = random.Random(seed)
+    for _ in range(samples):
+        # positive points keep roots and logarithms real
+        point = {symbol: rnd.uniform(0.5, 2.0) for symbol in symbols}
+        try:
+            values = [expr.evalf(subs=point) for expr in expressions]
+            values = [float(value) if value.is_real and value.is_finite else None for value in values]
+        except Exception:
+            values = None
+        if values is None or None in values:
+            yield None
+        else:
+            yield values
+
+
+def numerically_different(expr1, expr2, tolerance: float = 1e-3, samples: int = 3, seed: int = 0) -> bool:
+    """True when `expr1 - expr2` is clearly not within `tolerance` of 0 at a sampled point."""
+    for values in _numeric_samples((expr1, expr2), samples, seed):
+        if values is not None and abs(values[0] - values[1]) > tolerance * max(1.0, abs(values[0]), abs(values[1])):
+            return True
+    return False
+
+
+def numerically_not_proportional(expr1, expr2, samples: int = 3, seed: int = 0) -> bool:
+    """True when neither `expr1 / expr2` nor `expr2 / expr1` is a non-zero integer at a sampled point."""
+
+    def is_integer_ratio(ratio):
+        nearest = round(ratio)
+        return nearest != 0 and abs(ratio - nearest) <= 1e-6 * max(1.0, abs(ratio))
+
+    for values in _numeric_samples((expr1, expr2), samples, seed):
+        if values is None or values[0] == 0 or values[1] == 0:
+            continue
+        if not is_integer_ratio(values[0] / values[1]) and not is_integer_ratio(values[1] / values[0]):
+            return True
+    return False
+
+
+def _worker_loop(conn, judge: Callable, memory_mb: Optional[int]) -> None:
+    if memory_mb:
+        try:
+            import resource
+
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        index, check = task
+        try:
+            result = bool(judge(*check))
+        except BaseException:
+            # judges treat failures as "not equal", MemoryError and RecursionError included
+            result = False
+        conn.send((index, result))
+
+
+class _Worker:
+    def __init__(self, judge: Callable, memory_mb: Optional[int]) -> None:
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_loop, args=(child_conn, judge, memory_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class MathEquivalenceChecker:
+    """Runs `judge(prediction, gold, *args) -> bool` in worker processes with a per-check timeout, memoizing the results.
+
+    `normalize(prediction, gold)` maps a pair to the form the judge compares (e.g. with the
+    answer extracted from `\\boxed{}`); pairs with the same normalized form share one check.
+    `judge` must be a module-level function so that workers can be started with any start method.
+    """
+
+    def __init__(
+        self,
+        judge: Callable[..., bool],
+        normalize: Optional[Callable[[str, str], Tuple[str, str]]] = None,
+        num_processes: int = MATH_PROCESSES,
+        timeout: float = MATH_TIMEOUT,
+        memory_mb: Optional[int] = MATH_MEMORY_MB,
+    ) -> None:
+        self.judge = judge
+        self.normalize = normalize
+        self.num_processes = max(1, num_processes)
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.cache = {}
+        self.timeouts = 0
+        self._workers: List[_Worker] = []
+
+    def key(self, check: Sequence) -> Hashable:
+        prediction, gold, *args = check
+        if self.normalize is not None:
+            try:
+                prediction, gold = self.normalize(prediction, gold)
+            except Exception:
+                pass
+        return (prediction, gold) + tuple(tuple(arg) if isinstance(arg, list) else arg for arg in args)
+
+    def check(self, prediction, gold, *args) -> bool:
+        return self.check_many([(prediction, gold, *args)])[0]
+
+    def check_many(self, checks: Sequence[Sequence]) -> List[bool]:
+        """Results of many `(prediction, gold, *args)` checks, the ones not memoized yet run concurrently."""
+        keys = [self.key(check) for check in checks]
+        todo = {}
+        for key, check in zip(keys, checks):
+            if key not in self.cache and key not in todo:
+                todo[key] = check
+        if todo:
+            for key, result in zip(todo, self._run(list(todo.values()))):
+                self.cache[key] = result
+        return [self.cache[key] for key in keys]
+
+    def _run(self, checks: List[Sequence]) -> List[bool]:
+        results = [False] * len(checks)
+        while len(self._workers) < min(self.num_processes, len(checks)):
+            self._workers.append(_Worker(self.judge, self.memory_mb))
+        idle = list(range(min(len(self._workers), len(checks))))
+        pending = collections.deque(enumerate(checks))
+        # worker slot -> (index of its check, deadline)
+        busy = {}
+        while pending or busy:
+            while pending and idle:
+                slot = idle.pop()
+                index, check = pending.popleft()
+                try:
+                    self._workers[slot].conn.send((index, tuple(check)))
+                except (BrokenPipeError, OSError):
+                    # the worker died between two calls, retry the check on a new one
+                    self._restart(slot)
+                    pending.appendleft((index, check))
+                    idle.append(slot)
+                    continue
+                busy[slot] = (index, time.monotonic() + self.timeout)
+            next_deadline = min(deadline for _, deadline in busy.values())
+            ready = wait([self._workers[slot].conn for slot in busy], timeout=max(0.0, next_deadline - time.monotonic()))
+            for slot in list(busy):
+                index, deadline = busy[slot]
+                if self._workers[slot].conn in ready:
+                    try:
+                        _, results[index] = self._workers[slot].conn.recv()
+                    except (EOFError, OSError):
+                        eval_logger.warning(f"Math equivalence worker crashed on check {checks[index][:2]}, counting it as not equal")
+                        self._restart(slot)
+                elif deadline <= time.monotonic():
+                    eval_logger.warning(f"Math equivalence check timed out after {self.timeout}s, counting it as not equal: {checks[index][:2]}")
+                    self.timeouts += 1
+                    self._restart(slot)
+                else:
+                    continue
+                del busy[slot]
+                idle.append(slot)
+        return results
+
+    def _restart(self, slot: int) -> None:
+        self._workers[slot].kill()
+        self._workers[slot] = _Worker(self.judge, self.memory_mb)
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.kill()
+        self._workers = []
+
+
+_process_evaluator = None
+
+
+def _evaluator():
+    global _process_evaluator
+    if _process_evaluator is None:
+        # imported on first use, the olympiadbench evaluator itself imports this module
+        from lmms_eval.tasks.olympiadbench.olympiadbench_evals import OlympiadBenchEvaluator
+
+        _process_evaluator = OlympiadBenchEvaluator()
+    return _process_evaluator
+
+
+def judge_answer(expression1, expression2, precision=1e-8):
+    """`OlympiadBenchEvaluator.judge` with an evaluator created once per process, for `MathEquivalenceChecker` workers."""
+    return _evaluator().judge(expression1, expression2, precision)
+
+
+def normalize_answers(expression1, expression2):
+    # `judge` only looks at the preprocessed expressions
+    return _evaluator().preprocess(expression1, expression2)
+
+
+# shared by the olympiadbench and mathverse tasks, checks run in worker processes with a timeout
+math_checker = MathEquivalenceChecker(judge_answer, normalize=normalize_answers)
@@ -0,0 +1,65 @@
+"""Best-matching n-gram search used by the VCR tasks, kept free of spaCy so it can run in worker processes.
+
+`best_ngram_match` returns exactly what the original loop returned: the first n-gram of the
+response (n = number of reference tokens) sharing a token with the reference whose
+`difflib.SequenceMatcher(None, ngram, reference).ratio()` is highest. It is faster because
+the reference is set as the second sequence of one `SequenceMatcher` (which indexes it once),
+repeated n-gram strings are scored once, and `real_quick_ratio`/`quick_ratio`, which are upper
+bounds of `ratio`, skip every candidate that cannot beat the best similarity found so far.
+"""
+import multiprocessing
+import os
+from difflib import SequenceMatcher
+from typing import List, Sequence, Tuple
+
+# below this many samples a process pool costs more than it saves
+MIN_PARALLEL_SAMPLES = 64
+
+# (crossed_text, result, language) -> score of vcr_wiki, filled for a whole task by its prefetch_results hook.
+# It is kept here because `!function` tags may each load their own copy of a task's utils.py,
+# so prefetch_results and process_results would not share a dict defined there.
+prefetched_scores = {}
+
+
+def best_ngram_match(tokens_result: Sequence[str], tokens_crossed_text: Sequence[str], crossed_text: str, splitter: str) -> Tuple[float, str, tuple]:
+    """Returns `(max_sim_val, max_sim_string, max_sim_ngram)`, `(0, "", ())` when no n-gram shares a token with the reference."""
+    n = len(tokens_crossed_text)
+    tokens_crossed_text_set = set(tokens_crossed_text)
+    matcher = SequenceMatcher(None)
+    matcher.set_seq2(crossed_text)
+    max_sim_val = 0
+    max_sim_string = ""
+    max_sim_ngram = ()
+    seen = set()
+    # same n-grams as nltk.util.ngrams, which yields nothing when the response is shorter than the reference
+    for start in range(len(tokens_result) - n + 1 if n > 0 else 0):
+        ngram = tuple(tokens_result[start : start + n])
+        if tokens_crossed_text_set.isdisjoint(ngram):
+            continue
+        result_ngram = splitter.join(ngram)
+        # an n-gram string seen before cannot be strictly better than itself
+        if result_ngram in seen:
+            continue
+        seen.add(result_ngram)
+        matcher.set_seq1(result_ngram)
+        if matcher.real_quick_ratio() <= max_sim_val or matcher.quick_ratio() <= max_sim_val:
+            continue
+        similarity = matcher.ratio()
+        if similarity > max_sim_val:
+            max_sim_val = similarity
+            max_sim_string = result_ngram
+            max_sim_ngram = ngram
+    return max_sim_val, max_sim_string, max_sim_ngram
+
+
+def _best_ngram_match_star(args):
+    return best_ngram_match(*args)
+
+
+def best_ngram_matches(samples: List[Tuple[Sequence[str], Sequence[str], str, str]], num_processes: int = None) -> List[Tuple[float, str, tuple]]:
+    """`best_ngram_match` over many `(tokens_result, tokens_crossed_text, crossed_text, splitter)` samples, in a process pool when it pays off."""
+    if num_processes == 1 or len(samples) < MIN_PARALLEL_SAMPLES:
+        return [best_ngram_match(*sample) for sample in samples]
+    num_processes = num_processes or os.cpu_count()
+    with multiprocessing.Pool(num_processes) as pool:
+        return pool.map(_best_ngram_match_star, samples, chunksize=max(1, len(samples) // (4 * num_processes)))
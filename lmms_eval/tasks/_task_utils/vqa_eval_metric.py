@@ -1,4 +1,26 @@
+"""EvalAI answer normalization and VQA accuracy shared by the VQA tasks (vqav2, textvqa, ok_vqa, vizwiz_vqa).
+
+`normalize_answer` is a module-level, LRU-cached `EvalAIAnswerProcessor`, so the ground-truth
+answers, which repeat a lot across questions, are normalized once per run instead of once per
+document. `vqa_accuracy` scores a batch of normalized predictions against `Counter`s of the
+normalized ground-truth answers: with M of the n answers equal to the prediction, each of those
+M answers scores min(1, (M - 1) / 3) against the others and the remaining n - M score
+min(1, M / 3), so the accuracy needs no comparison between pairs of answers.
+"""
+import functools
 import re
+from collections import Counter
+from typing import Iterable, Sequence
+
+import numpy as np
+
+# distinct strings kept by the normalization caches
+NORMALIZE_CACHE_SIZE = 2**18
+
+# (question_id, prediction) -> (normalized prediction, accuracy) of vqav2, filled for a whole task by its prefetch_results hook.
+# It is kept here because `!function` tags may each load their own copy of a task's utils.py,
+# so prefetch_results and process_results would not share a dict defined there.
+prefetched_accuracy = {}
 
 
 class EvalAIAnswerProcessor:
@@ -145,7 +167,7 @@ class EvalAIAnswerProcessor:
         "nine": "9",
         "ten": "10",
     }
-    ARTICLES = ["a", "an", "the"]
+    ARTICLES = frozenset(["a", "an", "the"])
     PERIOD_STRIP = re.compile(r"(?!<=\d)(\.)(?!\d)")
     COMMA_STRIP = re.compile(r"(?<=\d)(\,)+(?=\d)")
     PUNCTUATIONS = [
@@ -172,6 +194,9 @@ class EvalAIAnswerProcessor:
         "!",
     ]
 
+    # every punctuation mark is a single character, so it is removed or replaced by a space with one str.translate
+    _PUNCTUATION_REMOVE = str.maketrans("", "", "".join(PUNCTUATIONS))
+
     def __init__(self, *args, **kwargs):
         pass
 
@@ -181,12 +206,10 @@ class EvalAIAnswerProcessor:
         return word.strip()
 
     def process_punctuation(self, in_text):
-        out_text = in_text
-        for p in self.PUNCTUATIONS:
-            if (p + " " in in_text or " " + p in in_text) or (re.search(self.COMMA_STRIP, in_text) is not None):
-                out_text = out_text.replace(p, "")
-            else:
-                out_text = out_text.replace(p, " ")
+        if re.search(self.COMMA_STRIP, in_text) is not None:
+            out_text = in_text.translate(self._PUNCTUATION_REMOVE)
+        else:
+            out_text = in_text.translate({ord(p): "" if (p + " " in in_text or " " + p in in_text) else " " for p in self.PUNCTUATIONS})
         out_text = self.PERIOD_STRIP.sub("", out_text, re.UNICODE)
         return out_text
 
@@ -194,14 +217,9 @@ class EvalAIAnswerProcessor:
         out_text = []
         temp_text = in_text.lower().split()
         for word in temp_text:
-            word = self.NUMBER_MAP.setdefault(word, word)
+            word = self.NUMBER_MAP.get(word, word)
             if word not in self.ARTICLES:
-                out_text.append(word)
-            else:
-                pass
-        for word_id, word in enumerate(out_text):
-            if word in self.CONTRACTIONS:
-                out_text[word_id] = self.CONTRACTIONS[word]
+                out_text.append(self.CONTRACTIONS.get(word, word))
         out_text = " ".join(out_text)
         return out_text
 
@@ -211,3 +229,35 @@ class EvalAIAnswerProcessor:
         item = self.process_punctuation(item)
         item = self.process_digit_article(item)
         return item
+
+
+_processor = EvalAIAnswerProcessor()
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_answer(answer: str) -> str:
+    """`EvalAIAnswerProcessor()(answer)`, cached."""
+    return _processor(answer)
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_punctuation_digit_article(answer: str) -> str:
+    """`process_punctuation` then `process_digit_article`, cached. VQAv2 applies it to answers with disagreeing annotators."""
+    return _processor.process_digit_article(_processor.process_punctuation(answer))
+
+
+def answer_counts(answers: Iterable[str]) -> Counter:
+    """Counter of the normalized ground-truth answers of a question."""
+    return Counter(normalize_answer(answer) for answer in answers)
+
+
+def vqa_accuracy(predictions: Sequence[str], gt_answer_counts: Sequence[Counter]) -> np.ndarray:
+    """VQA accuracy of every normalized prediction against the Counter of its normalized ground-truth answers.
+
+    Equal to the mean over the ground-truth answers of min(1, matches among the other answers / 3),
+    up to float rounding. A question without answers scores 0.
+    """
+    num_answers = np.fromiter((sum(counts.values()) for counts in gt_answer_counts), dtype=np.float64, count=len(gt_answer_counts))
+    matches = np.fromiter((counts.get(prediction, 0) for prediction, counts in zip(predictions, gt_answer_counts)), dtype=np.float64, count=len(gt_answer_counts))
+    total = matches * np.minimum(1, np.maximum(matches - 1, 0) / 3) + (num_answers - matches) * np.minimum(1, matches / 3)
+    return np.divide(total, num_answers, out=np.zeros_like(total), where=num_answers > 0)
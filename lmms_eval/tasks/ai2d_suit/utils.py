@@ -37,6 +37,10 @@ def ai2d_doc_to_target(doc, model_specific_target_kwargs):
         return doc["options"][int(doc["answer"])]
 
 
+# Regex to directly extract the option letter from the model response, compiled once for all documents
+OPTION_LETTER_REGEX = re.compile(r"^\s*([A-Z])\.")
+
+
 class MultiChoiceRegexFilter(ExtendedRegexFilter):
     def __init__(self, *args, **kwargs):
         """
@@ -59,14 +63,11 @@ class MultiChoiceRegexFilter(ExtendedRegexFilter):
         filtered_resps = []
 
         for r, doc in zip(resps, docs):
-            # Regex to directly extract the option letter from the model response
-            option_letter_regex = re.compile(r"^\s*([A-Z])\.")
-
             # Process each response
             filtered = []
             for resp in r:
                 # Try to match the option letter at the start of the response
-                match = option_letter_regex.match(resp)
+                match = OPTION_LETTER_REGEX.match(resp)
                 if match:
                     # If a match is found, append the matched letter
                     filtered.append(match.group(1))
@@ -1,9 +1,7 @@
 import os
 import json
-from pycocoevalcap.eval import COCOEvalCap, Bleu, Meteor, Rouge, Cider, Spice
-from pycocoevalcap.tokenizer.ptbtokenizer import PTBTokenizer
-from pycocotools.coco import COCO
 
+from lmms_eval.tasks._task_utils.caption_scorer import caption_score
 from lmms_eval.tasks._task_utils.file_utils import generate_submission_file
 
 
@@ -42,51 +40,9 @@ def coco_process_result(doc, result):
 
 
 def coco_aggregation_result(results, metric, args):
-    scorers = [(Bleu(4), "Bleu_1"), (Bleu(4), "Bleu_2"), (Bleu(4), "Bleu_3"), (Bleu(4), "Bleu_4"), (Meteor(), "METEOR"), (Rouge(), "ROUGE_L"), (Cider(), "CIDEr")]  # , (Spice(), "SPICE")]
-    scorers_dict = {s[1]: s for s in scorers}
-
-    stored_results = []
-    # In order to make the coco eval tools to successfully create index
-    # We need at least two dict in the dataset
-    # 'annotation' and 'images'
-    # 'annotation' exactly reproduce the original annotation
-    # 'images' however only need the image id which is contained in the file name
-    dataset = {"annotations": [], "images": []}
-    idx = 0
-    for result in results:
-        stored_results.append({"image_id": int(result["image_id"]), "caption": result["pred"]})
-        for a in result["answer"]:
-            dataset["annotations"].append({"image_id": int(result["image_id"]), "caption": a, "id": idx})
-            idx += 1
-        dataset["images"].append({"id": result["image_id"]})
-
-    coco = COCO()
-    # Manually create index here
-    coco.dataset = dataset
-    coco.createIndex()
-
-    coco_result = coco.loadRes(stored_results)
-    coco_eval = COCOEvalCap(coco, coco_result)
-
-    imgIds = coco_eval.params["image_id"]
-    gts = {}
-    res = {}
-    for imgId in imgIds:
-        gts[imgId] = coco_eval.coco.imgToAnns[imgId]
-        res[imgId] = coco_eval.cocoRes.imgToAnns[imgId]
-
-    eval_logger.info("tokenization...")
-    tokenizer = PTBTokenizer()
-    gts = tokenizer.tokenize(gts)
-    res = tokenizer.tokenize(res)
-
-    eval_logger.info(f"Computing {metric} scores...")
-
-    score, scores = scorers_dict[metric][0].compute_score(gts, res)
-    # When metric is one of the Bleu, score will be a list
-    if type(score) == list:
-        n = int(metric.split("_")[-1])
-        score = score[n - 1]
+    stored_results = [{"image_id": int(result["image_id"]), "caption": result["pred"]} for result in results]
+    # tokenized once for all the caption metrics of the task, see caption_scorer
+    score = caption_score(results, metric)
 
     path = generate_submission_file("coco_captions_val2014_alg_results.json", args)
     if not os.path.exists(path):
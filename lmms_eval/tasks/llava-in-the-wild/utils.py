@@ -1,18 +1,15 @@
 import json
 
 import os
-import requests
 import numpy as np
 import openai
 from openai import OpenAI
-import time
 import yaml
 from pathlib import Path
 from copy import deepcopy
 
 from loguru import logger as eval_logger
-
-NUM_SECONDS_TO_SLEEP = 5
+from lmms_eval.tasks._task_utils.gpt_judge import get_judge
 
 LLAVA_W_METRICS = ["gpt_eval_llava_conv", "gpt_eval_llava_detail", "gpt_eval_llava_complex"]
 
@@ -48,9 +45,7 @@ elif API_TYPE == "azure":
     }
 
 
-def get_eval(content: str, max_tokens: int, retries: int = 5):
-    global headers
-
+def build_payload(content: str, max_tokens: int):
     messages = [
         {
             "role": "system",
@@ -59,32 +54,19 @@ def get_eval(content: str, max_tokens: int, retries: int = 5):
         {"role": "user", "content": content},
     ]
 
-    payload = {
+    return {
         "model": GPT_EVAL_MODEL_NAME,
         "messages": messages,
         "temperature": 0.2,
         "max_tokens": max_tokens,
     }
 
-    for attempt in range(retries):
-        try:
-            response = requests.post(API_URL, headers=headers, json=payload, timeout=60)
-            response.raise_for_status()
-            response_data = response.json()
 
-            content = response_data["choices"][0]["message"]["content"].strip()
-            if content != "":
-                return content, response_data["model"]
-            break  # If successful, break out of the loop
-
-        except Exception as e:
-            eval_logger.info(f"Attempt {attempt + 1} failed with error: {e}")
-            if attempt < retries:  # If we have retries left, sleep and then continue to next attempt
-                time.sleep(NUM_SECONDS_TO_SLEEP)
-            else:  # If this was the last attempt, log and return empty
-                eval_logger.error(f"All {retries} attempts failed. Last error message: {e}")
-                return "", ""
-    return "", ""
+def get_eval(content: str, max_tokens: int):
+    response_data = get_judge(API_URL, headers).query(build_payload(content, max_tokens))
+    if response_data is None:
+        return "", ""
+    return response_data["choices"][0]["message"]["content"].strip(), response_data["model"]
 
 
 def parse_score(review):
@@ -114,6 +96,25 @@ def llava_doc_to_text(doc, model_specific_prompt_kwargs=None):
     return f"{pre_prompt}{doc['question']}{post_prompt}"
 
 
+def build_review_content(doc, result):
+    question = doc.get("question", "")
+    ans1 = doc.get("gpt_answer", "")
+    ans2 = result[0] if result else ""
+    captions = doc.get("caption", [])
+    context = "\n".join(captions) if isinstance(captions, list) else captions
+    category = "llava_bench_" + doc.get("category", "")
+    rule = rule_dict.get(category, {})
+    prompt = rule.get("prompt", "")
+    role = rule.get("role", "user")
+    content = f"[Context]\n{context}\n\n" f"[Question]\n{question}\n\n" f"[{role} 1]\n{ans1}\n\n[End of {role} 1]\n\n" f"[{role} 2]\n{ans2}\n\n[End of {role} 2]\n\n" f"[System]\n{prompt}\n\n"
+    return question, ans1, ans2, context, category, content
+
+
+def llava_prefetch_results(docs, results):
+    payloads = [build_payload(build_review_content(doc, result)[-1], 1024) for doc, result in zip(docs, results)]
+    get_judge(API_URL, headers).query_all(payloads)
+
+
 def llava_process_results(doc, result):
     """
     Args:
@@ -123,16 +124,7 @@ def llava_process_results(doc, result):
         a dictionary with key: metric name (in this case coco_bleu), value: metric value
     """
     try:
-        question = doc.get("question", "")
-        ans1 = doc.get("gpt_answer", "")
-        ans2 = result[0] if result else ""
-        captions = doc.get("caption", [])
-        context = "\n".join(captions) if isinstance(captions, list) else captions
-        category = "llava_bench_" + doc.get("category", "")
-        rule = rule_dict.get(category, {})
-        prompt = rule.get("prompt", "")
-        role = rule.get("role", "user")
-        content = f"[Context]\n{context}\n\n" f"[Question]\n{question}\n\n" f"[{role} 1]\n{ans1}\n\n[End of {role} 1]\n\n" f"[{role} 2]\n{ans2}\n\n[End of {role} 2]\n\n" f"[System]\n{prompt}\n\n"
+        question, ans1, ans2, context, category, content = build_review_content(doc, result)
 
         review, model_name = get_eval(content, 1024)
         scores = parse_score(review)
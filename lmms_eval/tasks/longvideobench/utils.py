@@ -3,15 +3,12 @@ import json
 import re
 from collections import Counter, defaultdict
 from lmms_eval.tasks._task_utils.file_utils import generate_submission_file
+from lmms_eval.models.model_utils.video_frames import load_video_frames
 import random
 import os
 
-import os
-import decord
-from decord import VideoReader, cpu
 import numpy as np
 from PIL import Image
-import torch
 
 
 from pathlib import Path
@@ -32,22 +29,7 @@ def timestamp_to_seconds(timestamp):
 
 
 def load_video(video_file, duration, max_num_frames=16):
-    from decord import VideoReader
-
-    vr = VideoReader(video_file, ctx=cpu(0), num_threads=1)
-    fps = vr.get_avg_fps()
-    total_valid_frames = int(duration * fps)
-    num_frames = min(max_num_frames, int(duration))
-
-    frame_indices = [int(total_valid_frames / num_frames) * i for i in range(num_frames)]
-
-    frames = vr.get_batch(frame_indices)
-    if isinstance(frames, torch.Tensor):
-        frames = frames.numpy()
-    else:
-        frames = frames.asnumpy()
-    frame_timestamps = [frame_index / fps for frame_index in frame_indices]
-
+    frames = load_video_frames(video_file, max_num_frames, policy="duration_stride", duration=duration)
     return [Image.fromarray(fr).convert("RGB") for fr in frames]
 
 
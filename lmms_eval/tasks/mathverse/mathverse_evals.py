@@ -6,6 +6,8 @@ import pandas as pd
 
 from loguru import logger as eval_logger
 
+from lmms_eval.tasks._task_utils.math_equivalence import math_checker
+
 DEMO_PROMPT_EXTRACT = """
 I am providing you a response from a model to a math problem, termed 'Model Response'. You should extract the answer from the response as 'Extracted Answer'. Directly output the extracted answer with no explanation.
 
@@ -259,24 +261,37 @@ class MathVerseEvaluator:
         return query
 
     def eval_results(self, results, config):
-        # extract and score for each question
+        # extract the answer of each question
         for inst in tqdm(results):
             full_prediction = inst["prediction"].strip()
+            if config["metadata"].get("trunk_response", -1) > 0:
+                prediction = " ".join(full_prediction.split(" ")[-config["metadata"]["trunk_response"] :])
+            else:
+                prediction = full_prediction
+            inst["extraction"] = self.extract_answer(prediction)
+            inst["prediction"] = prediction
+
+        # with `symbolic_match`, free-form answers mathematically equivalent to the standard answer are correct without a GPT judgement.
+        # The official protocol always asks GPT, so it is off by default.
+        equivalent = set()
+        if config["metadata"].get("symbolic_match", False):
+            free_form = [inst for inst in results if inst["question_type"] == "free-form" and inst.get("answer") is not None and inst["extraction"]]
+            equivalent = {id(inst) for inst, equal in zip(free_form, math_checker.check_many([(inst["extraction"], inst["answer"]) for inst in free_form])) if equal}
+
+        # score each question
+        for inst in tqdm(results):
             problem = {
                 "question_type": inst["question_type"],
                 "answer": inst["answer"] if "answer" in inst else None,
                 "question_for_eval": inst["question_for_eval"],
             }
-            if config["metadata"].get("trunk_response", -1) > 0:
-                prediction = " ".join(full_prediction.split(" ")[-config["metadata"]["trunk_response"] :])
-            else:
-                prediction = full_prediction
-            extraction = self.extract_answer(prediction)
             # set test set answer to None
-            true_false = self.score_answer(problem["question_for_eval"], problem["answer"], extraction, config["metadata"]["quick_match"]) if problem["answer"] is not None else False
-
-            inst["extraction"] = extraction
-            inst["prediction"] = prediction
+            if problem["answer"] is None:
+                true_false = False
+            elif id(inst) in equivalent:
+                true_false = True
+            else:
+                true_false = self.score_answer(problem["question_for_eval"], problem["answer"], inst["extraction"], config["metadata"]["quick_match"])
             inst["true_false"] = true_false
 
         # calculate total scores
@@ -1,10 +1,9 @@
-import time
-import requests
 import re
 from Levenshtein import distance
 
 
 from loguru import logger as eval_logger
+from lmms_eval.tasks._task_utils.gpt_judge import get_judge
 
 # pids: 799, 681, 615
 shot_examples = [
@@ -153,51 +152,27 @@ class MathVistaEvaluator:
         self.gpt_model = gpt_model
         self.quick_extract = quick_extract
 
-    def _post_request(self, payload):
+    @property
+    def judge(self):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
-        response = requests.post(self.API_URL, headers=headers, json=payload, timeout=30)
-        response.raise_for_status()
-        return response.json()
+        return get_judge(self.API_URL, headers)
 
-    def get_chat_response(self, prompt, temperature=0, max_tokens=256, n=1, patience=5, sleep_time=0):
+    def build_payload(self, prompt, temperature=0, max_tokens=256, n=1):
         messages = [
             {"role": "user", "content": prompt},
         ]
-        payload = {"model": self.gpt_model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens, "n": n}
+        return {"model": self.gpt_model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens, "n": n}
 
-        while patience > 0:
-            patience -= 1
-            try:
-                response = self._post_request(payload)
-                if n == 1:
-                    prediction = response["choices"][0]["message"]["content"].strip()
-                    if prediction and prediction != "":
-                        return prediction
-                else:
-                    prediction = [choice["message"]["content"].strip() for choice in response["choices"]]
-                    if prediction and prediction[0] != "":
-                        return prediction
-
-            except Exception as e:
-                if "Rate limit" not in str(e):
-                    eval_logger.error(e)
-
-                if "Please reduce the length of the messages" in str(e):
-                    eval_logger.error("!!Reduce prompt size")
-                    # reduce input prompt and keep the tail
-                    new_size = int(len(prompt) * 0.9)
-                    new_start = len(prompt) - new_size
-                    prompt = prompt[new_start:]
-                    payload["messages"] = [
-                        {"role": "user", "content": prompt},
-                    ]
-
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-        return ""
+    def get_chat_response(self, prompt, temperature=0, max_tokens=256, n=1):
+        response = self.judge.query(self.build_payload(prompt, temperature, max_tokens, n), trim_long_prompts=True)
+        if response is None:
+            return ""
+        if n == 1:
+            return response["choices"][0]["message"]["content"].strip()
+        return [choice["message"]["content"].strip() for choice in response["choices"]]
 
     def verify_extraction(self, extraction):
         extraction = extraction.strip()
@@ -211,11 +186,11 @@ class MathVistaEvaluator:
         full_prompt = f"{demo_prompt}\n\n{test_prompt}\n\nExtracted answer: "
         return full_prompt
 
-    def extract_answer(self, response, problem, quick_extract=False):
+    def rule_based_extraction(self, response, problem, quick_extract=False):
+        """Returns the answer if it can be extracted without the GPT judge, otherwise None."""
         question_type = problem["question_type"]
         answer_type = problem["answer_type"]
         choices = problem.get("choices", [])
-        query = problem["query"]
 
         if not response:
             return ""
@@ -249,9 +224,20 @@ class MathVistaEvaluator:
             except re.error:
                 pass
 
+        return None
+
+    def extraction_payload(self, response, problem):
+        full_prompt = self.create_test_prompt(DEMO_PROMPT, problem["query"], response)
+        return self.build_payload(full_prompt, temperature=0, max_tokens=256, n=1)
+
+    def extract_answer(self, response, problem, quick_extract=False):
+        extraction = self.rule_based_extraction(response, problem, quick_extract)
+        if extraction is not None:
+            return extraction
+
         # general extraction
         try:
-            full_prompt = self.create_test_prompt(DEMO_PROMPT, query, response)
+            full_prompt = self.create_test_prompt(DEMO_PROMPT, problem["query"], response)
             extraction = self.get_chat_response(full_prompt, temperature=0, max_tokens=256, n=1)
             return extraction
         except Exception as e:
@@ -260,6 +246,11 @@ class MathVistaEvaluator:
 
         return ""
 
+    def prefetch_extractions(self, responses, problems, quick_extract=False):
+        """Sends the GPT extraction prompts of all responses concurrently, so that `extract_answer` hits the judge cache."""
+        payloads = [self.extraction_payload(response, problem) for response, problem in zip(responses, problems) if self.rule_based_extraction(response, problem, quick_extract) is None]
+        self.judge.query_all(payloads, trim_long_prompts=True)
+
     def get_most_similar(self, prediction, choices):
         """
         Use the Levenshtein distance (or edit distance) to determine which of the choices is most similar to the given prediction
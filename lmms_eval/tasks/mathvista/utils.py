@@ -47,9 +47,8 @@ def mathvista_doc_to_text(doc, model_specific_prompt_kwargs=None):
     return query_prompt
 
 
-def mathvista_process_results(doc, results):
-    prediction = results[0].strip()
-    problem = {
+def mathvista_doc_to_problem(doc):
+    return {
         "question_type": doc["question_type"],
         "answer_type": doc["answer_type"],
         "query": doc["query"],
@@ -57,6 +56,15 @@ def mathvista_process_results(doc, results):
         "answer": doc["answer"] if "answer" in doc else None,
         "precision": doc["precision"] if "precision" in doc else 0,
     }
+
+
+def mathvista_prefetch_results(docs, results):
+    mathvista_evaluator.prefetch_extractions([result[0].strip() for result in results], [mathvista_doc_to_problem(doc) for doc in docs], config["metadata"]["quick_extract"])
+
+
+def mathvista_process_results(doc, results):
+    prediction = results[0].strip()
+    problem = mathvista_doc_to_problem(doc)
     extraction = mathvista_evaluator.extract_answer(prediction, problem, config["metadata"]["quick_extract"])
 
     prediction = mathvista_evaluator.normalize_extracted_answer(extraction, problem["choices"], problem["question_type"], problem["answer_type"], problem["precision"])
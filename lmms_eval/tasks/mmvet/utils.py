@@ -1,5 +1,4 @@
 import os
-import requests
 import time
 
 import pandas as pd
@@ -7,6 +6,7 @@ import yaml
 from pathlib import Path
 
 from loguru import logger as eval_logger
+from lmms_eval.tasks._task_utils.gpt_judge import get_judge
 
 with open(Path(__file__).parent / "mmvet.yaml", "r") as f:
     raw_data = f.readlines()
@@ -34,47 +34,42 @@ Can you explain this meme? | This meme is poking fun at the fact that the names
 """
 
 
-def get_chat_response(prompt, model=GPT_EVAL_MODEL_NAME, temperature=0.0, max_tokens=128, patience=3, sleep_time=5):
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-    }
+HEADERS = {
+    "Authorization": f"Bearer {API_KEY}",
+    "Content-Type": "application/json",
+}
+
 
+def build_payload(prompt, model=GPT_EVAL_MODEL_NAME, temperature=0.0, max_tokens=128):
     messages = [
         {"role": "user", "content": prompt},
     ]
 
-    payload = {
+    return {
         "model": model,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
 
-    while patience > 0:
-        patience -= 1
-        try:
-            response = requests.post(
-                API_URL,
-                headers=headers,
-                json=payload,
-                timeout=60,
-            )
-            response.raise_for_status()
-            response_data = response.json()
 
-            content = response_data["choices"][0]["message"]["content"].strip()
-            if content != "":
-                return content, response_data["model"]
+def get_chat_response(prompt, model=GPT_EVAL_MODEL_NAME, temperature=0.0, max_tokens=128):
+    response_data = get_judge(API_URL, HEADERS).query(build_payload(prompt, model, temperature, max_tokens))
+    if response_data is None:
+        return "", ""
+    return response_data["choices"][0]["message"]["content"].strip(), response_data["model"]
 
-        except Exception as e:
-            eval_logger.error(f"Error: {e}")
-            if "Rate limit" in str(e):
-                eval_logger.info("Sleeping due to rate limit...")
-                time.sleep(sleep_time)
-            eval_logger.info(f"Retrying...Patience left: {patience}")
 
-    return "", ""
+def build_gpt_query_prompt(doc, pred):
+    question = doc["question"]
+    answer = doc["answer"]
+    return f"{MM_VET_PROMPT}\n{question} | {answer.replace('<AND>', ' <AND> ').replace('<OR>', ' <OR> ')} | {pred} |"
+
+
+def mmvet_prefetch_results(docs, results):
+    # only the first, temperature 0 attempt of every sample is prefetched; retries with a higher temperature stay in process_results
+    payloads = [build_payload(build_gpt_query_prompt(doc, result[0])) for doc, result in zip(docs, results)]
+    get_judge(API_URL, HEADERS).query_all(payloads)
 
 
 def mmvet_doc_to_visual(doc):
@@ -86,9 +81,7 @@ def mmvet_doc_to_visual(doc):
 def mmvet_process_results(doc, results):
     # get pred and ground truth here
     pred = results[0]
-    question = doc["question"]
-    answer = doc["answer"]
-    gpt_query_prompt = f"{MM_VET_PROMPT}\n{question} | {answer.replace('<AND>', ' <AND> ').replace('<OR>', ' <OR> ')} | {pred} |"
+    gpt_query_prompt = build_gpt_query_prompt(doc, pred)
     grade_sample_run_complete = False
     temperature = 0.0
 
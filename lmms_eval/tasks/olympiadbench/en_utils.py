@@ -1,7 +1,7 @@
 import os
 import json
 import datetime
-from lmms_eval.tasks.olympiadbench.olympiadbench_evals import OlympiadBenchEvaluator
+from lmms_eval.tasks._task_utils.math_equivalence import math_checker
 from lmms_eval.tasks._task_utils.file_utils import generate_submission_file
 
 
@@ -9,11 +9,6 @@ from loguru import logger as eval_logger
 
 dir_name = os.path.dirname(os.path.abspath(__file__))
 
-try:
-    olympiadbench_evaluator = OlympiadBenchEvaluator()
-except:
-    pass
-
 
 def olympiadbench_doc_to_visual(doc):
     return [image.convert("RGB") for image in doc["images"]]
@@ -48,19 +43,29 @@ def olympiadbench_doc_to_text(doc):
     return final_question
 
 
-def olympiadbench_process_results(doc, results):
+def olympiadbench_answer_check(doc, prediction):
+    """The (prediction, gold answer, precision) judged for a doc that is not a proof."""
     precision = doc["error"]
-    is_proving = "TP" in doc["source"]
     if precision is None:
         precision = 0
+    prediction = prediction.split("final answer is")[-1]
+    prediction = prediction.replace('"', "").replace("\n", "").replace(" ", "").strip(".").strip("。")
+    return prediction, doc["final_answer"][0], precision
+
+
+def olympiadbench_prefetch_results(docs, results):
+    # run the checks of the whole task in the math checker's worker processes, process_results reads them from its memo
+    math_checker.check_many([olympiadbench_answer_check(doc, result[0]) for doc, result in zip(docs, results) if "TP" not in doc["source"]])
+
+
+def olympiadbench_process_results(doc, results):
+    is_proving = "TP" in doc["source"]
     prediction = results[0].strip()
 
     if is_proving:
         return {"submission": prediction}
     else:
-        prediction = prediction.split("final answer is")[-1]
-        prediction = prediction.replace('"', "").replace("\n", "").replace(" ", "").strip(".").strip("。")
-        accuracy = olympiadbench_evaluator.judge(prediction, doc["final_answer"][0], precision)
+        accuracy = math_checker.check(*olympiadbench_answer_check(doc, prediction))
         accuracy = int(accuracy)
         return {"exact_match": accuracy}
 
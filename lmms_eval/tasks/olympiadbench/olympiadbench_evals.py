@@ -4,6 +4,8 @@ import sympy as sp
 
 from loguru import logger as eval_logger
 
+from lmms_eval.tasks._task_utils.math_equivalence import numerically_different, numerically_not_proportional
+
 try:
     from sympy import simplify, Eq, sympify, Pow
     from sympy.parsing.latex import parse_latex
@@ -216,6 +218,9 @@ class OlympiadBenchEvaluator:
                     return False
             else:
                 try:
+                    # simplification is slow, skip it when the expressions differ at a random point
+                    if numerically_different(expr1_sym, expr2_sym):
+                        return False
                     simplified_expr = simplify(expr1_sym - expr2_sym)
 
                     num_value = simplified_expr.evalf()
@@ -226,7 +231,7 @@ class OlympiadBenchEvaluator:
     def equation_equal(self, expression1, expression2):
         # Check if two equations are mathematically equivalent
         # Simplify equations and use sympy for equivalence checking
-        def simplify_equation(latex_eq):
+        def equation_difference(latex_eq):
             lhs, rhs = latex_eq.split("=")
 
             lhs_expr = parse_latex(lhs)
@@ -234,12 +239,17 @@ class OlympiadBenchEvaluator:
 
             equation = Eq(lhs_expr, rhs_expr)
 
-            simplified_eq = simplify(equation.lhs - equation.rhs)
+            return equation.lhs - equation.rhs
 
-            return simplified_eq
+        expr1_sym = equation_difference(expression1)
+        expr2_sym = equation_difference(expression2)
+
+        # equivalent equations have proportional sides, skip the simplification when they are not at a random point
+        if numerically_not_proportional(expr1_sym, expr2_sym):
+            return False
 
-        expr1_sym = simplify_equation(expression1)
-        expr2_sym = simplify_equation(expression2)
+        expr1_sym = simplify(expr1_sym)
+        expr2_sym = simplify(expr2_sym)
 
         division_result_1 = simplify(expr1_sym / expr2_sym)
         division_result_2 = simplify(expr2_sym / expr1_sym)
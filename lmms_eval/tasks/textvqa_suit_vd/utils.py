@@ -5,9 +5,9 @@ import yaml
 import pathlib
 
 import datetime
-import statistics
+from collections import Counter
 
-from lmms_eval.tasks._task_utils.vqa_eval_metric import EvalAIAnswerProcessor
+from lmms_eval.tasks._task_utils.vqa_eval_metric import normalize_answer, vqa_accuracy
 from lmms_eval.tasks._task_utils.file_utils import generate_submission_file
 from PIL import Image
 from loguru import logger as eval_logger
@@ -19,23 +19,13 @@ def textvqa_doc_to_visual(doc):
 
 
 def textvqa_process_results(doc, result):
-    eval_ai_processor = EvalAIAnswerProcessor()
     assert len(result) == 1, f"The result should be a list of length 1, but got {len(result)}."
-    resAns = eval_ai_processor(result[0])
+    resAns = normalize_answer(result[0])
     accuracy = 0
 
     if "answers" in doc and doc["answers"] is not None:
-        gtAcc = []
-
-        for i in range(len(doc["answers"])):
-            doc["answers"][i] = eval_ai_processor(doc["answers"][i])
-
-        for i in range(len(doc["answers"])):
-            otherGTAns = [doc["answers"][j] for j in range(len(doc["answers"])) if i != j]
-            matchingAns = [item for item in otherGTAns if item == resAns]
-            acc = min(1, float(len(matchingAns)) / 3)
-            gtAcc.append(acc)
-        accuracy = statistics.mean(gtAcc)
+        doc["answers"] = [normalize_answer(answer) for answer in doc["answers"]]
+        accuracy = float(vqa_accuracy([resAns], [Counter(doc["answers"])])[0])
 
     return {
         "exact_match": accuracy,
@@ -2,16 +2,14 @@ import datetime
 import json
 
 import os
-from difflib import SequenceMatcher as SM
-from functools import partial
+from collections import Counter
 
-import evaluate
 import numpy as np
 import spacy
-from nltk.util import ngrams
 from spacy.cli import download
 
 from lmms_eval.tasks._task_utils.file_utils import generate_submission_file
+from lmms_eval.tasks._task_utils.ngram_similarity import best_ngram_matches, prefetched_scores
 
 # Download the English and Chinese models
 try:
@@ -27,7 +25,9 @@ except Exception as e:
     nlp_zh = spacy.load("zh_core_web_sm")
 
 nlp = {"en": nlp_en, "zh": nlp_zh}
-rouge = evaluate.load("rouge")
+
+# processes of the n-gram search, defaults to all cores
+VCR_SCORE_PROCESSES = int(os.getenv("LMMS_EVAL_VCR_PROCESSES", 0)) or None
 
 from loguru import logger as eval_logger
 
@@ -87,6 +87,110 @@ def tokenize(text, language):
     return [token.text for token in processed_text]
 
 
+def _empty_score(crossed_text):
+    return {
+        "crossed_text": crossed_text,
+        "max_sim_val": 0,
+        "max_sim_string": "",
+        "precision": 0,
+        "recall": 0,
+        "f1": 0,
+        "jaccard": 0,
+        "rouge1": 0,
+        "exact_match": 0,
+    }
+
+
+def tokenize_batch(texts, language):
+    """`tokenize` over many texts with `nlp.pipe`. Only the tokenizer is needed, so the other pipeline components are disabled."""
+    assert language in ["en", "zh"]
+    nlp_lang = nlp[language]
+    return [[token.text for token in processed_text] for processed_text in nlp_lang.pipe(texts, disable=nlp_lang.pipe_names, batch_size=256)]
+
+
+def _rouge1(tokens_prediction, tokens_reference):
+    # rouge1 f-measure of `rouge.compute` with the spaCy tokenizer, which for a single pair is exactly the rouge_score f-measure
+    prediction_counts = Counter(tokens_prediction)
+    reference_counts = Counter(tokens_reference)
+    intersection = sum(min(count, prediction_counts[token]) for token, count in reference_counts.items())
+    precision = intersection / max(len(tokens_prediction), 1)
+    recall = intersection / max(len(tokens_reference), 1)
+    return 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+
+
+def vcr_score_batch(pairs, language):
+    """
+    Scores many (crossed_text, result) pairs at once, with the same outputs as scoring them one by one.
+    All texts are tokenized with `nlp.pipe`, and the n-gram search runs in a process pool (see ngram_similarity).
+    """
+    assert language in ["en", "zh"], f"Language {language} is not supported."
+    splitter = " " if language == "en" else ""
+    outputs = [None] * len(pairs)
+    todo = []
+    for i, (crossed_text, result) in enumerate(pairs):
+        if fast_filter(result):
+            outputs[i] = _empty_score(crossed_text)
+        else:
+            todo.append(i)
+
+    texts = list(dict.fromkeys(text for i in todo for text in pairs[i]))
+    tokens = dict(zip(texts, tokenize_batch(texts, language)))
+    matches = best_ngram_matches([(tokens[pairs[i][1]], tokens[pairs[i][0]], pairs[i][0], splitter) for i in todo], num_processes=VCR_SCORE_PROCESSES)
+
+    # the best n-gram is joined into a string and tokenized again for rouge1
+    best_strings = list(dict.fromkeys(max_sim_string for _, max_sim_string, max_sim_ngram in matches if len(max_sim_ngram) > 0))
+    tokens.update(zip(best_strings, tokenize_batch(best_strings, language)))
+
+    for i, (max_sim_val, max_sim_string, max_sim_ngram) in zip(todo, matches):
+        crossed_text = pairs[i][0]
+        if len(max_sim_ngram) == 0:
+            outputs[i] = _empty_score(crossed_text)
+            continue
+        tokens_crossed_text = tokens[crossed_text]
+        pred_set = set(max_sim_ngram)
+        ref_set = set(tokens_crossed_text)
+        correct_tokens = pred_set.intersection(ref_set)
+        len_correct_tokens = len(correct_tokens)
+
+        precision = len_correct_tokens / len(pred_set)
+        recall = len_correct_tokens / len(ref_set)
+        if (precision + recall) == 0:
+            f1 = 0
+        else:
+            f1 = 2 * precision * recall / (precision + recall)
+        union = pred_set.union(ref_set)
+        jaccard = len_correct_tokens / len(union) if len(union) > 0 else 0
+        rouge_1 = _rouge1(tokens[max_sim_string], tokens_crossed_text)
+        exact_match = float(list(max_sim_ngram) == list(tokens_crossed_text))
+        outputs[i] = {
+            "crossed_text": crossed_text,
+            "max_sim_string": max_sim_string,
+            "max_sim_val": max_sim_val,
+            "precision": precision,
+            "recall": recall,
+            "f1": f1,
+            "jaccard": jaccard,
+            "rouge1": rouge_1,
+            "exact_match": exact_match,
+        }
+    return outputs
+
+
+def _prefetch_scores(docs, results, language):
+    pairs = list(dict.fromkeys((crossed_text, result[0]) for doc, result in zip(docs, results) for crossed_text in doc["crossed_text"]))
+    prefetched_scores.clear()
+    for (crossed_text, result), score in zip(pairs, vcr_score_batch(pairs, language)):
+        prefetched_scores[(crossed_text, result, language)] = score
+
+
+def vcr_en_prefetch_results(docs, results):
+    _prefetch_scores(docs, results, "en")
+
+
+def vcr_zh_prefetch_results(docs, results):
+    _prefetch_scores(docs, results, "zh")
+
+
 def vcr_process_results_single(crossed_text, result, language):
     """
     Args:
@@ -95,85 +199,10 @@ def vcr_process_results_single(crossed_text, result, language):
     Returns:
         a dictionary with key: metric name (in this case vcr score), value: metric value
     """
-
-    assert language in ["en", "zh"], f"Language {language} is not supported."
-
-    if fast_filter(result):
-        return {
-            "crossed_text": crossed_text,
-            "max_sim_val": 0,
-            "max_sim_string": "",
-            "precision": 0,
-            "recall": 0,
-            "f1": 0,
-            "jaccard": 0,
-            "rouge1": 0,
-            "exact_match": 0,
-        }
-    tokens_result = tokenize(result, language)
-    tokens_crossed_text = tokenize(crossed_text, language)
-
-    splitter = " " if language == "en" else ""
-    ngrams_ = ngrams(tokens_result, len(tokens_crossed_text))
-    max_sim_val = 0
-    max_sim_string = ""
-    max_sim_ngram = []
-    tokens_crossed_text_set = set(tokens_crossed_text)
-    ngrams_hasjoint = [ngram for ngram in ngrams_ if not set(ngram).isdisjoint(tokens_crossed_text_set)]
-
-    for ngram in ngrams_hasjoint:
-        result_ngram = splitter.join(ngram)
-        similarity = SM(None, result_ngram, crossed_text).ratio()
-        if similarity > max_sim_val:
-            max_sim_val = similarity
-            max_sim_string = result_ngram
-            max_sim_ngram = ngram
-
-    # Evaluate
-    if len(max_sim_ngram) == 0:
-        return {
-            "crossed_text": crossed_text,
-            "max_sim_val": 0,
-            "max_sim_string": "",
-            "precision": 0,
-            "recall": 0,
-            "f1": 0,
-            "jaccard": 0,
-            "rouge1": 0,
-            "exact_match": 0,
-        }
-    pred_set = set(max_sim_ngram)
-    ref_set = set(tokens_crossed_text)
-    correct_tokens = pred_set.intersection(ref_set)
-    len_correct_tokens = len(correct_tokens)
-
-    precision = len_correct_tokens / len(pred_set)
-    recall = len_correct_tokens / len(ref_set)
-    if (precision + recall) == 0:
-        f1 = 0
-    else:
-        f1 = 2 * precision * recall / (precision + recall)
-    union = pred_set.union(ref_set)
-    jaccard = len_correct_tokens / len(union) if len(union) > 0 else 0
-    rouge_1 = rouge.compute(
-        predictions=[max_sim_string],
-        references=[crossed_text],
-        tokenizer=partial(tokenize, language=language),
-        rouge_types=["rouge1"],
-    )["rouge1"]
-    exact_match = float(list(max_sim_ngram) == list(tokens_crossed_text))
-    out = {
-        "crossed_text": crossed_text,
-        "max_sim_string": max_sim_string,
-        "max_sim_val": max_sim_val,
-        "precision": precision,
-        "recall": recall,
-        "f1": f1,
-        "jaccard": jaccard,
-        "rouge1": rouge_1,
-        "exact_match": exact_match,
-    }
-    return out
+    key = (crossed_text, result, language)
+    if key in prefetched_scores:
+        return prefetched_scores[key]
+    return vcr_score_batch([(crossed_text, result)], language)[0]
 
 
 def vcr_en_process_results(doc, results):
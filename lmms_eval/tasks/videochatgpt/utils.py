@@ -169,7 +169,7 @@ def videochatgpt_process_results_temporal(doc, result):
 
 
 # Process result for generation in consistency task
-def videochatgpt_process_results_consistency(doc, result, full_docs=None):
+def videochatgpt_process_results_consistency(doc, result):
     pred = result[0]
 
     # if it is question_1, then assign prediction for the 1st question
@@ -180,36 +180,27 @@ def videochatgpt_process_results_consistency(doc, result, full_docs=None):
         return {"gpt_eval_score_consistency": {"video_name": doc["video_name"], "Q2": doc["question_2"], "A": doc["answer"], "pred2": pred}}
 
 
+# Pair the predictions of the two questions about a video, the docs of a video are grouped by `doc_group_key: video_name`
+def videochatgpt_process_group_results_consistency(docs, results):
+    firsts, seconds = [], []
+    for i, (doc, result) in enumerate(zip(docs, results)):
+        entry = videochatgpt_process_results_consistency(doc, result)["gpt_eval_score_consistency"]
+        if "Q1" in entry:
+            firsts.append((i, entry))
+        else:
+            seconds.append((i, entry))
+    # a question without its counterpart is dropped
+    return [([i, j], {"gpt_eval_score_consistency": {**first, "Q2": second["Q2"], "pred2": second["pred2"]}}) for (i, first), (j, second) in zip(firsts, seconds)]
+
+
 def videochatgpt_aggregate_submissions_consistency(results, args, task):
     now_date_time = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
     submission_file_name = f"inference_results_videochatgpt_{task}_{now_date_time}.json"
     path = file_utils.generate_submission_file(submission_file_name, args)
 
-    combined_results = []
-    processed_indices = set()
-
-    # Iterate through results to find pairs in order to avoid multiprocessing bugs
-    for i in range(len(results)):
-        if i in processed_indices:
-            continue
-
-        first_dict = results[i]
-        video_name = first_dict.get("video_name")
-
-        for j in range(i + 1, len(results)):
-            if j in processed_indices:
-                continue
-
-            second_dict = results[j]
-            if video_name == second_dict.get("video_name"):
-                first_dict.update({"Q2": second_dict.get("Q2"), "pred2": second_dict.get("pred2")})
-                processed_indices.add(i)
-                processed_indices.add(j)
-                combined_results.append(first_dict)
-                break
-
+    # results are already paired by video in `videochatgpt_process_group_results_consistency`
     with open(path, "w") as f:
-        json.dump(combined_results, f, indent=4)
+        json.dump(results, f, indent=4)
 
     eval_logger.info(f"Submission file saved to {path}")
 
@@ -3,11 +3,11 @@ import os
 import json
 
 import datetime
-import statistics
+from collections import Counter
 
 import lmms_eval.tasks._task_utils.file_utils as file_utils
 
-from lmms_eval.tasks._task_utils.vqa_eval_metric import EvalAIAnswerProcessor
+from lmms_eval.tasks._task_utils.vqa_eval_metric import normalize_answer, normalize_punctuation_digit_article, prefetched_accuracy, vqa_accuracy
 
 
 from loguru import logger as eval_logger
@@ -17,33 +17,44 @@ def vqav2_doc_to_visual(doc):
     return [doc["image"].convert("RGB")]
 
 
+def _vqav2_answers(doc, result):
+    """Returns the normalized prediction and the ground-truth answers it is compared with."""
+    resAns = normalize_answer(result[0])
+    gtAnswers = [ansDic["answer"].replace("\n", " ").replace("\t", " ").strip() for ansDic in doc["answers"]]
+    # as in the official evaluation, answers are only normalized further when the annotators disagree
+    if len(set(gtAnswers)) > 1:
+        gtAnswers = [normalize_punctuation_digit_article(answer) for answer in gtAnswers]
+        resAns = normalize_punctuation_digit_article(resAns)
+    return resAns, gtAnswers
+
+
+def vqav2_prefetch_results(docs, results):
+    """Scores all predictions of the task with a single `vqa_accuracy` call."""
+    prefetched_accuracy.clear()
+    keys, predictions, counts = [], [], []
+    for doc, result in zip(docs, results):
+        if "answers" not in doc or doc["answers"] is None:
+            continue
+        resAns, gtAnswers = _vqav2_answers(doc, result)
+        keys.append((doc["question_id"], result[0]))
+        predictions.append(resAns)
+        counts.append(Counter(gtAnswers))
+    for key, resAns, accuracy in zip(keys, predictions, vqa_accuracy(predictions, counts).tolist()):
+        prefetched_accuracy[key] = (resAns, accuracy)
+
+
 def vqav2_process_results(doc, result):
-    eval_ai_processor = EvalAIAnswerProcessor()
     assert len(result) == 1, f"The result should be a list of length 1, but got {len(result)}."
-    resAns = eval_ai_processor(result[0])
+    resAns = normalize_answer(result[0])
     accuracy = 0
 
     if "answers" in doc and doc["answers"] is not None:
-        for ansDic in doc["answers"]:
-            ansDic["answer"] = ansDic["answer"].replace("\n", " ")
-            ansDic["answer"] = ansDic["answer"].replace("\t", " ")
-            ansDic["answer"] = ansDic["answer"].strip()
-        gtAcc = []
-        gtAnswers = [ans["answer"] for ans in doc["answers"]]
-
-        if len(set(gtAnswers)) > 1:
-            for ansDic in doc["answers"]:
-                ansDic["answer"] = eval_ai_processor.process_punctuation(ansDic["answer"])
-                ansDic["answer"] = eval_ai_processor.process_digit_article(ansDic["answer"])
-            resAns = eval_ai_processor.process_punctuation(resAns)
-            resAns = eval_ai_processor.process_digit_article(resAns)
-
-        for gtAnsDatum in doc["answers"]:
-            otherGTAns = [item for item in doc["answers"] if item != gtAnsDatum]
-            matchingAns = [item for item in otherGTAns if item["answer"] == resAns]
-            acc = min(1, float(len(matchingAns)) / 3)
-            gtAcc.append(acc)
-        accuracy = statistics.mean(gtAcc)
+        key = (doc["question_id"], result[0])
+        if key in prefetched_accuracy:
+            resAns, accuracy = prefetched_accuracy[key]
+        else:
+            resAns, gtAnswers = _vqav2_answers(doc, result)
+            accuracy = float(vqa_accuracy([resAns], [Counter(gtAnswers)])[0])
 
     return {
         "exact_match": accuracy,
@@ -1,4 +1,5 @@
 import re
+import functools
 import os
 import sys
 import datetime
@@ -233,6 +234,31 @@ def worldqa_doc_to_choice(doc):
     return [op.split(".")[1].strip() for op in doc["option"]]
 
 
+# Regex to extract multiple choice options from the question
+MULTIPLE_CHOICES_REGEX = re.compile(r"\b([A-Z])\.\s+([^\n]*)")
+# Punctuation removed from the responses before matching
+PUNCTUATION_REGEX = re.compile(r"[^\w\s]")
+
+
+@functools.lru_cache(maxsize=4096)
+def choice_regex(question):
+    """Returns the regex matching any of the choices listed in `question` and the mapping from choice text to letter, built once per question."""
+    fallback_regexes = []
+    choice_to_alpha = {}
+    next_alpha = "A"
+
+    # Build regex patterns and mappings for each choice
+    for m in MULTIPLE_CHOICES_REGEX.findall(question):
+        choice_text = m[1].strip()
+        fallback_regexes.append(f"{re.escape(choice_text)}")
+        choice_to_alpha[choice_text] = next_alpha
+
+        next_alpha = chr(ord(next_alpha) + 1)
+
+    # Compile regex to match any of the extracted choices
+    return re.compile("|".join(fallback_regexes)), choice_to_alpha
+
+
 class MultiChoiceRegexFilter(ExtendedRegexFilter):
     def __init__(self, *args, **kwargs):
         """
@@ -255,34 +281,17 @@ class MultiChoiceRegexFilter(ExtendedRegexFilter):
         filtered_resps = []
 
         for r, doc in zip(resps, docs):
-            fallback_regexes = []
-            choice_to_alpha = {}
-            next_alpha = "A"
-
             question = doc["question"]
             if "option" in doc:
                 for op in doc["option"]:
                     question += "\n" + op
-            # Regex to extract multiple choice options from the question
-            multiple_choices_regex = re.compile(r"\b([A-Z])\.\s+([^\n]*)")
-            matches = multiple_choices_regex.findall(question)
-
-            # Build regex patterns and mappings for each choice
-            for m in matches:
-                choice_text = m[1].strip()
-                fallback_regexes.append(f"{re.escape(choice_text)}")
-                choice_to_alpha[choice_text] = next_alpha
-
-                next_alpha = chr(ord(next_alpha) + 1)
-
-            # Compile regex to match any of the extracted choices
-            fallback_regex = re.compile("|".join(fallback_regexes))
+            fallback_regex, choice_to_alpha = choice_regex(question)
 
             # Process each response
             filtered = []
             for resp in r:
                 # Remove any punctuation and extra spaces
-                cleaned_resp = re.sub(r"[^\w\s]", "", resp).strip()
+                cleaned_resp = PUNCTUATION_REGEX.sub("", resp).strip()
                 # Try to match cleaned response with the choice text
                 match = fallback_regex.search(cleaned_resp)
                 if match and match.group() in choice_to_alpha:
@@ -489,6 +489,10 @@ def get_datetime_str(timezone="Asia/Singapore"):
     return local_time.strftime("%m%d_%H%M")
 
 
+# module path -> module, all the `!function` tags referencing a file share one import of it
+_function_modules = {}
+
+
 def import_function(loader, node):
     function_name = loader.construct_scalar(node)
     yaml_path = os.path.dirname(loader.name)
@@ -498,9 +502,12 @@ def import_function(loader, node):
         module_name = ".".join(module_name)
     module_path = os.path.normpath(os.path.join(yaml_path, "{}.py".format(module_name)))
 
-    spec = importlib.util.spec_from_file_location(module_name, module_path)
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
+    module = _function_modules.get(module_path)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(module_name, module_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _function_modules[module_path] = module
 
     function = getattr(module, function_name)
     return function
@@ -787,6 +794,24 @@ class Collator:
             batch = self.get_chunks(values, n=n, fn=batch_fn)
             yield from batch
 
+    def get_batched_adaptive(self, batcher, cost_fn: Callable) -> Iterator:
+        """
+        Generates and yields batches from the reordered array, sized by an `AdaptiveBatcher`.
+
+        The sorting function should sort by decreasing `cost_fn`, so that the first element of a batch is the one it is padded to.
+
+        Parameters:
+        - batcher (lmms_eval.api.batching.AdaptiveBatcher): Decides the size of each batch from the costs and the current token budget.
+        - cost_fn (Callable[[Any], float]): Text cost of an element, its text tokens plus its `max_new_tokens`.
+
+        Yields:
+        Iterator: An iterator over batches of reordered elements.
+        """
+        groups = self.arr_with_indices.values() if self.grouping else [self.arr_with_indices]
+        for values in groups:  # type: ignore
+            values = list(self._reorder(values))
+            yield from batcher.batches(values, [cost_fn(x) for x in values])
+
     def _reorder(self, arr: Union[List, Tuple[Tuple[int, Any], ...]]) -> List:
         """
         Reorders the elements in the array based on the sorting function.
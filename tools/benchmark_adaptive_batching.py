@@ -0,0 +1,134 @@
+"""Simulates the scheduling of generation requests on a GPU, with fixed batches and with `AdaptiveBatcher`.
+
+Runs on CPU: the device is a memory model (weights plus a cost per padded token, with some noise)
+and a time model (prefill proportional to the padded tokens, one decoding step per generated token
+of the longest answer of a batch). Requests mix short multiple-choice prompts with `max_new_tokens=16`
+and captioning prompts with `max_new_tokens=1024`, 0 to 4 images each, and 1 or 5 anyres tiles per
+image. A batch that does not fit raises a simulated OOM, its prefill time is lost and it is retried in
+halves, like `Llava._generate_with_oom_retry` does.
+
+    python tools/benchmark_adaptive_batching.py --num_requests 4000 --batch_sizes 1,8,32
+"""
+import argparse
+import random
+
+from lmms_eval.api.batching import AdaptiveBatcher
+
+TOKENS_PER_TILE = 576
+
+
+class SimulatedOOM(Exception):
+    pass
+
+
+class SimulatedDevice:
+    def __init__(self, total_memory=80e9, base_memory=16e9, bytes_per_token=0.5e6, noise=0.05, seed=0):
+        self.total_memory = total_memory
+        self.base_memory = base_memory
+        self.bytes_per_token = bytes_per_token
+        self.noise = noise
+        self.rnd = random.Random(seed)
+        self.time = 0.0
+        self.ooms = 0
+
+    def run(self, batch):
+        """Generates `batch`, returns its peak memory, raises SimulatedOOM when it does not fit."""
+        prompt = max(r["text_tokens"] + r["visual_tokens"] for r in batch)
+        new_tokens = max(r["max_new_tokens"] for r in batch)
+        padded = len(batch) * (prompt + new_tokens)
+        peak = self.base_memory + self.bytes_per_token * padded * (1 + self.rnd.uniform(0, self.noise))
+        prefill = 2e-5 * len(batch) * prompt
+        if peak > self.total_memory:
+            self.time += prefill
+            self.ooms += 1
+            raise SimulatedOOM
+        decode_steps = max(r["answer_tokens"] for r in batch)
+        self.time += prefill + decode_steps * (0.02 + 0.0005 * len(batch))
+        return peak
+
+
+def make_requests(num_requests, seed=0):
+    rnd = random.Random(seed)
+    requests = []
+    for _ in range(num_requests):
+        captioning = rnd.random() < 0.3
+        max_new_tokens = 1024 if captioning else 16
+        num_images = rnd.choice([0, 1, 1, 1, 2, 4])
+        tiles = sum(rnd.choice([1, 5]) for _ in range(num_images))
+        requests.append(
+            {
+                "text_tokens": int(rnd.lognormvariate(4.5, 0.8)),
+                "visual_tokens": tiles * TOKENS_PER_TILE,
+                "max_new_tokens": max_new_tokens,
+                "answer_tokens": rnd.randint(20, max_new_tokens) if captioning else rnd.randint(1, 4),
+            }
+        )
+    return requests
+
+
+def text_cost(r):
+    return r["text_tokens"] + r["max_new_tokens"]
+
+
+def grouped(requests):
+    # batches never mix generation kwargs, like `Collator(grouping=True)`
+    groups = {}
+    for r in requests:
+        groups.setdefault(r["max_new_tokens"], []).append(r)
+    return [sorted(group, key=lambda r: -text_cost(r)) for group in groups.values()]
+
+
+def run_with_retry(device, batch, batcher=None):
+    costs = [text_cost(r) + r["visual_tokens"] for r in batch]
+    try:
+        peak = device.run(batch)
+    except SimulatedOOM:
+        if len(batch) == 1:
+            raise
+        if batcher is not None:
+            batcher.on_oom(len(costs) * max(costs))
+        half = len(batch) // 2
+        run_with_retry(device, batch[:half], batcher)
+        run_with_retry(device, batch[half:], batcher)
+        return
+    if batcher is not None:
+        batcher.observe_memory(len(costs) * max(costs), peak, device.base_memory, device.total_memory)
+
+
+def simulate_fixed(requests, batch_size):
+    device = SimulatedDevice()
+    batches = sizes = 0
+    for group in grouped(requests):
+        for start in range(0, len(group), batch_size):
+            batch = group[start : start + batch_size]
+            run_with_retry(device, batch)
+            batches += 1
+            sizes += len(batch)
+    return device, sizes / batches
+
+
+def simulate_adaptive(requests, max_batch_size):
+    device = SimulatedDevice()
+    batcher = AdaptiveBatcher(max_batch_size=max_batch_size)
+    for group in grouped(requests):
+        for batch in batcher.batches(group, [text_cost(r) for r in group]):
+            # the visuals of a batch are only known once it is loaded
+            batcher.observe_visuals(len(batch), sum(r["visual_tokens"] for r in batch))
+            costs = [text_cost(r) + r["visual_tokens"] for r in batch]
+            for part in batcher.split(costs):
+                run_with_retry(device, batch[part], batcher)
+    return device, batcher.stats.mean_batch_size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_requests", type=int, default=4000)
+    parser.add_argument("--batch_sizes", type=str, default="1,8,32", help="Fixed batch sizes, and largest batch of the adaptive batcher.")
+    args = parser.parse_args()
+
+    requests = make_requests(args.num_requests)
+    print(f"{'scheduler':>18} {'time (s)':>10} {'req/s':>8} {'ooms':>6} {'mean batch':>11}")
+    for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+        for name, simulate in [(f"fixed {batch_size}", simulate_fixed), (f"adaptive <= {batch_size}", simulate_adaptive)]:
+            device, mean_batch = simulate(requests, batch_size)
+            print(f"{name:>18} {device.time:>10.1f} {len(requests) / device.time:>8.2f} {device.ooms:>6} {mean_batch:>11.2f}")
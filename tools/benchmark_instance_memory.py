@@ -0,0 +1,76 @@
+"""Measures the memory held by the requests of a task, as a list of `Instance` and as an `InstanceStore`.
+
+The requests are built like `ConfigurableTask.construct_requests` builds them, with a bound
+`doc_to_visual` method and the task's generation kwargs in every arguments tuple, then
+answered and filtered like `evaluator.evaluate` does. Memory is measured with `tracemalloc`,
+excluding the contexts, which are the same strings in both cases.
+
+    python tools/benchmark_instance_memory.py --sizes 100000,1000000 --num_choices 1
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from lmms_eval.api.instance import Instance, InstanceStore
+
+
+class BenchTask:
+    def __init__(self):
+        self.generation_kwargs = {"max_new_tokens": 16, "temperature": 0}
+
+    def doc_to_visual(self, doc):
+        return []
+
+    def construct_requests(self, doc_id, ctx, num_choices, split):
+        if num_choices == 1:
+            arguments = (ctx, self.generation_kwargs, self.doc_to_visual, doc_id, "bench_task", split)
+            return [Instance(request_type="generate_until", arguments=arguments, idx=0, metadata=("bench_task", doc_id, 1))]
+        return [
+            Instance(request_type="loglikelihood", arguments=(ctx, f" choice {i}", self.doc_to_visual, doc_id, "bench_task", split), idx=i, metadata=("bench_task", doc_id, 1))
+            for i in range(num_choices)
+        ]
+
+
+def build(num_docs, num_choices, contexts, compact):
+    task = BenchTask()
+    instances = InstanceStore("bench_task", "test", 1) if compact else []
+    for doc_id in range(num_docs):
+        for inst in task.construct_requests(doc_id, contexts[doc_id], num_choices, "test"):
+            instances.append(inst)
+    for inst in instances:
+        inst.resps.append("A")
+    for inst in instances:
+        inst.filtered_resps["none"] = inst.resps[0]
+    return instances
+
+
+def measure(num_docs, num_choices, compact):
+    contexts = [f"Question {doc_id}: which option is correct?" for doc_id in range(num_docs)]
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    instances = build(num_docs, num_choices, contexts, compact)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(instances) == num_docs * num_choices
+    return size, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_choices", type=int, default=1, help="1 builds generate_until requests, more builds loglikelihood requests")
+    parser.add_argument("--sizes", type=str, default="10000,100000,1000000")
+    args = parser.parse_args()
+
+    print(f"{'docs':>8} {'instances':>10} {'list (MB)':>10} {'store (MB)':>11} {'list B/inst':>12} {'store B/inst':>13} {'list (s)':>9} {'store (s)':>10}")
+    for num_docs in [int(x) for x in args.sizes.split(",")]:
+        num_instances = num_docs * args.num_choices
+        listed, listed_time = measure(num_docs, args.num_choices, compact=False)
+        stored, stored_time = measure(num_docs, args.num_choices, compact=True)
+        print(
+            f"{num_docs:>8} {num_instances:>10} {listed / 2**20:>10.1f} {stored / 2**20:>11.1f} {listed / num_instances:>12.0f} {stored / num_instances:>13.0f}"
+            f" {listed_time:>9.2f} {stored_time:>10.2f}"
+        )
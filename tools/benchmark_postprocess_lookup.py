@@ -0,0 +1,71 @@
+"""Times the per-document instance lookup done in `evaluator.evaluate` postprocessing.
+
+Compares the old `filter(lambda x: x.doc_id == doc_id, ...)` scan against the
+`doc_id -> instances` index built by `group_by_doc_id`, for growing task sizes.
+The indexed lookup should grow linearly with the number of documents.
+
+    python tools/benchmark_postprocess_lookup.py --num_choices 4 --sizes 1000,2000,4000,8000
+"""
+import argparse
+import random
+import time
+
+from lmms_eval.api.instance import Instance, group_by_doc_id
+
+
+def make_instances(num_docs, num_choices):
+    instances = [
+        Instance(
+            request_type="loglikelihood",
+            arguments=("context", f" choice {i}"),
+            idx=i,
+            metadata=("bench_task", doc_id, 1),
+        )
+        for doc_id in range(num_docs)
+        for i in range(num_choices)
+    ]
+    # model adapters hand responses back in arbitrary order
+    random.Random(1234).shuffle(instances)
+    return instances
+
+
+def postprocess_scan(instances, num_docs):
+    per_doc = []
+    for doc_id in range(num_docs):
+        requests = list(filter(lambda x: x.doc_id == doc_id, instances))
+        requests.sort(key=lambda x: x.idx)
+        per_doc.append(requests)
+    return per_doc
+
+
+def postprocess_indexed(instances, num_docs):
+    index = group_by_doc_id(instances)
+    per_doc = []
+    for doc_id in range(num_docs):
+        requests = index.get(doc_id, [])
+        per_doc.append(requests)
+    return per_doc
+
+
+def timeit(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_choices", type=int, default=4)
+    parser.add_argument("--sizes", type=str, default="1000,2000,4000,8000")
+    parser.add_argument("--skip_scan_above", type=int, default=8000, help="Skip the quadratic baseline for larger tasks.")
+    args = parser.parse_args()
+
+    print(f"{'docs':>8} {'instances':>10} {'scan (s)':>10} {'indexed (s)':>12} {'indexed us/doc':>15}")
+    for num_docs in [int(x) for x in args.sizes.split(",")]:
+        instances = make_instances(num_docs, args.num_choices)
+        indexed, indexed_requests = timeit(postprocess_indexed, instances, num_docs)
+        scan = float("nan")
+        if num_docs <= args.skip_scan_above:
+            scan, scan_requests = timeit(postprocess_scan, instances, num_docs)
+            assert scan_requests == indexed_requests, "the indexed lookup returned different requests than the scan"
+        print(f"{num_docs:>8} {len(instances):>10} {scan:>10.3f} {indexed:>12.4f} {indexed / num_docs * 1e6:>15.2f}")
@@ -0,0 +1,85 @@
+"""Runs `RequestEngine` against a local mock chat-completions server.
+
+The server answers OpenAI-style `/v1/chat/completions` requests after `--latency`
+seconds and fails a `--failure_rate` fraction of them with HTTP 429, so concurrency,
+rate limiting, retries and ordered reassembly can be checked without an API key.
+Each answer echoes the prompt, which lets the script verify that every result
+landed at the index of its request.
+
+    python tools/benchmark_request_engine.py --num_requests 200 --latency 0.2 --max_in_flight 1,8,32
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lmms_eval.api.request_engine import RequestEngine
+
+
+def make_handler(latency, failure_rate, seed):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class MockChatCompletionsHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latency)
+            with lock:
+                fail = rng.random() < failure_rate
+            if fail:
+                self.send_response(429)
+                self.end_headers()
+                return
+            prompt = payload["messages"][0]["content"][0]["text"]
+            body = json.dumps({"choices": [{"message": {"role": "assistant", "content": f"echo: {prompt}"}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockChatCompletionsHandler
+
+
+def start_server(latency, failure_rate, seed=1234):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(latency, failure_rate, seed))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--failure_rate", type=float, default=0.1)
+    parser.add_argument("--max_in_flight", type=str, default="1,8,32")
+    parser.add_argument("--requests_per_second", type=float, default=None)
+    args = parser.parse_args()
+
+    server, url = start_server(args.latency, args.failure_rate)
+
+    def send(payload):
+        request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read())["choices"][0]["message"]["content"]
+
+    payloads = [{"messages": [{"role": "user", "content": [{"type": "text", "text": f"question {i}"}]}]} for i in range(args.num_requests)]
+    for max_in_flight in [int(n) for n in args.max_in_flight.split(",")]:
+        engine = RequestEngine(max_in_flight=max_in_flight, requests_per_second=args.requests_per_second, max_retries=8, base_delay=0.05, max_delay=1.0)
+        start = time.perf_counter()
+        results = engine.run(send, payloads)
+        elapsed = time.perf_counter() - start
+        in_order = all(result == f"echo: question {i}" for i, result in enumerate(results))
+        print(f"max_in_flight={max_in_flight:>3}  requests={len(payloads)}  time={elapsed:.2f}s  in_order={in_order}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
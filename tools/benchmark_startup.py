@@ -0,0 +1,74 @@
+"""Measures the import cost of lmms_eval entry points.
+
+Every target runs in a fresh interpreter with `python -X importtime`, the script reports
+the wall time and the packages that account for most of the cumulative import time, so
+regressions in startup cost (e.g. a model module imported eagerly again) are easy to spot.
+`--output` appends the measurements as one JSON line, to track them across commits.
+
+    python tools/benchmark_startup.py --repeats 3 --output startup.jsonl
+"""
+import argparse
+import collections
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+TARGETS = {
+    "registry": [sys.executable, "-X", "importtime", "-c", "import lmms_eval.api.registry"],
+    "models": [sys.executable, "-X", "importtime", "-c", "import lmms_eval.models"],
+    "evaluator": [sys.executable, "-X", "importtime", "-c", "import lmms_eval.evaluator"],
+    "tasks_list": [sys.executable, "-X", "importtime", "-m", "lmms_eval", "--tasks", "list"],
+}
+
+
+def parse_importtime(stderr):
+    """Returns the import time in seconds spent in each top-level package, summed over its modules."""
+    per_package = collections.Counter()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = [part.strip() for part in line[len("import time:") :].split("|")]
+        per_package[name.split(".")[0]] += int(self_us) / 1e6
+    return per_package
+
+
+def measure(command):
+    start = time.perf_counter()
+    proc = subprocess.run(command, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        tail = "\n".join(line for line in proc.stderr.splitlines() if not line.startswith("import time:"))[-2000:]
+        raise RuntimeError(f"{' '.join(command)} failed:\n{tail}")
+    return elapsed, parse_importtime(proc.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--targets", type=str, default=",".join(TARGETS), help=f"comma separated subset of {', '.join(TARGETS)}")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    record = {"time": time.strftime("%Y-%m-%d %H:%M:%S")}
+    for target in args.targets.split(","):
+        timings, packages = [], collections.Counter()
+        for _ in range(args.repeats):
+            elapsed, per_package = measure(TARGETS[target])
+            timings.append(elapsed)
+            packages = per_package
+        wall = statistics.median(timings)
+        record[target] = {"wall_time": round(wall, 3), "top_packages": {name: round(t, 3) for name, t in packages.most_common(args.top)}}
+        print(f"{target:>12}: {wall:.2f}s (median of {args.repeats})")
+        for name, t in packages.most_common(args.top):
+            print(f"{'':>14}{name:<30}{t:.3f}s")
+
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Checks that shared-prefix scoring matches one full forward pass per continuation.
+
+`score_continuations_with_shared_prefix` (used by `Llava.loglikelihood` for multiple_choice
+tasks) encodes the prompt once and scores every choice from the cached `past_key_values`.
+This builds a tiny randomly initialised Llama on the CPU and compares its scores against
+`score_continuation`, the full forward pass `Llava._loglikelihood_one` runs for the requests
+that cannot share a prefix. Half of the choices are the greedy decoding of the prompt, so that
+`is_greedy` is checked both ways. It also times both paths.
+
+    python tools/check_prefix_cache_loglikelihood.py --num_choices 4 --prefix_len 512
+"""
+import argparse
+import time
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from lmms_eval.models.model_utils.prefix_cache import score_continuation, score_continuations_with_shared_prefix
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_choices", type=int, default=4)
+    parser.add_argument("--prefix_len", type=int, default=512)
+    parser.add_argument("--num_docs", type=int, default=8)
+    args = parser.parse_args()
+
+    torch.manual_seed(1234)
+    config = LlamaConfig(vocab_size=512, hidden_size=64, intermediate_size=128, num_hidden_layers=2, num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=args.prefix_len + 64)
+    model = LlamaForCausalLM(config).eval()
+
+    naive_time = cached_time = 0.0
+    for _ in range(args.num_docs):
+        prefix_ids = torch.randint(0, config.vocab_size, (1, args.prefix_len))
+        # choices of different lengths, so that the batched path has to pad, half of them greedy
+        continuation_ids = []
+        for i in range(args.num_choices):
+            length = int(torch.randint(1, 8, ()))
+            if i % 2 == 0:
+                continuation_ids.append(model.generate(prefix_ids, attention_mask=torch.ones_like(prefix_ids), do_sample=False, max_new_tokens=length, min_new_tokens=length)[0, prefix_ids.shape[1] :])
+            else:
+                continuation_ids.append(torch.randint(0, config.vocab_size, (length,)))
+
+        start = time.perf_counter()
+        expected = [score_continuation(model, torch.cat([prefix_ids[0], cont]).unsqueeze(0), prefix_ids.shape[1]) for cont in continuation_ids]
+        naive_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        scores = score_continuations_with_shared_prefix(model, prefix_ids, continuation_ids, batch_size=args.num_choices)
+        cached_time += time.perf_counter() - start
+
+        for i, ((loss, greedy), (expected_loss, expected_greedy)) in enumerate(zip(scores, expected)):
+            assert abs(loss - expected_loss) < 1e-4, f"{loss} != {expected_loss}"
+            assert greedy == expected_greedy, f"is_greedy {greedy} != {expected_greedy}"
+            if i % 2 == 0:
+                assert greedy, "the greedy decoding of the prompt is not scored as greedy"
+
+    print(f"scores match for {args.num_docs} docs x {args.num_choices} choices; naive {naive_time:.3f}s, shared prefix {cached_time:.3f}s")
+
+
+if __name__ == "__main__":
+    main()